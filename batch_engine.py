@@ -0,0 +1,246 @@
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: solo lo necesita este motor
+    np = None
+
+from linker import link, classify, is_frame_bank, bank_type, FRAME_BANKS, LinkedFrame
+
+# ----- Motor por lotes (NumPy) -----
+# Corre un programa sobre N carriles a la vez, cada uno con sus propios valores iniciales de
+# globales (un barrido de parametros). Cada slot de memoria guarda un escalar de Python si vale
+# lo mismo en todos los carriles o un vector de NumPy si no, asi la aritmetica es una sola
+# operacion vectorizada por cuadruplo. Los carriles de un grupo comparten el ip: un GOTOF cuya
+# condicion no es igual en todo el grupo lo divide con mascaras en dos grupos que siguen por
+# separado (en el peor caso cada carril termina en su propio grupo).
+# Los enteros en vectores son int64; una suma, resta, producto o negacion que podria salirse de
+# int64 se repite sobre vectores de objetos (enteros de Python), asi el resultado es exacto como
+# en la VM en lugar de dar la vuelta. Las entradas se convierten al tipo declarado de su variable.
+
+INT_OPS = {'+', '-', '*'}  # operaciones de enteros que se pueden desbordar
+INT64_SAFE = 2.0 ** 62  # resultados estimados (en float) desde aqui se calculan como objetos
+DTYPES = {'int': 'int64', 'float': 'float64', 'bool': 'bool'}
+
+BINARY_OPS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+
+def _take(value, mask):
+    return value[mask] if isinstance(value, np.ndarray) else value
+
+
+def _is_int(value):
+    # Entero que puede dar la vuelta: vector int64 o escalar int (los vectores de objetos no)
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'iu'
+    return isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_))
+
+
+def _may_overflow(op, a, b):
+    # Estima el resultado en float64: si alguno se acerca a 2**63 (o no cabe ni en float) la
+    # operacion se hace con objetos
+    try:
+        estimate = BINARY_OPS[op](np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64))
+    except OverflowError:
+        return True
+    return bool(np.any(np.abs(estimate) >= INT64_SAFE))
+
+
+def _objects(value):
+    return value.astype(object) if isinstance(value, np.ndarray) else value
+
+
+def _lanes(name, values, tipo):
+    # Vector de la entrada con el tipo declarado de la variable
+    if tipo == 'int':
+        if not all(_is_int(v) for v in values):
+            raise ValueError(f"La variable '{name}' es int y recibe valores que no son enteros")
+        try:
+            return np.asarray(values, dtype=np.int64)
+        except OverflowError:
+            return np.asarray([int(v) for v in values], dtype=object)
+    return np.asarray(values, dtype=DTYPES[tipo])
+
+
+class LaneGroup:
+    # Carriles que avanzan juntos: sus indices, su ip, su memoria y su pila de llamadas
+    def __init__(self, lanes, ip, mem, current_frame, call_stack, next_frame=None):
+        self.lanes = lanes
+        self.ip = ip
+        self.mem = mem
+        self.current_frame = current_frame
+        self.call_stack = call_stack
+        self.next_frame = next_frame
+
+    def select(self, mask, ip):
+        # Grupo nuevo solo con los carriles de mask (vector bool sobre los carriles del grupo)
+        copies = {}
+
+        def copy_frame(frame):
+            if frame is None:
+                return None
+            if id(frame) not in copies:
+                stores = [[_take(v, mask) for v in store] for store in frame.stores]
+                copies[id(frame)] = LinkedFrame(frame.layout, stores, [stores[s] for s in frame.layout.bank_stores])
+            return copies[id(frame)]
+
+        current = copy_frame(self.current_frame)
+        mem = [bank if bank is None or is_frame_bank(i) else [_take(v, mask) for v in bank]
+               for i, bank in enumerate(self.mem)]
+        mem[FRAME_BANKS] = current.banks
+        stack = [(copy_frame(frame), ret_ip, dest) for frame, ret_ip, dest in self.call_stack]
+        return LaneGroup(self.lanes[mask], ip, mem, current, stack, copy_frame(self.next_frame))
+
+
+class BatchVirtualMachine:
+    # inputs: nombre de variable global -> secuencia con su valor inicial en cada carril
+    def __init__(self, cuadruplos, dir_funcs, constant_table, inputs):
+        if np is None:
+            raise RuntimeError("El motor por lotes requiere NumPy")
+        sizes = {len(values) for values in inputs.values()}
+        if len(sizes) != 1:
+            raise ValueError("Todas las entradas deben tener el mismo número de carriles")
+        self.lanes = sizes.pop()
+        self.program = link(cuadruplos, dir_funcs, constant_table)
+        self.outputs = [[] for _ in range(self.lanes)]
+        self.splits = 0  # veces que un GOTOF dividio un grupo
+
+        mem, main = self.program.new_memory()
+        global_vars = dir_funcs.get_funcs('global').var_table.table
+        for name, values in inputs.items():
+            var = global_vars.get(name)
+            if var is None:
+                raise ValueError(f"Variable global '{name}' no declarada")
+            bank, slot = classify(var.address)
+            mem[bank][slot] = _lanes(name, values, bank_type(bank))
+        self.groups = [LaneGroup(np.arange(self.lanes), 0, mem, main, [])]
+
+        self.handlers = {op: self._op_binary for op in BINARY_OPS}
+        self.handlers.update({
+            '=': self._op_assign,
+            'uminus': self._op_uminus,
+            'GOTO': self._op_goto,
+            'GOTOF': self._op_gotof,
+            'IMPRIME': self._op_imprime,
+            'ERA': self._op_era,
+            'PARAM': self._op_param,
+            'GOSUB': self._op_gosub,
+            'RETURN': self._op_return,
+            'ENDFUNC': self._op_endfunc,
+            'END': self._op_end,
+        })
+
+    def run(self):
+        # Corre los grupos hasta que todos terminan; regresa la salida de cada carril
+        code = self.program.code
+        handlers = self.handlers
+        while self.groups:
+            group = self.groups.pop()
+            ip = group.ip
+            while ip is not None and ip < len(code):
+                op, left, right, res = code[ip]
+                handler = handlers.get(op)
+                if handler is None:
+                    raise RuntimeError(f"Operación de cuádruplo no soportada: {op}")
+                ip = handler(group, ip, op, left, right, res)
+        return [''.join(out) for out in self.outputs]
+
+    # ------------------ Handlers ------------------
+    # Mismos operandos enlazados que el motor 'table', sobre la memoria del grupo
+    def _op_binary(self, g, ip, op, left, right, res):
+        mem = g.mem
+        a = mem[left[0]][left[1]]
+        b = mem[right[0]][right[1]]
+        if op == '/' and not np.all(b):
+            # Igual que la VM: dividir entre cero es error, no inf/nan
+            raise ZeroDivisionError("division by zero")
+        if (op in INT_OPS and (isinstance(a, np.ndarray) or isinstance(b, np.ndarray))
+                and _is_int(a) and _is_int(b) and _may_overflow(op, a, b)):
+            a, b = _objects(a), _objects(b)
+        mem[res[0]][res[1]] = BINARY_OPS[op](a, b)
+        return ip + 1
+
+    def _op_assign(self, g, ip, op, left, right, res):
+        g.mem[res[0]][res[1]] = g.mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_uminus(self, g, ip, op, left, right, res):
+        value = g.mem[left[0]][left[1]]
+        if isinstance(value, np.ndarray) and value.dtype.kind == 'i' and np.any(value == np.iinfo(value.dtype).min):
+            # -(-2**63) no cabe en int64
+            value = value.astype(object)
+        g.mem[res[0]][res[1]] = -value
+        return ip + 1
+
+    def _op_goto(self, g, ip, op, left, right, res):
+        return res
+
+    def _op_gotof(self, g, ip, op, left, right, res):
+        cond = g.mem[left[0]][left[1]]
+        if not isinstance(cond, np.ndarray):
+            return ip + 1 if cond else res
+        if cond.all():
+            return ip + 1
+        if not cond.any():
+            return res
+        # Divergencia: los carriles verdaderos siguen en ip+1 y los falsos saltan, por separado
+        mask = cond.astype(bool)
+        self.groups.append(g.select(~mask, res))
+        self.groups.append(g.select(mask, ip + 1))
+        self.splits += 1
+        return None
+
+    def _op_imprime(self, g, ip, op, left, right, res):
+        value = g.mem[res[0]][res[1]]
+        outputs = self.outputs
+        if isinstance(value, np.ndarray):
+            # tolist() regresa escalares de Python: se imprimen igual que en la VM
+            for lane, x in zip(g.lanes.tolist(), value.tolist()):
+                outputs[lane].append(str(x))
+        else:
+            text = str(value)
+            for lane in g.lanes.tolist():
+                outputs[lane].append(text)
+        return ip + 1
+
+    def _op_era(self, g, ip, op, left, right, res):
+        g.next_frame = res.new_frame()
+        return ip + 1
+
+    def _op_param(self, g, ip, op, left, right, res):
+        if g.next_frame is None:
+            raise RuntimeError("PARAM sin un ERA previo")
+        g.next_frame.banks[res[0]][res[1]] = g.mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_gosub(self, g, ip, op, left, right, res):
+        g.call_stack.append((g.current_frame, ip + 1, None))
+        if g.next_frame is None:
+            raise RuntimeError("GOSUB sin ERA previo")
+        g.current_frame = g.next_frame
+        g.mem[FRAME_BANKS] = g.current_frame.banks
+        g.next_frame = None
+        return res.start_quad
+
+    def _op_return(self, g, ip, op, left, right, res):
+        g.mem[left[0]][left[1]] = g.mem[res[0]][res[1]]
+        return ip + 1
+
+    def _op_endfunc(self, g, ip, op, left, right, res):
+        if not g.call_stack:
+            return None
+        g.current_frame, ret_ip, _ = g.call_stack.pop()
+        g.mem[FRAME_BANKS] = g.current_frame.banks
+        return ret_ip
+
+    def _op_end(self, g, ip, op, left, right, res):
+        for lane in g.lanes.tolist():
+            self.outputs[lane].append('\n')
+        return None
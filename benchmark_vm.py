@@ -0,0 +1,86 @@
+import io
+import sys
+import time
+from contextlib import redirect_stdout
+
+from tests_final import TESTS, compile_patito_program
+from virtual_machine import VirtualMachine
+from transpiler import PythonProgram
+from c_backend import CProgram
+
+
+# ===========================================================
+#  Benchmark de la VM: cuadruplos por segundo por motor
+# ===========================================================
+
+# Programas de tests_final usados para medir (factorial y recursion)
+BENCH_PROGRAMS = [
+    "Factorial en MAIN (iterativo)",
+    "Factorial en función iterativa",
+    "Factorial recursivo",
+    "Fibonacci recursivo",
+]
+
+MIN_TIME = 0.5  # segundos minimos de medicion por programa y motor
+
+
+def count_quads(cuadruplos, dir_funcs, constants, **options):
+    """Corre el programa una vez contando los cuadruplos despachados."""
+    vmachine = VirtualMachine(cuadruplos, dir_funcs, constants, **options)
+    counter = [0]
+
+    def counting(handler):
+        def wrapped(ip, left, right, res):
+            counter[0] += 1
+            return handler(ip, left, right, res)
+        return wrapped
+
+    vmachine.code = [(counting(h), l, r, res) for h, l, r, res in vmachine.code]
+    with redirect_stdout(io.StringIO()):
+        vmachine.run()
+    return counter[0]
+
+
+def time_engine(cuadruplos, dir_funcs, constants, engine):
+    """Tiempo promedio de run() (sin contar la carga) con el motor indicado ('python' = transpiler, 'c' = AOT)."""
+    runs = 0
+    elapsed = 0.0
+    sink = io.StringIO()
+    python_program = PythonProgram(cuadruplos, dir_funcs, constants) if engine == 'python' else None
+    if engine == 'c':
+        # Incluye arrancar el proceso del ejecutable
+        python_program = CProgram(cuadruplos, dir_funcs, constants)
+    while elapsed < MIN_TIME:
+        if python_program is None:
+            runner = VirtualMachine(cuadruplos, dir_funcs, constants, engine=engine)
+        else:
+            runner = python_program
+        with redirect_stdout(sink):
+            start = time.perf_counter()
+            runner.run()
+            elapsed += time.perf_counter() - start
+        runs += 1
+    return elapsed / runs
+
+
+def benchmark(engines=('switch', 'table', 'closure', 'python')):
+    # El primer motor es la base del speedup: 'switch' es el ciclo if/elif original, con los
+    # cuadruplos pasados a tuplas una vez por corrida (cuesta lo mismo que antes del QuadBuffer)
+    programs = dict(TESTS)
+    speedup = f"{engines[-1]}/{engines[0]}"
+    # q/s se mide en cuadruplos originales; 'dispatch' son los despachos con superinstrucciones
+    print(f"{'Programa':<34}{'quads':>9}{'dispatch':>10}" + "".join(f"{e + ' q/s':>16}" for e in engines)
+          + f"{speedup:>16}")
+    for name in BENCH_PROGRAMS:
+        cuadruplos, dir_funcs, constants = compile_patito_program(programs[name])
+        quads = count_quads(cuadruplos, dir_funcs, constants, superinstructions=False)
+        dispatched = count_quads(cuadruplos, dir_funcs, constants)
+
+        rates = [quads / time_engine(cuadruplos, dir_funcs, constants, e) for e in engines]
+        line = f"{name:<34}{quads:>9}{dispatched:>10}" + "".join(f"{r:>16,.0f}" for r in rates)
+        print(line + f"{rates[-1] / rates[0]:>15.2f}x")
+
+
+if __name__ == "__main__":
+    engines = tuple(sys.argv[1:]) or ('switch', 'table', 'closure', 'python')
+    benchmark(engines)
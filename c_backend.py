@@ -0,0 +1,451 @@
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+
+from linker import BANKS, link, quad_owners, bank_type, is_frame_bank, is_const_bank
+from verifier import verify, VerificationError
+from transpiler import basic_blocks
+from pgo import HOT_CALLS, BIAS
+from virtual_machine import VirtualMachine
+from output_sink import StreamSink
+
+# ----- Backend de C (AOT) -----
+# Traduce los cuadruplos enlazados a un archivo de C, lo compila con el cc del sistema a un
+# ejecutable y lo corre como subproceso. Cada funcion de Patito es una funcion de C con sus
+# locales y temporales como variables locales tipadas (int -> int64_t, float -> double,
+# bool -> int); las globales son variables estaticas y los saltos son goto a etiquetas.
+#
+# La salida tiene que ser la misma que la de VirtualMachine. Donde C no puede garantizarlo sin
+# pagar de mas en cada operacion, el programa se rinde: termina con codigo 3 sin escribir nada
+# y CProgram lo vuelve a correr en la VM, que da la salida (o el error) exactos. Se rinde con
+#   - enteros que se desbordan de int64 (en Python no tienen limite)
+#   - division entre cero, o division / comparacion mixta con enteros de mas de 53 bits
+#   - lectura de una global sin valor dentro de una funcion (en la VM vale None)
+#   - cualquier otra falla del proceso (por ejemplo recursion que agota la pila de C)
+# Los programas que no se pueden traducir (no pasan verify(), o un float que recibe un int y
+# lo imprimiria como int) y la falta de compilador tambien corren en la VM; fallback_reason
+# dice por que. Con pgo (un ProgramProfile de pgo.py) la traduccion sigue el perfil: inline y
+# cold en las funciones, bloques frios al final y __builtin_expect en los saltos sesgados.
+# Los ejecutables quedan en un cache del usuario (directorio 0o700); uno que no sea del
+# usuario o que otros puedan escribir no se corre: se vuelve a compilar en un mkdtemp().
+
+CFLAGS = ('-O2', '-std=c99', '-w')
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'patito_c')
+INLINE_QUADS = 40  # cuadruplos maximos de una funcion que se expande inline con perfil
+
+C_TYPES = {'int': 'int64_t', 'float': 'double', 'bool': 'int'}
+
+RUNTIME = r'''#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#define EXACT (INT64_C(1) << 53)
+
+static void bail(void) { _Exit(3); }
+
+static int64_t add_i(int64_t a, int64_t b) { int64_t r; if (__builtin_add_overflow(a, b, &r)) bail(); return r; }
+static int64_t sub_i(int64_t a, int64_t b) { int64_t r; if (__builtin_sub_overflow(a, b, &r)) bail(); return r; }
+static int64_t mul_i(int64_t a, int64_t b) { int64_t r; if (__builtin_mul_overflow(a, b, &r)) bail(); return r; }
+static int64_t neg_i(int64_t a) { if (a == INT64_MIN) bail(); return -a; }
+
+/* Entero convertido a double sin redondeo (para / entre enteros y comparaciones mixtas) */
+static double exact(int64_t a) { if (a > EXACT || a < -EXACT) bail(); return (double)a; }
+static double div_d(double a, double b) { if (b == 0.0) bail(); return a / b; }
+
+static void out_int(int64_t a) { printf("%lld", (long long)a); }
+static void out_bool(int a) { fputs(a ? "True" : "False", stdout); }
+
+/* repr() de un float de Python: los digitos mas cortos que regresan al mismo valor */
+static void out_float(double x) {
+    char buf[40], digits[20];
+    int p, n = 0, exp, decpt, i;
+    if (isnan(x)) { fputs("nan", stdout); return; }
+    if (isinf(x)) { fputs(x > 0 ? "inf" : "-inf", stdout); return; }
+    for (p = 0; p < 16; p++) {
+        snprintf(buf, sizeof buf, "%.*e", p, x);
+        if (strtod(buf, NULL) == x) break;
+    }
+    if (p == 16) snprintf(buf, sizeof buf, "%.16e", x);
+    char *s = buf;
+    if (*s == '-') { putchar('-'); s++; }
+    for (; *s != 'e'; s++) if (*s != '.') digits[n++] = *s;
+    exp = atoi(s + 1);
+    while (n > 1 && digits[n - 1] == '0') n--;
+    decpt = exp + 1;
+    if (decpt > -4 && decpt <= 16) {
+        if (decpt <= 0) {
+            fputs("0.", stdout);
+            for (i = 0; i < -decpt; i++) putchar('0');
+            fwrite(digits, 1, n, stdout);
+        } else if (decpt >= n) {
+            fwrite(digits, 1, n, stdout);
+            for (i = n; i < decpt; i++) putchar('0');
+            fputs(".0", stdout);
+        } else {
+            fwrite(digits, 1, decpt, stdout);
+            putchar('.');
+            fwrite(digits + decpt, 1, n - decpt, stdout);
+        }
+    } else {
+        putchar(digits[0]);
+        if (n > 1) { putchar('.'); fwrite(digits + 1, 1, n - 1, stdout); }
+        printf("e%c%02d", exp < 0 ? '-' : '+', exp < 0 ? -exp : exp);
+    }
+}
+'''
+
+
+class UnsupportedProgram(RuntimeError):
+    """El programa no se puede traducir a C con la misma salida que la VM."""
+    pass
+
+
+def func_name(name):
+    return f"pf_{name}"
+
+
+def c_string(text):
+    # Literal de C con los bytes utf-8 del texto
+    out = []
+    for byte in text.encode('utf-8'):
+        char = chr(byte)
+        if char in '"\\':
+            out.append('\\' + char)
+        elif 32 <= byte < 127 and char != '?':
+            out.append(char)
+        else:
+            out.append(f"\\{byte:03o}")
+    return '"' + ''.join(out) + '"'
+
+
+class _FunctionWriter:
+    # Genera el fuente de C de una funcion de Patito
+    def __init__(self, name, layout, indices, program, mem, checked_globals, pgo=None):
+        self.name = name
+        self.layout = layout
+        self.indices = indices
+        self.program = program
+        self.mem = mem
+        self.checked_globals = checked_globals  # globales que se marcan al escribirse
+        self.pgo = pgo
+        self.locals = {}  # nombre -> tipo de C
+        self.args = []  # variables con los argumentos de la llamada en curso
+        self.pending = None  # FrameLayout del ultimo ERA
+
+    # ------------------ Operandos ------------------
+    def type_of(self, operand):
+        bank, slot = operand
+        if is_const_bank(bank):
+            value = self.mem[bank][slot]
+            return 'letrero' if isinstance(value, str) else 'float' if isinstance(value, float) else 'int'
+        tipo = bank_type(bank)
+        if tipo not in C_TYPES:
+            raise UnsupportedProgram(f"variable de tipo {tipo}")
+        return tipo
+
+    def read(self, operand):
+        bank, slot = operand
+        if is_const_bank(bank):
+            value = self.mem[bank][slot]
+            if isinstance(value, float):
+                return value.hex()  # literal exacto
+            if isinstance(value, int):
+                if not -2 ** 63 < value < 2 ** 63:
+                    raise UnsupportedProgram(f"constante {value} fuera de int64")
+                return f"INT64_C({value})"
+            raise UnsupportedProgram("letrero fuera de IMPRIME")
+        name = self.var(operand)
+        if self.name != 'global' and not is_frame_bank(bank) and operand in self.checked_globals:
+            return f"(gs_{bank}_{slot} ? {name} : (bail(), {name}))"
+        return name
+
+    def var(self, operand):
+        bank, slot = operand
+        if is_frame_bank(bank):
+            name = f"f{bank}_{slot}"
+            self.locals[name] = C_TYPES[bank_type(bank)]
+            return name
+        return f"g{bank}_{slot}"
+
+    def write(self, operand, expression):
+        bank, slot = operand
+        line = f"{self.var(operand)} = {expression};"
+        if not is_frame_bank(bank) and operand in self.checked_globals:
+            line += f" gs_{bank}_{slot} = 1;"
+        return line
+
+    def store(self, dest, source):
+        # dest = source; un int en un float conservaria su tipo en la VM (se imprimiria como int)
+        if self.type_of(dest) == 'float' and self.type_of(source) == 'int':
+            raise UnsupportedProgram("un float recibe un valor int")
+        return self.write(dest, self.read(source))
+
+    # ------------------ Expresiones ------------------
+    def binary(self, op, left, right):
+        lt, rt = self.type_of(left), self.type_of(right)
+        if 'letrero' in (lt, rt):
+            if lt != rt or op not in ('==', '!=') or not (is_const_bank(left[0]) and is_const_bank(right[0])):
+                raise UnsupportedProgram("operación con letreros")
+            equal = self.mem[left[0]][left[1]] == self.mem[right[0]][right[1]]
+            return '1' if equal == (op == '==') else '0'
+        a, b = self.read(left), self.read(right)
+        if op in ('+', '-', '*'):
+            if lt == rt == 'int':
+                return f"{ {'+': 'add_i', '-': 'sub_i', '*': 'mul_i'}[op]}({a}, {b})"
+            return f"((double){a} {op} (double){b})"
+        if op == '/':
+            if lt == rt == 'int':
+                return f"div_d(exact({a}), exact({b}))"
+            return f"div_d((double){a}, (double){b})"
+        # Relacionales: comparacion mixta sin redondear el entero
+        if lt != rt and 'bool' not in (lt, rt):
+            a = f"exact({a})" if lt == 'int' else a
+            b = f"exact({b})" if rt == 'int' else b
+        return f"({a} {op} {b})"
+
+    def statements(self, i):
+        op, left, right, res = self.program.code[i]
+        if op in ('+', '-', '*', '/', '<', '>', '==', '!='):
+            return [self.write(res, self.binary(op, left, right))]
+        if op == '=':
+            return [self.store(res, left)]
+        if op == 'uminus':
+            expression = f"neg_i({self.read(left)})" if self.type_of(left) == 'int' else f"(-{self.read(left)})"
+            return [self.write(res, expression)]
+        if op == 'IMPRIME':
+            tipo = self.type_of(res)
+            if tipo == 'letrero':
+                return [f"fputs({c_string(str(self.mem[res[0]][res[1]]))}, stdout);"]
+            return [f"out_{tipo}({self.read(res)});"]
+        if op == 'ERA':
+            self.args = []
+            return []
+        if op == 'PARAM':
+            # Los argumentos se evaluan en orden en variables propias y se pasan en el GOSUB
+            callee = self.pending
+            k = len(self.args)
+            param = callee.params[k]
+            if bank_type(param[0]) == 'float' and self.type_of(left) == 'int':
+                raise UnsupportedProgram("un parámetro float recibe un valor int")
+            name = f"a{callee.index}_{k}"
+            self.locals[name] = C_TYPES[bank_type(param[0])]
+            self.args.append(name)
+            return [f"{name} = {self.read(left)};"]
+        if op == 'GOSUB':
+            call = f"{func_name(res.name)}({', '.join(self.args)});"
+            self.args = []
+            return [call]
+        if op == 'RETURN':
+            # RETURN solo deja el valor en el return_address; el control sigue hasta ENDFUNC
+            return [self.store(left, res)]
+        if op == 'GOTO':
+            return [f"goto q{res};"]
+        if op == 'GOTOF':
+            ratio = self.pgo.taken_ratio(i) if self.pgo is not None else None
+            if ratio is not None and (ratio >= BIAS or ratio <= 1 - BIAS):
+                return [f"if (__builtin_expect(!{self.read(left)}, {int(ratio >= BIAS)})) goto q{res};"]
+            return [f"if (!{self.read(left)}) goto q{res};"]
+        if op == 'ENDFUNC':
+            return ["return;"]
+        if op == 'END':
+            return ["putchar('\\n');", "return;"]
+        raise UnsupportedProgram(f"operación {op}")
+
+    def source(self, attributes=''):
+        # Cuerpo por bloques basicos; con perfil, los bloques que nunca corrieron van al final
+        code = self.program.code
+        lines = {}
+        for i in self.indices:
+            if code[i][0] == 'ERA':
+                self.pending = code[i][3]
+            lines[i] = self.statements(i)
+        blocks = basic_blocks(self.indices, code)
+        if self.pgo is not None:
+            cold = [b for b in blocks[1:] if not self.pgo.counts[b[0]]]
+            blocks = [b for b in blocks if b not in cold] + cold
+
+        body = []
+        for n, (leader, block) in enumerate(blocks):
+            body.append(f"q{leader}:;")
+            for i in block:
+                body.extend(f"    {line}" for line in lines[i])
+            last = block[-1]
+            if code[last][0] not in ('GOTO', 'ENDFUNC', 'END'):
+                # El bloque cae al siguiente cuadruplo: si no quedo despues, se salta a el
+                following = blocks[n + 1][0] if n + 1 < len(blocks) else None
+                if last + 1 != following:
+                    body.append(f"    goto q{last + 1};" if last + 1 in lines else "    return;")
+        # Saltos al final del programa (despues del ultimo cuadruplo)
+        targets = {code[i][3] for i in self.indices if code[i][0] in ('GOTO', 'GOTOF')}
+        past_end = sorted(targets - set(lines))
+        if past_end:
+            body.extend(f"q{target}:;" for target in past_end)
+            body.append("    return;")
+
+        params = [f"{C_TYPES[bank_type(p[0])]} f{p[0]}_{p[1]}" for p in self.layout.params]
+        param_names = {f"f{p[0]}_{p[1]}" for p in self.layout.params}
+        out = [f"{attributes}static void {func_name(self.name)}({', '.join(params) or 'void'}) {{"]
+        for name, ctype in sorted(self.locals.items()):
+            if name not in param_names:
+                out.append(f"    {ctype} {name} = 0;")
+        return "\n".join(out + body + ["}"]) + "\n"
+
+
+def function_attributes(name, indices, code, pgo):
+    # Con perfil: funciones calientes, pequeñas y sin llamadas se expanden en quien las llama y
+    # las que nunca se llamaron se compilan aparte como frias
+    if pgo is None or name == 'global':
+        return ''
+    calls = pgo.calls.get(name, 0)
+    if not calls:
+        return '__attribute__((cold, noinline)) '
+    leaf = not any(code[i][0] == 'GOSUB' for i in indices)
+    if calls >= HOT_CALLS and leaf and len(indices) <= INLINE_QUADS:
+        return '__attribute__((always_inline)) inline '
+    return ''
+
+
+def translate(cuadruplos, dir_funcs, constant_table, pgo=None):
+    # Regresa el fuente de C equivalente al programa; UnsupportedProgram si no se puede.
+    # pgo: ProgramProfile (pgo.py) que guia inlining, acomodo de bloques y saltos probables
+    if pgo is not None:
+        pgo.check(cuadruplos)
+    try:
+        verify(cuadruplos, dir_funcs, constant_table)
+    except VerificationError as e:
+        raise UnsupportedProgram(f"no pasa la verificación ({len(e.errors)} errores)")
+    program = link(cuadruplos, dir_funcs, constant_table)
+    mem, _ = program.new_memory()
+    owners = quad_owners(cuadruplos, dir_funcs)
+
+    # Globales leidas dentro de funciones: main no necesariamente las escribio antes
+    checked = set()
+    for i, (op, left, right, res) in enumerate(program.code):
+        if owners[i] != 'global':
+            operands = [left, right] if op not in ('IMPRIME', 'RETURN') else [res]
+            checked.update(o for o in operands if isinstance(o, tuple) and len(o) == 2
+                           and BANKS[o[0]][0] == 'global')
+
+    chunks = ["/* Generado por c_backend.py a partir de los cuadruplos de Patito */", RUNTIME]
+    for bank, size in program.global_sizes.items():
+        tipo = bank_type(bank)
+        if tipo not in C_TYPES:
+            raise UnsupportedProgram(f"global de tipo {tipo}")
+        for slot in range(size):
+            chunks.append(f"static {C_TYPES[tipo]} g{bank}_{slot} = 0;")
+            if (bank, slot) in checked:
+                chunks.append(f"static char gs_{bank}_{slot} = 0;")
+
+    functions = []
+    for name, layout in program.layouts.items():
+        if layout.start_quad is not None:
+            indices = [i for i in range(layout.start_quad, len(cuadruplos)) if owners[i] == name]
+            functions.append((name, layout, indices, function_attributes(name, indices, program.code, pgo)))
+    # Las funciones inline van primero: el compilador necesita su cuerpo antes de cada llamada
+    functions.sort(key=lambda f: 'always_inline' not in f[3])
+    for name, layout, _, attributes in functions:
+        params = [C_TYPES[bank_type(p[0])] for p in layout.params]
+        chunks.append(f"{attributes}static void {func_name(name)}({', '.join(params) or 'void'});")
+    for name, layout, indices, attributes in functions:
+        chunks.append(_FunctionWriter(name, layout, indices, program, mem, checked, pgo).source(attributes))
+
+    chunks.append("int main(void) {\n"
+                  "    static char buffer[1 << 16];\n"
+                  "    setvbuf(stdout, buffer, _IOFBF, sizeof buffer);\n"
+                  f"    {func_name('global')}();\n"
+                  "    return fflush(stdout) != 0;\n"
+                  "}")
+    return "\n".join(chunks) + "\n"
+
+
+def find_compiler(cc=None):
+    # Ruta del compilador: el cc pedido, o $CC o el del sistema; None si no hay
+    if cc is not None:
+        return shutil.which(cc)
+    for candidate in (os.environ.get('CC'), 'cc', 'gcc', 'clang'):
+        if candidate and shutil.which(candidate):
+            return shutil.which(candidate)
+    return None
+
+
+def trusted(path):
+    # True si path es del usuario actual y nadie mas puede escribirlo (sin seguir symlinks)
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return info.st_uid == os.getuid() and not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def build(source, cc, cache_dir=CACHE_DIR, flags=CFLAGS):
+    # Compila el fuente a un ejecutable (en cache por hash del fuente, compilador y banderas)
+    key = hashlib.sha256("\0".join([source, cc, *flags]).encode('utf-8')).hexdigest()[:24]
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    except OSError:
+        pass
+    if not trusted(cache_dir):
+        # Directorio ajeno o que otros pueden escribir: se compila aparte
+        cache_dir = tempfile.mkdtemp(prefix='patito_c-')
+    executable = os.path.join(cache_dir, f"patito_{key}")
+    if os.path.exists(executable):
+        if trusted(executable):
+            return executable
+        # Alguien mas pudo haberlo cambiado: no se corre, se compila de nuevo aparte
+        executable = os.path.join(tempfile.mkdtemp(prefix='patito_c-'), f"patito_{key}")
+    c_path = executable + ".c"
+    partial = f"{executable}.{os.getpid()}.tmp"
+    with open(c_path, 'w', encoding='utf-8') as f:
+        f.write(source)
+    result = subprocess.run([cc, *flags, '-o', partial, c_path, '-lm'], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{cc} falló: {result.stderr.strip()[:500]}")
+    os.replace(partial, executable)
+    return executable
+
+
+class CProgram:
+    # Programa de Patito compilado a un ejecutable nativo, con la VM como respaldo
+    def __init__(self, cuadruplos, dir_funcs, constant_table, cc=None, cache_dir=CACHE_DIR, flags=CFLAGS,
+                 pgo=None):
+        self.cuadruplos = cuadruplos
+        self.dir_funcs = dir_funcs
+        self.constant_table = constant_table
+        self.source = None
+        self.executable = None
+        self.fallback_reason = None  # por que corre en la VM (None si corre nativo)
+        try:
+            self.source = translate(cuadruplos, dir_funcs, constant_table, pgo)
+        except UnsupportedProgram as e:
+            self.fallback_reason = f"no se puede traducir a C: {e}"
+            return
+        compiler = find_compiler(cc)
+        if compiler is None:
+            self.fallback_reason = "no hay compilador de C"
+            return
+        try:
+            self.executable = build(self.source, compiler, cache_dir, flags)
+        except (OSError, RuntimeError) as e:
+            self.fallback_reason = f"no se pudo compilar: {e}"
+
+    @classmethod
+    def from_program(cls, program, **options):
+        return cls(program.cuadruplos, program.dir_funcs, program.constants, **options)
+
+    def run(self, output=None, **vm_options):
+        # Corre el ejecutable; si no hay, o si se rinde, corre el programa en la VM.
+        # Regresa True si corrio nativo; vm_options son las de VirtualMachine para el respaldo
+        output = output if output is not None else StreamSink()
+        if self.executable is not None:
+            result = subprocess.run([self.executable], capture_output=True)
+            if result.returncode == 0:
+                output.write(result.stdout.decode('utf-8'))
+                output.flush()
+                return True
+        VirtualMachine(self.cuadruplos, self.dir_funcs, self.constant_table, output=output, **vm_options).run()
+        return False
@@ -0,0 +1,325 @@
+from linker import FRAME_BANKS, FRAME_POOL_SIZE, is_frame_bank, is_const_bank, bank_type, split_moves
+
+# ----- Motor de closures -----
+# Cada cuadruplo enlazado se vuelve una funcion sin argumentos que ya tiene ligados sus
+# operandos (constantes como valores, bancos globales como objetos) y su siguiente ip.
+# El ciclo de ejecucion queda como: ip = code[ip]()
+
+BINARY_OPS = {
+    '+': '+',
+    '-': '-',
+    '*': '*',
+    '/': '/',
+    '<': '<',
+    '>': '>',
+    '==': '==',
+    '!=': '!=',
+}
+
+FUSED_BRANCHES = {
+    'GOTO_IF_NOT_LT': '<',
+    'GOTO_IF_NOT_GT': '>',
+    'GOTO_IF_NOT_EQ': '==',
+    'GOTO_IF_NOT_NE': '!=',
+}
+
+_makers = {}  # (plantilla, tipos de operandos) -> fabrica de closures
+
+
+def operand_kind(operand):
+    # 'k' constante (se liga el valor), 'g' banco fijo (se liga el banco), 'f' banco del frame activo
+    bank = operand[0]
+    if is_const_bank(bank):
+        return 'k'
+    if is_frame_bank(bank):
+        return 'f'
+    return 'g'
+
+
+def _prelude(name, kind):
+    # Lineas que ligan el operando al crear el closure
+    if kind == 'k':
+        return f"{name}_v = mem[{name}[0]][{name}[1]]"
+    if kind == 'g':
+        return f"{name}_b = mem[{name}[0]]; {name}_s = {name}[1]"
+    return f"{name}_b, {name}_s = {name}"
+
+
+def _access(name, kind):
+    # Expresion de lectura/escritura del operando dentro del closure
+    if kind == 'k':
+        return f"{name}_v"
+    if kind == 'g':
+        return f"{name}_b[{name}_s]"
+    return f"mem[{name}_b][{name}_s]"
+
+
+def _maker(template, kinds):
+    # Genera (una sola vez por combinacion) la fabrica de closures para la plantilla
+    key = (template, kinds)
+    maker = _makers.get(key)
+    if maker is None:
+        names = ('a', 'b', 'd')
+        preludes = [_prelude(n, k) for n, k in zip(names, kinds) if k is not None]
+        fields = {n.upper(): _access(n, k) for n, k in zip(names, kinds) if k is not None}
+        body = template.format(**fields)
+        source = "def maker(mem, a, b, d, nxt, target, out):\n"
+        source += "".join(f"    {line}\n" for line in preludes)
+        source += "    def step():\n"
+        source += "".join(f"        {line}\n" for line in body.split("\n"))
+        source += "    return step\n"
+        namespace = {}
+        exec(source, namespace)
+        maker = _makers[key] = namespace['maker']
+    return maker
+
+
+def _kinds(*operands):
+    return tuple(operand_kind(o) if o is not None else None for o in operands)
+
+
+def compile_closures(vm, linked_code):
+    # Traduce el codigo enlazado a una lista de closures (mas un centinela al final)
+    mem = vm.mem
+    code = []
+
+    out = vm.write_output
+
+    for ip, (op, left, right, res) in enumerate(linked_code):
+        nxt = ip + 1
+
+        if op in BINARY_OPS:
+            template = "{D} = {A} " + BINARY_OPS[op] + " {B}\nreturn nxt"
+            step = _maker(template, _kinds(left, right, res))(mem, left, right, res, nxt, None, out)
+
+        elif op in ('=', 'RETURN'):
+            # RETURN ya trae en left el return_address de la funcion
+            source = left if op == '=' else res
+            dest = res if op == '=' else left
+            step = _maker("{D} = {A}\nreturn nxt", _kinds(source, None, dest))(mem, source, None, dest, nxt, None, out)
+
+        elif op == 'uminus':
+            step = _maker("{D} = -{A}\nreturn nxt", _kinds(left, None, res))(mem, left, None, res, nxt, None, out)
+
+        elif op == 'GOTO' and vm.jit is not None and res <= ip:
+            # GOTO hacia atras: fin de un ciclo, lo cuenta el JIT
+            step = _back_edge(vm.jit, ip, res)
+
+        elif op == 'GOTO':
+            step = _maker("return target", (None, None, None))(mem, None, None, None, nxt, res, out)
+
+        elif op == 'GOTOF':
+            step = _maker("if {A}:\n    return nxt\nreturn target", _kinds(left, None, None))(mem, left, None, None, nxt, res, out)
+
+        elif op == 'IMPRIME':
+            typed_bool = vm.program.typed_bank(res[0]) and bank_type(res[0]) == 'bool'
+            template = "out(str(bool({A})))\nreturn nxt" if typed_bool else "out(str({A}))\nreturn nxt"
+            step = _maker(template, _kinds(res, None, None))(mem, res, None, None, nxt, None, out)
+
+        elif op == 'ERA':
+            step = _era(vm, res, nxt)
+
+        elif op == 'PARAM':
+            step = _param(vm, left, res, nxt)
+
+        elif op == 'GOSUB':
+            step = _gosub(vm, res, nxt)
+
+        elif op == 'ENDFUNC':
+            step = _endfunc(vm)
+
+        elif op == 'NOP':
+            step = _maker("return nxt", (None, None, None))(mem, None, None, None, nxt, None, out)
+
+        elif op in FUSED_BRANCHES:
+            # El cuadruplo siguiente es el NOP del GOTOF absorbido
+            template = "if {A} " + FUSED_BRANCHES[op] + " {B}:\n    return nxt\nreturn target"
+            step = _maker(template, _kinds(left, right, None))(mem, left, right, None, ip + 2, res, out)
+
+        elif op == 'CALL':
+            layout, resume = res
+            step = _call(vm, layout, left, right, resume)
+
+        elif op == 'TAILCALL':
+            step = _tailcall(vm, res, left)
+
+        elif op == 'END':
+            step = _end(vm)
+
+        else:
+            raise RuntimeError(f"Operación de cuádruplo no soportada: {op}")
+
+        code.append(step)
+
+    # Centinela: salir del final de la lista termina la ejecucion
+    code.append(_halt)
+    return code
+
+
+def _back_edge(jit, ip, header):
+    back_edge = jit.back_edge
+
+    def step():
+        return back_edge(ip, None, None, header)
+    return step
+
+
+# ------------------ Llamadas ------------------
+# El linker ya resolvio las funciones a su FrameLayout y los PARAM al slot del parametro
+def _era(vm, layout, nxt):
+    acquire = layout.acquire
+    pool = vm.frame_pools[layout.index]
+
+    def step():
+        vm.next_frame = acquire(pool)
+        return nxt
+    return step
+
+
+def _param(vm, left, param, nxt):
+    mem = vm.mem
+    lb, ls = left
+    pb, ps = param
+
+    if vm.unchecked:
+        # Programa verificado (ver verifier.py): siempre hay un ERA previo
+        if operand_kind(left) != 'f':
+            value_bank = mem[lb]
+
+            def step():
+                vm.next_frame.banks[pb][ps] = value_bank[ls]
+                return nxt
+            return step
+
+        def step():
+            vm.next_frame.banks[pb][ps] = mem[lb][ls]
+            return nxt
+        return step
+
+    if operand_kind(left) != 'f':
+        value_bank = mem[lb]
+
+        def step():
+            frame = vm.next_frame
+            if frame is None:
+                raise RuntimeError("PARAM sin un ERA previo")
+            frame.banks[pb][ps] = value_bank[ls]
+            return nxt
+        return step
+
+    def step():
+        frame = vm.next_frame
+        if frame is None:
+            raise RuntimeError("PARAM sin un ERA previo")
+        frame.banks[pb][ps] = mem[lb][ls]
+        return nxt
+    return step
+
+
+def _gosub(vm, layout, nxt):
+    mem = vm.mem
+    push = vm.call_stack.append
+    start = layout.start_quad
+
+    if vm.unchecked:
+        def step():
+            push((vm.current_frame, nxt, None))
+            frame = vm.current_frame = vm.next_frame
+            mem[FRAME_BANKS] = frame.banks
+            vm.next_frame = None
+            return start
+        return step
+
+    def step():
+        push((vm.current_frame, nxt, None))
+        frame = vm.next_frame
+        if frame is None:
+            raise RuntimeError("GOSUB sin ERA previo")
+        vm.current_frame = frame
+        mem[FRAME_BANKS] = frame.banks
+        vm.next_frame = None
+        return start
+    return step
+
+
+def _endfunc(vm):
+    mem = vm.mem
+    stack = vm.call_stack
+    pools = vm.frame_pools
+
+    def step():
+        if not stack:
+            return None
+        callee = vm.current_frame
+        frame, ret_ip, dest = stack.pop()
+        vm.current_frame = frame
+        mem[FRAME_BANKS] = frame.banks
+        layout = callee.layout
+        if dest is not None:
+            # CALL con destino: copia el valor de retorno al temporal del llamador
+            src = layout.return_slot
+            mem[dest[0]][dest[1]] = mem[src[0]][src[1]]
+        # El frame de la funcion que termina regresa a su pool
+        pool = pools[layout.index]
+        if len(pool) < FRAME_POOL_SIZE:
+            pool.append(callee)
+        return ret_ip
+    return step
+
+
+def _call(vm, layout, moves, dest, resume):
+    # Superinstruccion CALL: frame del pool, parametros, push y salto en un solo closure
+    mem = vm.mem
+    push = vm.call_stack.append
+    acquire = layout.acquire
+    pool = vm.frame_pools[layout.index]
+    start = layout.start_quad
+    moves, consts = split_moves(moves, mem)
+
+    def step():
+        frame = acquire(pool)
+        banks = frame.banks
+        for pb, ps, ab, slot in moves:
+            banks[pb][ps] = mem[ab][slot]
+        for pb, ps, value in consts:
+            banks[pb][ps] = value
+        push((vm.current_frame, resume, dest))
+        vm.current_frame = frame
+        mem[FRAME_BANKS] = banks
+        return start
+    return step
+
+
+def _tailcall(vm, layout, moves):
+    # Recursion de cola: lee los argumentos, limpia el frame actual y lo reutiliza
+    mem = vm.mem
+    reset = layout.reset
+    start = layout.start_quad
+    moves, consts = split_moves(moves, mem)
+    sources = [(ab, slot) for _, _, ab, slot in moves]
+    targets = [(pb, ps) for pb, ps, _, _ in moves]
+
+    def step():
+        values = [mem[ab][slot] for ab, slot in sources]
+        frame = vm.current_frame
+        reset(frame)
+        banks = frame.banks
+        for (pb, ps), value in zip(targets, values):
+            banks[pb][ps] = value
+        for pb, ps, value in consts:
+            banks[pb][ps] = value
+        return start
+    return step
+
+
+def _end(vm):
+    write = vm.write_output
+
+    def step():
+        write('\n')
+        return None
+    return step
+
+
+def _halt():
+    return None
@@ -0,0 +1,80 @@
+import threading
+import time
+
+# ----- Limites de recursos -----
+# VirtualMachine.run(max_quads=..., max_time=..., max_stack_depth=..., max_cells=..., cancel_token=...)
+# corre el programa por tandas de check_interval cuadruplos y revisa los limites entre tandas,
+# asi el costo por cuadruplo es solo el del ciclo. El limite de cuadruplos es exacto; tiempo,
+# pila, celdas y cancelacion se detectan a lo mas check_interval cuadruplos despues.
+
+
+class ResourceLimitExceeded(RuntimeError):
+    """El programa excedio un limite de recursos; trae el ip y la pila de llamadas del momento."""
+
+    def __init__(self, limit, message, ip, stack):
+        super().__init__(f"{message} (ip={ip})")
+        self.limit = limit  # 'quads', 'time', 'stack', 'cells' o 'cancel'
+        self.ip = ip
+        self.stack = stack  # [(funcion, ip)] de la llamada mas externa a la actual
+
+
+class ExecutionCancelled(ResourceLimitExceeded):
+    """La ejecucion se cancelo desde otro hilo con un CancellationToken."""
+    pass
+
+
+class CancellationToken:
+    # Bandera que otro hilo puede levantar para detener la VM en la siguiente revision
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+
+class ResourceGovernor:
+    # Limites de una ejecucion; None en un limite significa sin limite
+    def __init__(self, max_quads=None, max_time=None, max_stack_depth=None, max_cells=None,
+                 cancel_token=None, check_interval=4096):
+        if check_interval < 1:
+            raise ValueError("check_interval debe ser al menos 1")
+        self.max_quads = max_quads
+        self.max_time = max_time
+        self.max_stack_depth = max_stack_depth
+        self.max_cells = max_cells
+        self.cancel_token = cancel_token
+        self.check_interval = check_interval
+        self.retired = 0
+        self.deadline = None
+
+    def start(self):
+        self.retired = 0
+        self.deadline = time.monotonic() + self.max_time if self.max_time is not None else None
+
+    def next_slice(self, vm, ip):
+        # Cuantos cuadruplos se pueden correr antes de la siguiente revision
+        if self.max_quads is None:
+            return self.check_interval
+        remaining = self.max_quads - self.retired
+        if remaining <= 0:
+            raise self.error(vm, ip, 'quads', f"Se excedio el limite de {self.max_quads} cuadruplos")
+        return min(self.check_interval, remaining)
+
+    def check(self, vm, ip, retired):
+        self.retired += retired
+        if self.cancel_token is not None and self.cancel_token.cancelled:
+            raise self.error(vm, ip, 'cancel', "Ejecucion cancelada", ExecutionCancelled)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise self.error(vm, ip, 'time', f"Se excedio el limite de {self.max_time} segundos")
+        if self.max_stack_depth is not None and len(vm.call_stack) > self.max_stack_depth:
+            raise self.error(vm, ip, 'stack', f"Se excedio la profundidad de pila de {self.max_stack_depth}")
+        if self.max_cells is not None and vm.live_cells() > self.max_cells:
+            raise self.error(vm, ip, 'cells', f"Se excedio el limite de {self.max_cells} celdas de memoria")
+
+    def error(self, vm, ip, limit, message, cls=ResourceLimitExceeded):
+        vm.ip = ip
+        return cls(limit, message, ip, vm.stack_trace(ip))
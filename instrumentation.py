@@ -0,0 +1,90 @@
+import json
+
+# ----- Instrumentacion de la VM -----
+# Contadores opcionales (VirtualMachine(..., instrument=True)): ejecuciones por cuadruplo,
+# por opcode y por funcion (llamadas, cuadruplos retirados, tiempo inclusivo y exclusivo) y
+# cuantas veces salto cada salto condicional (para pgo.py).
+# El ciclo normal de la VM no cambia; con instrumentacion corre run_instrumented().
+
+
+class ExecutionProfile:
+    # Contadores de una ejecucion; ops, owners y lines (linea del fuente o None) vienen del
+    # codigo enlazado (uno por cuadruplo)
+    def __init__(self, engine, ops, owners, lines=None):
+        self.engine = engine
+        self.ops = ops
+        self.owners = owners
+        self.lines = lines if lines is not None else [None] * len(ops)
+        self.counts = [0] * len(ops)
+        self.taken = [0] * len(ops)  # veces que cada salto condicional salto a su destino
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.active = []  # [funcion, inicio, tiempo de hijos] de cada llamada abierta
+        self.depth = {}  # llamadas abiertas por funcion (la recursion no suma doble el inclusivo)
+        self.wall_time = 0.0
+
+    def enter(self, name, now):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.depth[name] = self.depth.get(name, 0) + 1
+        self.active.append([name, now, 0.0])
+
+    def leave(self, now):
+        name, start, children = self.active.pop()
+        elapsed = now - start
+        self.exclusive[name] = self.exclusive.get(name, 0.0) + elapsed - children
+        self.depth[name] -= 1
+        if self.depth[name] == 0:
+            self.inclusive[name] = self.inclusive.get(name, 0.0) + elapsed
+        if self.active:
+            self.active[-1][2] += elapsed
+
+    def tail_call(self, name):
+        # TAILCALL reutiliza el frame: cuenta como llamada pero el tiempo sigue en la misma entrada
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def finish(self, now):
+        # Cierra las llamadas abiertas (programa terminado o interrumpido por un error)
+        while self.active:
+            self.leave(now)
+
+    def to_dict(self):
+        opcodes = {}
+        functions = {}
+        quads = []
+        for ip, count in enumerate(self.counts):
+            if not count:
+                continue
+            op, owner = self.ops[ip], self.owners[ip]
+            opcodes[op] = opcodes.get(op, 0) + count
+            entry = {'ip': ip, 'op': op, 'function': owner, 'line': self.lines[ip], 'count': count}
+            if op == 'GOTOF' or op.startswith('GOTO_IF'):
+                entry['taken'] = self.taken[ip]
+            quads.append(entry)
+            functions.setdefault(owner, {'quads': 0})['quads'] += count
+
+        for name in set(functions) | set(self.calls):
+            entry = functions.setdefault(name, {'quads': 0})
+            entry['calls'] = self.calls.get(name, 0)
+            entry['inclusive_time'] = self.inclusive.get(name, 0.0)
+            entry['exclusive_time'] = self.exclusive.get(name, 0.0)
+
+        return {
+            'engine': self.engine,
+            'quads_retired': sum(self.counts),
+            'wall_time': self.wall_time,
+            'opcodes': dict(sorted(opcodes.items(), key=lambda item: -item[1])),
+            'functions': dict(sorted(functions.items(), key=lambda item: -item[1]['quads'])),
+            'quads': sorted(quads, key=lambda q: -q['count']),
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent, ensure_ascii=False)
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_json())
+
+    def hot_quads(self, n=10):
+        # Los n cuadruplos mas ejecutados: [(ip, op, funcion, veces)]
+        return [(q['ip'], q['op'], q['function'], q['count']) for q in self.to_dict()['quads'][:n]]
@@ -0,0 +1,349 @@
+from array import array
+
+from semantics import VirtualMemory
+
+# ----- Bancos de memoria -----
+# Cada par (segmento, tipo) de la tabla de bases de VirtualMemory se vuelve un banco.
+# Un operando enlazado es (banco, slot): el VM solo indexa, ya no clasifica direcciones.
+SEGMENT_SIZE = 1000  # direcciones reservadas por tipo dentro de cada segmento
+
+BANKS = []  # [(segmento, tipo, base)]
+for _segment, _types in VirtualMemory().memory.items():
+    for _tipo, _base in _types.items():
+        BANKS.append((_segment, _tipo, _base))
+
+BANK_OF_BASE = {base: i for i, (_, _, base) in enumerate(BANKS)}
+
+# Bancos que viven en el frame de cada llamada (locales y temporales), contiguos
+FRAME_BANK_IDS = [i for i, (segment, _, _) in enumerate(BANKS) if segment in ('local', 'temporal')]
+FRAME_BANKS = slice(FRAME_BANK_IDS[0], FRAME_BANK_IDS[-1] + 1)
+assert FRAME_BANK_IDS == list(range(FRAME_BANKS.start, FRAME_BANKS.stop))
+
+FRAME_POOL_SIZE = 64  # frames liberados que cada VM guarda por funcion para reutilizar
+
+# Tipo de cada operando por opcode: 'addr' direccion, 'jump' indice de cuadruplo,
+# 'func' funcion (se enlaza a su FrameLayout), 'param' etiqueta Pk, None sin operando
+OPERAND_KINDS = {
+    '=': ('addr', None, 'addr'),
+    '+': ('addr', 'addr', 'addr'),
+    '-': ('addr', 'addr', 'addr'),
+    '*': ('addr', 'addr', 'addr'),
+    '/': ('addr', 'addr', 'addr'),
+    '<': ('addr', 'addr', 'addr'),
+    '>': ('addr', 'addr', 'addr'),
+    '==': ('addr', 'addr', 'addr'),
+    '!=': ('addr', 'addr', 'addr'),
+    'uminus': ('addr', None, 'addr'),
+    'GOTO': (None, None, 'jump'),
+    'GOTOF': ('addr', None, 'jump'),
+    'IMPRIME': (None, None, 'addr'),
+    'ERA': (None, None, 'func'),
+    'PARAM': ('addr', None, 'param'),
+    'GOSUB': (None, None, 'func'),
+    'RETURN': (None, None, 'addr'),
+    'ENDFUNC': (None, None, None),
+    'END': (None, None, None),
+    # Superinstrucciones (ver optimizer.py); 'args' tupla de direcciones, 'call' funcion llamada
+    'NOP': (None, None, None),
+    'GOTO_IF_NOT_LT': ('addr', 'addr', 'jump'),
+    'GOTO_IF_NOT_GT': ('addr', 'addr', 'jump'),
+    'GOTO_IF_NOT_EQ': ('addr', 'addr', 'jump'),
+    'GOTO_IF_NOT_NE': ('addr', 'addr', 'jump'),
+    'CALL': ('args', 'addr', 'call'),
+    'TAILCALL': ('args', None, 'func'),
+}
+
+
+# Modos de memoria: 'list' guarda cualquier valor de Python (None si no se ha escrito),
+# 'typed' usa array('q') para int, array('d') para float y bytearray para bool en los bancos
+# del frame (locales y temporales). Un arreglo tipado no tiene None ni guarda un int como int,
+# asi que 'typed' solo acepta programas que pasan verifier.check_typed(): ningun local o
+# temporal se lee sin asignar y ningun int se guarda en un float. Las globales siguen en
+# listas: el verificador no sabe si main ya las escribio cuando una funcion las lee.
+MEMORY_MODES = ('list', 'typed')
+
+
+def new_bank(tipo, size, mode='list'):
+    # Crea un banco (o almacen de frame) vacio del tamaño dado segun el modo de memoria
+    if mode == 'list' or tipo not in ('int', 'float', 'bool'):
+        return [None] * size
+    if tipo == 'int':
+        return array('q', bytes(8 * size))
+    if tipo == 'float':
+        return array('d', bytes(8 * size))
+    return bytearray(size)
+
+
+def bank_type(bank):
+    return BANKS[bank][1]
+
+
+def classify(address):
+    # Regresa (banco, offset dentro del banco) para una direccion virtual
+    if not isinstance(address, int) or isinstance(address, bool):
+        raise RuntimeError(f"Invalid address: {address}")
+    bank = BANK_OF_BASE.get(address - address % SEGMENT_SIZE)
+    if bank is None:
+        raise RuntimeError(f"Invalid address: {address}")
+    return bank, address % SEGMENT_SIZE
+
+
+def is_frame_bank(bank):
+    return FRAME_BANKS.start <= bank < FRAME_BANKS.stop
+
+
+def is_const_bank(bank):
+    return BANKS[bank][0] == 'const'
+
+
+def split_moves(moves, mem):
+    # Separa los movimientos de argumentos de CALL/TAILCALL en (de variables, de constantes);
+    # los de constantes llevan el valor ya leido: (banco del frame, slot, valor)
+    var_moves = tuple(m for m in moves if not is_const_bank(m[2]))
+    const_moves = tuple((pb, ps, mem[ab][slot]) for pb, ps, ab, slot in moves if is_const_bank(ab))
+    return var_moves, const_moves
+
+
+class FrameLayout:
+    # Descriptor de frame de una funcion: tamaños por banco y slots rebasados
+    def __init__(self, func_info):
+        self.name = func_info.name
+        self.start_quad = func_info.start_quad
+        self.return_slot = None  # (banco, slot) global donde se deja el valor de retorno
+        self.params = []  # (banco, slot) de cada parametro en el frame de la funcion
+        self.base = {}  # banco local -> primer offset usado por la funcion
+        self.sizes = [0] * len(FRAME_BANK_IDS)
+        self.offsets = [0] * len(FRAME_BANK_IDS)  # inicio de cada banco dentro de su almacen
+        self.bank_stores = [0] * len(FRAME_BANK_IDS)  # almacen que usa cada banco
+        self.templates = None
+        self.index = None  # posicion del layout; indexa el pool de frames de cada VM
+
+    def reserve(self, bank, slot):
+        idx = bank - FRAME_BANKS.start
+        if slot >= self.sizes[idx]:
+            self.sizes[idx] = slot + 1
+
+    def freeze(self, mode):
+        # Empaca los bancos del frame en almacenes: en 'list' todos comparten una sola lista,
+        # en 'typed' hay un arreglo por tipo (locales y temporales del mismo tipo juntos)
+        stores = {}
+        for i, n in enumerate(self.sizes):
+            tipo = bank_type(FRAME_BANKS.start + i)
+            key = tipo if mode == 'typed' else 'list'
+            if key not in stores:
+                stores[key] = 0
+            self.offsets[i] = stores[key]
+            self.bank_stores[i] = list(stores).index(key)
+            stores[key] += n
+        self.templates = [new_bank(key, size, mode) for key, size in stores.items()]
+
+    def new_frame(self):
+        # Un frame son los almacenes copiados de la plantilla, vistos como bancos
+        stores = [t[:] for t in self.templates]
+        if len(stores) == 1:
+            return LinkedFrame(self, stores, stores * len(self.bank_stores))
+        return LinkedFrame(self, stores, [stores[s] for s in self.bank_stores])
+
+    def reset(self, frame):
+        # Deja el frame como recien creado, en su lugar (los bancos siguen siendo los mismos objetos)
+        for store, template in zip(frame.stores, self.templates):
+            store[:] = template
+
+    def acquire(self, pool):
+        # Reutiliza un registro de activacion del pool (limpio, como recien creado) o crea uno
+        if pool:
+            frame = pool.pop()
+            self.reset(frame)
+            return frame
+        return self.new_frame()
+
+    def __repr__(self):
+        return f"FrameLayout(name={self.name}, start_quad={self.start_quad}, sizes={self.sizes})"
+
+
+class LinkedFrame:
+    # Frame de ejecucion enlazado: los bancos locales y temporales del frame activo
+    __slots__ = ('layout', 'stores', 'banks')
+
+    def __init__(self, layout, stores, banks):
+        self.layout = layout
+        self.stores = stores  # almacenes reales (una lista, o un arreglo por tipo)
+        self.banks = banks  # banco del frame -> almacen que lo contiene
+
+    @property
+    def func_name(self):
+        return self.layout.name
+
+
+class LinkedProgram:
+    # Resultado del enlace: codigo con operandos resueltos y descriptores de memoria
+    def __init__(self, code, layouts, global_sizes, const_banks, memory='list'):
+        self.code = code  # [(op, left, right, res)]
+        self.layouts = layouts  # nombre de funcion -> FrameLayout
+        self.global_sizes = global_sizes  # tamaño de cada banco global
+        self.const_banks = const_banks  # banco -> lista de valores constantes
+        self.memory = memory  # modo de memoria de los bancos globales, locales y temporales
+        # Plantilla de la memoria global: cada VM copia los bancos en lugar de armarlos
+        self.global_templates = {bank: new_bank(bank_type(bank), size, 'list')
+                                 for bank, size in global_sizes.items()}
+
+    def typed_bank(self, bank):
+        # True si el banco vive en un arreglo tipado (un bool se guarda como 0/1)
+        return self.memory == 'typed' and is_frame_bank(bank)
+
+    def new_memory(self):
+        # Lista de bancos indexada por numero de banco, con el frame de main activo.
+        # Solo lee el LinkedProgram: varias VMs (de varios hilos) pueden compartir uno
+        mem = [None] * len(BANKS)
+        for bank, template in self.global_templates.items():
+            mem[bank] = template[:]
+        for bank, values in self.const_banks.items():
+            mem[bank] = values
+        main = self.layouts['global'].new_frame()
+        mem[FRAME_BANKS] = main.banks
+        return mem, main
+
+
+def quad_owners(cuadruplos, dir_funcs):
+    # Funcion duena de cada cuadruplo: cada funcion ocupa desde su start_quad hasta el siguiente
+    starts = sorted((f.start_quad, name) for name, f in dir_funcs.functions.items() if f.start_quad is not None)
+    owners = []
+    current = 'global'
+    pending = list(starts)
+    for i in range(len(cuadruplos)):
+        while pending and pending[0][0] <= i:
+            current = pending.pop(0)[1]
+        owners.append(current)
+    return owners
+
+
+def link(cuadruplos, dir_funcs, constant_table, memory='list'):
+    # Resuelve cada operando de los cuadruplos a (banco, slot) usando la tabla de bases
+    if memory not in MEMORY_MODES:
+        raise ValueError(f"Modo de memoria desconocido: {memory}")
+
+    layouts = {name: FrameLayout(f) for name, f in dir_funcs.functions.items()}
+    for index, layout in enumerate(layouts.values()):
+        layout.index = index
+    owners = quad_owners(cuadruplos, dir_funcs)
+    global_sizes = {i: 0 for i, (segment, _, _) in enumerate(BANKS) if segment == 'global'}
+
+    def reserve_global(bank, slot):
+        if slot >= global_sizes[bank]:
+            global_sizes[bank] = slot + 1
+
+    # Locales: cada funcion usa un rango contiguo por tipo, se rebasa al inicio de su rango
+    for name, func_info in dir_funcs.functions.items():
+        layout = layouts[name]
+        for var_info in func_info.var_table.table.values():
+            bank, offset = classify(var_info.address)
+            if bank in global_sizes:
+                reserve_global(bank, offset)
+            elif is_frame_bank(bank):
+                layout.base[bank] = min(layout.base.get(bank, offset), offset)
+
+        if func_info.return_address is not None:
+            bank, offset = classify(func_info.return_address)
+            reserve_global(bank, offset)
+            layout.return_slot = (bank, offset)
+
+    def resolve(address, layout):
+        bank, offset = classify(address)
+        if bank in global_sizes:
+            reserve_global(bank, offset)
+            return bank, offset
+        if is_frame_bank(bank):
+            slot = offset - layout.base.get(bank, 0)
+            if slot < 0:
+                raise RuntimeError(f"Invalid address: {address} en función '{layout.name}'")
+            layout.reserve(bank, slot)
+            return bank, slot + layout.offsets[bank - FRAME_BANKS.start]
+        if address not in constant_table:
+            raise RuntimeError(f"Invalid address: {address}")
+        return bank, offset
+
+    def descriptor(name, op):
+        callee = layouts.get(name)
+        if callee is None or (op != 'ERA' and callee.start_quad is None):
+            raise RuntimeError(f"GOSUB a función '{name}' sin start_quad")
+        return callee
+
+    def emit():
+        for name, func_info in dir_funcs.functions.items():
+            layout = layouts[name]
+            layout.params = [resolve(func_info.var_table.table[p].address, layout) for p in func_info.param_names]
+
+        code = []
+        pending = []  # layouts de los ERA cuyo GOSUB no ha llegado (los PARAM van al ultimo)
+        for i, q in enumerate(cuadruplos):
+            kinds = OPERAND_KINDS.get(q.op)
+            if kinds is None:
+                raise RuntimeError(f"Operación de cuádruplo no soportada: {q.op}")
+
+            layout = layouts[owners[i]]
+            operands = []
+            for kind, value in zip(kinds, (q.left_op, q.right_op, q.result)):
+                if kind == 'addr':
+                    if isinstance(value, str):
+                        # Copia del valor de retorno de una llamada: se lee de su return_address
+                        callee = layouts.get(value)
+                        if callee is None or callee.return_slot is None:
+                            raise RuntimeError(f"Intento de leer valor de retorno de '{value}' sin return_address")
+                        value = callee.return_slot
+                    elif value is not None:
+                        value = resolve(value, layout)
+                elif kind == 'func':
+                    # ERA/GOSUB apuntan directo al descriptor de la funcion
+                    value = descriptor(value, q.op)
+                elif kind == 'param':
+                    # PARAM Pk -> (banco dentro del frame, slot) del parametro en la funcion llamada
+                    idx = int(value[1:]) - 1
+                    if not pending or idx >= len(pending[-1].params):
+                        raise RuntimeError("PARAM sin un ERA previo")
+                    bank, slot = pending[-1].params[idx]
+                    value = (bank - FRAME_BANKS.start, slot)
+                elif kind == 'args':
+                    value = tuple(resolve(a, layout) for a in value)
+                elif kind == 'call':
+                    # CALL regresa al primer cuadruplo despues de los NOP que absorbio
+                    resume = i + 1
+                    while resume < len(cuadruplos) and cuadruplos[resume].op == 'NOP':
+                        resume += 1
+                    value = (descriptor(value, q.op), resume)
+                operands.append(value)
+
+            if q.op == 'ERA':
+                pending.append(operands[2])
+            elif q.op == 'GOSUB' and pending:
+                pending.pop()
+            elif q.op in ('CALL', 'TAILCALL'):
+                # Argumentos como movimientos (banco del frame, slot, banco origen, slot origen)
+                callee = operands[2][0] if q.op == 'CALL' else operands[2]
+                operands[0] = tuple((pb - FRAME_BANKS.start, ps, ab, slot)
+                                    for (pb, ps), (ab, slot) in zip(callee.params, operands[0]))
+
+            if q.op == 'RETURN':
+                # El destino del RETURN es fijo: el return_address de la funcion duena del cuadruplo
+                if layout.return_slot is None:
+                    raise RuntimeError(f"RETURN en función '{layout.name}' sin return_address")
+                operands[0] = layout.return_slot
+
+            code.append((q.op, operands[0], operands[1], operands[2]))
+        return code
+
+    # Primera pasada: dimensiona los frames; segunda: emite con los bancos ya empacados
+    emit()
+    for layout in layouts.values():
+        layout.freeze(memory)
+    code = emit()
+
+    # Constantes: un banco (lista) por tipo, indexado por offset
+    const_banks = {}
+    for address, value in constant_table.items():
+        bank, offset = classify(address)
+        values = const_banks.setdefault(bank, [])
+        if offset >= len(values):
+            values.extend([None] * (offset + 1 - len(values)))
+        values[offset] = value
+
+    return LinkedProgram(code, layouts, global_sizes, const_banks, memory)
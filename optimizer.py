@@ -0,0 +1,162 @@
+from quads import Quadruple
+from linker import quad_owners
+
+# ----- Superinstrucciones -----
+# Post-pase sobre la lista de cuadruplos que fusiona los patrones mas comunes del generador:
+#   relacional + GOTOF            ->  GOTO_IF_NOT_xx a, b, destino
+#   ERA, PARAM x N, GOSUB [, =]   ->  CALL (args), temporal, funcion
+# y un pase aparte de llamadas de cola (recursion en posicion de cola):
+#   ERA f, PARAM x N, GOSUB f [, = f, RETURN] dentro de f, seguido de ENDFUNC  ->  TAILCALL (args), -, f
+# Los indices de la lista no cambian: la superinstruccion ocupa el primer lugar del patron y
+# los cuadruplos absorbidos se vuelven NOP, asi ningun salto ni start_quad se tiene que mover.
+
+FUSED_BRANCHES = {
+    '<': 'GOTO_IF_NOT_LT',
+    '>': 'GOTO_IF_NOT_GT',
+    '==': 'GOTO_IF_NOT_EQ',
+    '!=': 'GOTO_IF_NOT_NE',
+}
+
+ARITHMETIC_OPS = {'+', '-', '*', '/', '<', '>', '==', '!=', 'uminus'}
+
+
+def jump_targets(cuadruplos, dir_funcs):
+    # Indices a los que se puede llegar por salto o llamada
+    targets = {q.result for q in cuadruplos if q.op in ('GOTO', 'GOTOF')}
+    targets.update(f.start_quad for f in dir_funcs.functions.values() if f.start_quad is not None)
+    return targets
+
+
+def reads(q):
+    # Direcciones que lee un cuadruplo
+    if q.op in ARITHMETIC_OPS:
+        return (q.left_op, q.right_op)
+    if q.op in ('=', 'GOTOF', 'PARAM'):
+        return (q.left_op,)
+    if q.op in ('IMPRIME', 'RETURN'):
+        return (q.result,)
+    if q.op in ('CALL', 'TAILCALL'):
+        return q.left_op
+    return ()
+
+
+def fuse_branches(code, targets, owners):
+    # relacional t = a op b seguido de GOTOF t -> GOTO_IF_NOT_op a, b, destino
+    readers = {}
+    for i, q in enumerate(code):
+        for address in reads(q):
+            readers.setdefault((owners[i], address), []).append(i)
+
+    for i in range(len(code) - 1):
+        q, nxt = code[i], code[i + 1]
+        if q.op not in FUSED_BRANCHES or nxt.op != 'GOTOF' or nxt.left_op != q.result:
+            continue
+        # El temporal de la condicion solo lo debe leer ese GOTOF
+        if i + 1 in targets or readers.get((owners[i], q.result)) != [i + 1]:
+            continue
+        code[i] = Quadruple(FUSED_BRANCHES[q.op], q.left_op, q.right_op, nxt.result)
+        code[i + 1] = Quadruple('NOP')
+
+
+def match_call(code, i, dir_funcs):
+    # Si en i empieza ERA f, (calculo de argumentos y PARAM)*, GOSUB f regresa
+    # (calculo, PARAMs, indice del GOSUB); si no, None
+    q = code[i]
+    if q.op != 'ERA':
+        return None
+
+    func = dir_funcs.get_funcs(q.result)
+    body, args = [], []
+    j = i + 1
+    # El calculo de argumentos no puede tener llamadas anidadas ni saltos
+    while j < len(code) and (code[j].op in ARITHMETIC_OPS or code[j].op == 'PARAM'):
+        if code[j].op == 'PARAM':
+            args.append(code[j])
+        else:
+            body.append(code[j])
+        j += 1
+
+    if (func is None or j >= len(code) or code[j].op != 'GOSUB' or code[j].result != q.result
+            or [p.result for p in args] != [f"P{k + 1}" for k in range(len(func.param_names))]):
+        return None
+    return body, args, j
+
+
+def reaches_endfunc(code, k):
+    # True si desde k solo hay GOTOs hasta un ENDFUNC (nada mas se ejecuta antes de regresar)
+    seen = set()
+    while k < len(code) and code[k].op == 'GOTO' and k not in seen:
+        seen.add(k)
+        k = code[k].result
+    return k < len(code) and code[k].op == 'ENDFUNC'
+
+
+def fuse_calls(code, targets, dir_funcs):
+    # ERA f, (calculo de argumentos y PARAM)*, GOSUB f [, = f -> t] -> calculo, CALL, NOP...
+    i = 0
+    while i < len(code):
+        q = code[i]
+        match = match_call(code, i, dir_funcs)
+        if match is None:
+            i += 1
+            continue
+        body, args, j = match
+
+        dest = None
+        end = j
+        if j + 1 < len(code) and code[j + 1].op == '=' and code[j + 1].left_op == q.result:
+            dest = code[j + 1].result
+            end = j + 1
+
+        if any(k in targets for k in range(i + 1, end + 1)):
+            i += 1
+            continue
+
+        call = Quadruple('CALL', tuple(p.left_op for p in args), dest, q.result)
+        region = body + [call]
+        region += [Quadruple('NOP')] * (end + 1 - i - len(region))
+        code[i:end + 1] = region
+        i = end + 1
+
+
+def eliminate_tail_calls(cuadruplos, dir_funcs):
+    # Llamada de una funcion a si misma cuyo resultado (si hay) solo se regresa y despues de la
+    # cual no se ejecuta nada hasta ENDFUNC -> TAILCALL, que reutiliza el frame actual y salta
+    # al inicio de la funcion sin tocar la pila de llamadas. Regresa una lista nueva.
+    # Solo recursion propia: el = f / RETURN que se omite copia el return_address sobre si mismo.
+    code = list(cuadruplos)
+    targets = jump_targets(code, dir_funcs)
+    owners = quad_owners(code, dir_funcs)
+    i = 0
+    while i < len(code):
+        q = code[i]
+        match = match_call(code, i, dir_funcs) if q.op == 'ERA' and q.result == owners[i] else None
+        if match is None:
+            i += 1
+            continue
+        body, args, j = match
+
+        end = j
+        if (j + 2 < len(code) and code[j + 1].op == '=' and code[j + 1].left_op == q.result
+                and code[j + 2].op == 'RETURN' and code[j + 2].result == code[j + 1].result):
+            end = j + 2
+
+        if not reaches_endfunc(code, end + 1) or any(k in targets for k in range(i + 1, end + 1)):
+            i += 1
+            continue
+
+        tail = Quadruple('TAILCALL', tuple(p.left_op for p in args), None, q.result)
+        region = body + [tail]
+        region += [Quadruple('NOP')] * (end + 1 - i - len(region))
+        code[i:end + 1] = region
+        i = end + 1
+    return code
+
+
+def fuse_superinstructions(cuadruplos, dir_funcs):
+    # Regresa una lista nueva con las superinstrucciones; la original no se modifica
+    code = list(cuadruplos)
+    targets = jump_targets(code, dir_funcs)
+    fuse_calls(code, targets, dir_funcs)
+    fuse_branches(code, targets, quad_owners(code, dir_funcs))
+    return code
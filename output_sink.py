@@ -0,0 +1,102 @@
+import os
+import sys
+
+# ----- Salidas para IMPRIME -----
+# La VM no llama print() por cada elemento: escribe texto a un sink que lo junta en un buffer
+# y lo vacia en bloque. Todos los sinks tienen write(text), flush() y close().
+
+
+class OutputLimitExceeded(RuntimeError):
+    """El programa escribio mas salida de la permitida por el sink."""
+    pass
+
+
+class OutputSink:
+    # Base: junta los textos y los entrega a _emit() en bloques de buffer_size caracteres
+    def __init__(self, buffer_size=8192, line_buffering=False):
+        self.buffer_size = buffer_size
+        self.line_buffering = line_buffering
+        self.pending = []
+        self.pending_size = 0
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.buffer_size or (self.line_buffering and '\n' in text):
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            data = ''.join(self.pending)
+            self.pending.clear()
+            self.pending_size = 0
+            self._emit(data)
+
+    def close(self):
+        self.flush()
+
+    def _emit(self, data):
+        raise NotImplementedError
+
+
+class StreamSink(OutputSink):
+    # Escribe a un stream de texto; sin stream usa sys.stdout del momento del flush
+    def __init__(self, stream=None, buffer_size=8192, line_buffering=False):
+        super().__init__(buffer_size, line_buffering)
+        self.stream = stream
+
+    def _emit(self, data):
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write(data)
+        stream.flush()
+
+
+class FileDescriptorSink(OutputSink):
+    # Escribe bytes directo a un descriptor de archivo con os.write (no lo cierra)
+    def __init__(self, fd, buffer_size=65536, line_buffering=False, encoding='utf-8'):
+        super().__init__(buffer_size, line_buffering)
+        self.fd = fd
+        self.encoding = encoding
+
+    def _emit(self, data):
+        view = memoryview(data.encode(self.encoding))
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+
+
+class BufferSink(OutputSink):
+    # Captura la salida en memoria; max_chars limita cuanto puede escribir el programa
+    def __init__(self, max_chars=None):
+        super().__init__(buffer_size=float('inf'))
+        self.max_chars = max_chars
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        self.size += len(text)
+        if self.max_chars is not None and self.size > self.max_chars:
+            raise OutputLimitExceeded(f"La salida excede el limite de {self.max_chars} caracteres")
+        self.chunks.append(text)
+
+    def flush(self):
+        # Compacta los pedazos para que getvalue() repetido sea barato
+        if len(self.chunks) > 1:
+            self.chunks[:] = [''.join(self.chunks)]
+
+    def getvalue(self):
+        self.flush()
+        return self.chunks[0] if self.chunks else ''
+
+    def take(self):
+        # Regresa lo capturado hasta ahora y lo quita del buffer (el limite sigue contando todo)
+        data = ''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+    def getbytes(self, encoding='utf-8'):
+        return self.getvalue().encode(encoding)
+
+    def clear(self):
+        self.chunks.clear()
+        self.size = 0
@@ -1,3 +1,5 @@
+import copy
+
 import ply.yacc as yacc
 from lex_patito import tokens, build_lexer
 from virtual_machine import VirtualMachine
@@ -16,6 +18,28 @@ current_func_call = None # FunctionInfo de la funcion que estoy llamando
 current_param_idx = 0 # Index de param actual (P1, P2, P3, ...)
 
 quad_manager = QuadManager() # para guardar las pilas y cuadruplos
+read_tokens = [None, None] # los dos ultimos tokens leidos por el parser (mapa de lineas)
+
+def next_token():
+    # Lee el siguiente token del lexer y lo recuerda para el mapa de lineas de los cuadruplos
+    tok = lexer.token()
+    if tok is not None:
+        read_tokens[0], read_tokens[1] = read_tokens[1], tok
+    return tok
+
+def source_position():
+    # (linea, columna) del ultimo token consumido; la columna empieza en 1. Si la reduccion
+    # necesito ver el siguiente token (estado sin reduccion por defecto), ese token todavia no
+    # es parte de la instruccion y la posicion es la del anterior
+    tok = read_tokens[1]
+    if parser.state not in parser.defaulted_states and read_tokens[0] is not None:
+        tok = read_tokens[0]
+    if tok is None:
+        return (0, 0)
+    line_start = lexer.lexdata.rfind('\n', 0, tok.lexpos) + 1
+    return tok.lineno, tok.lexpos - line_start + 1
+
+quad_manager.position = source_position
 
 # ----- Helper Functions -----
 
@@ -657,6 +681,42 @@ def p_error(p):
 
 parser = yacc.yacc()
 
+# ----- Compilacion -----
+def reset_compiler():
+    # Deja el estado global del compilador (pilas, cuadruplos, directorio, memoria) como nuevo
+    global current_function, current_func_call, current_param_idx
+    quad_manager.cuadruplos.clear()
+    quad_manager.pila_operandos.data.clear()
+    quad_manager.pila_tipos.data.clear()
+    quad_manager.pila_operadores.data.clear()
+    quad_manager.pila_saltos.data.clear()
+
+    for segment in vm.counters:
+        for tipo in vm.counters[segment]:
+            vm.counters[segment][tipo] = 0
+    for table in vm.const_tables.values():
+        table.clear()
+
+    dir_funcs.functions.clear()
+    dir_funcs.add_function("global", "nula")
+    current_function = None
+    current_func_call = None
+    current_param_idx = 0
+    read_tokens[:] = [None, None]
+    lexer.lineno = 1
+
+def compile_source(code):
+    # Compila un programa y regresa (cuadruplos, dir_funcs, constantes direccion -> valor).
+    # Los resultados son copias: la siguiente compilacion no los modifica
+    reset_compiler()
+    parser.parse(code, lexer=lexer, tokenfunc=next_token)
+
+    constant_table = {}
+    for table in vm.const_tables.values():
+        for value, address in table.items():
+            constant_table[address] = value
+    return quad_manager.cuadruplos.copy(), copy.deepcopy(dir_funcs), constant_table
+
 if __name__ == "__main__":
     data = """
 
@@ -692,7 +752,7 @@ if __name__ == "__main__":
 
     """
 
-    result = parser.parse(data, lexer=lexer)
+    result = parser.parse(data, lexer=lexer, tokenfunc=next_token)
 
     print("\nCuádruplos con direcciones:")
     quad_manager.print_cuadruplos()
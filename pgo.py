@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+
+from program import compile_program
+from quad_coverage import branch_targets
+from trace_jit import JIT_THRESHOLD
+from virtual_machine import VirtualMachine
+
+# ----- Optimizacion guiada por perfiles -----
+# record_profile() corre un programa con la VM instrumentada y guarda lo que paso en un archivo
+# de perfiles (JSON), bajo el hash del fuente: llamadas por funcion, ejecuciones por cuadruplo,
+# saltos tomados / no tomados de cada GOTOF y entradas / vueltas de cada ciclo (GOTO hacia
+# atras). Cada corrida nueva se suma a lo que ya habia, asi un programa que corre mucho tiempo
+# se puede volver a afinar con su propia carga. load_profile() regresa el perfil de un fuente.
+# Lo usan:
+#   - VirtualMachine(..., jit=True, pgo=perfil) y Program(..., pgo=perfil): los ciclos calientes
+#     se graban como traza en su primera vuelta en lugar de esperar JIT_THRESHOLD vueltas
+#   - CProgram(..., pgo=perfil): funciones calientes inline y frias fuera de linea, bloques
+#     que nunca corrieron al final de su funcion y saltos con su direccion probable
+# El despacho de la VM no depende de donde este cada cuadruplo: el acomodo de bloques y el
+# inlining solo se aplican en el backend de C.
+
+PROFILE_VERSION = 1
+HOT_TRIPS = 8  # vueltas promedio por entrada para considerar caliente un ciclo
+HOT_CALLS = 100  # llamadas para considerar caliente una funcion
+BIAS = 0.9  # fraccion de veces en una direccion para marcar un salto como predecible
+
+
+def source_hash(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+class ProgramProfile:
+    # Perfil acumulado de las corridas de un programa; los ip son de los cuadruplos originales
+    def __init__(self, source_hash, quads, runs=0, calls=None, counts=None, branches=None, loops=None):
+        self.source_hash = source_hash
+        self.quads = quads  # numero de cuadruplos del programa perfilado
+        self.runs = runs
+        self.calls = calls if calls is not None else {}  # funcion -> llamadas
+        self.counts = counts if counts is not None else [0] * quads  # ejecuciones por cuadruplo
+        self.branches = branches if branches is not None else {}  # ip del GOTOF -> [tomado, no tomado]
+        self.loops = loops if loops is not None else {}  # ip del GOTO hacia atras -> [entradas, vueltas]
+
+    @classmethod
+    def from_execution(cls, source_hash, vm):
+        # Perfil de una VM que ya corrio con instrument=True y sin superinstrucciones (cada
+        # cuadruplo cuenta por si mismo)
+        execution = vm.profile
+        if execution is None:
+            raise ValueError("La VM no corrió con instrument=True")
+        code = vm.program.code
+        counts = execution.counts[:len(code)]
+        # Los GOTOF que caen en el mismo cuadruplo por los dos lados no tienen direccion probable
+        targets = branch_targets(code)
+        branches = {}
+        loops = {}
+        for ip, (op, _, _, res) in enumerate(code):
+            if not counts[ip]:
+                continue
+            if targets[ip] is not None:
+                taken = execution.taken[ip]
+                branches[ip] = [taken, counts[ip] - taken]
+            elif op == 'GOTO' and res <= ip:
+                # El encabezado corre una vez por vuelta mas una por entrada (la que sale)
+                loops[ip] = [counts[res] - counts[ip], counts[ip]]
+        return cls(source_hash, len(code), 1, dict(execution.calls), counts, branches, loops)
+
+    def merge(self, other):
+        if other.source_hash != self.source_hash or other.quads != self.quads:
+            raise ValueError("Los perfiles son de programas distintos")
+        self.runs += other.runs
+        for name, calls in other.calls.items():
+            self.calls[name] = self.calls.get(name, 0) + calls
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        for table, theirs in ((self.branches, other.branches), (self.loops, other.loops)):
+            for ip, (a, b) in theirs.items():
+                mine = table.setdefault(ip, [0, 0])
+                mine[0] += a
+                mine[1] += b
+        return self
+
+    def check(self, cuadruplos):
+        if len(cuadruplos) != self.quads:
+            raise ValueError("El perfil no corresponde a estos cuadruplos")
+
+    # ------------------ Consultas ------------------
+    def taken_ratio(self, ip):
+        # Fraccion de veces que el GOTOF de ip salto; None si nunca corrio
+        taken, fallthrough = self.branches.get(ip, (0, 0))
+        total = taken + fallthrough
+        return taken / total if total else None
+
+    def trip_count(self, back_edge):
+        # Vueltas promedio por entrada del ciclo que cierra el GOTO de back_edge
+        entries, iterations = self.loops.get(back_edge, (0, 0))
+        return iterations / entries if entries else None
+
+    def hot_loops(self):
+        # GOTO hacia atras de los ciclos que vale la pena compilar en cuanto empiezan
+        return [ip for ip, (entries, iterations) in self.loops.items()
+                if iterations >= JIT_THRESHOLD and entries and iterations / entries >= HOT_TRIPS]
+
+    def hot_functions(self):
+        return [name for name, calls in self.calls.items() if name != 'global' and calls >= HOT_CALLS]
+
+    # ------------------ Archivo ------------------
+    def to_dict(self):
+        return {
+            'quads': self.quads,
+            'runs': self.runs,
+            'calls': self.calls,
+            'counts': self.counts,
+            'branches': {str(ip): v for ip, v in sorted(self.branches.items())},
+            'loops': {str(ip): v for ip, v in sorted(self.loops.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, source_hash, data):
+        return cls(source_hash, data['quads'], data['runs'], dict(data['calls']), list(data['counts']),
+                   {int(ip): list(v) for ip, v in data['branches'].items()},
+                   {int(ip): list(v) for ip, v in data['loops'].items()})
+
+    def __repr__(self):
+        return (f"ProgramProfile(source={self.source_hash[:12]}, runs={self.runs}, "
+                f"calls={self.calls}, loops={len(self.loops)})")
+
+
+def read_profiles(path):
+    # Hash del fuente -> datos del perfil; un archivo que no existe no tiene perfiles
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != PROFILE_VERSION:
+        raise ValueError(f"Versión de archivo de perfiles no soportada: {data.get('version')}")
+    return data['programs']
+
+
+def load_profile(path, source):
+    # Perfil guardado para este fuente, o None
+    data = read_profiles(path).get(source_hash(source))
+    return ProgramProfile.from_dict(source_hash(source), data) if data is not None else None
+
+
+def save_profile(path, profile):
+    # Suma el perfil al que ya estaba guardado para el mismo fuente; el archivo se reemplaza
+    # de una vez para no dejarlo a medias
+    programs = read_profiles(path)
+    data = programs.get(profile.source_hash)
+    if data is not None:
+        saved = ProgramProfile.from_dict(profile.source_hash, data)
+        if saved.quads == profile.quads:
+            profile = saved.merge(profile)
+    programs[profile.source_hash] = profile.to_dict()
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, 'w', encoding='utf-8') as f:
+        json.dump({'version': PROFILE_VERSION, 'programs': programs}, f)
+    os.replace(partial, path)
+    return profile
+
+
+def record_profile(source, path=None, engine='table', output=None):
+    # Corre el fuente instrumentado y regresa su perfil; con path lo suma al archivo de perfiles
+    program = compile_program(source)
+    vm = VirtualMachine.from_program(program, engine=engine, output=output, instrument=True,
+                                     superinstructions=False, tail_calls=False)
+    vm.run()
+    profile = ProgramProfile.from_execution(source_hash(source), vm)
+    if path is not None:
+        profile = save_profile(path, profile)
+    return profile
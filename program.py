@@ -0,0 +1,134 @@
+import mmap
+from types import MappingProxyType
+
+from program_image import encode_program, decode_program
+from quads import QuadBuffer
+from linker import link
+from optimizer import fuse_superinstructions, eliminate_tail_calls
+from verifier import verify, check_typed
+from virtual_machine import VirtualMachine
+
+# ----- Programa compilado -----
+# Lo que produce el compilador para la VM: cuadruplos, directorio de funciones y tabla de
+# constantes (direccion -> valor). Las constantes son parte del programa: nadie tiene que
+# reconstruirlas desde las tablas de la memoria virtual del compilador.
+# save() lo escribe como imagen (program_image) y load_program() la mapea con mmap: correr un
+# programa ya compilado no pasa por PLY y la carga no decodifica los cuadruplos uno por uno.
+# Program es la version lista para correr muchas veces: enlazada una sola vez y compartible.
+
+
+class CompiledProgram:
+    def __init__(self, cuadruplos, dir_funcs, constants):
+        self.cuadruplos = cuadruplos
+        self.dir_funcs = dir_funcs
+        self.constants = constants  # direccion -> valor
+
+    def __iter__(self):
+        # Permite desempacar como la tupla de antes: cuadruplos, dir_funcs, constantes = programa
+        return iter((self.cuadruplos, self.dir_funcs, self.constants))
+
+    def to_image(self):
+        return encode_program(self.cuadruplos, self.dir_funcs, self.constants)
+
+    @classmethod
+    def from_image(cls, data):
+        return cls(*decode_program(data))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_image())
+
+    def __repr__(self):
+        return (f"CompiledProgram(quads={len(self.cuadruplos)}, functions={list(self.dir_funcs.functions)}, "
+                f"constants={len(self.constants)})")
+
+
+def compile_program(source, path=None):
+    # Compila el fuente de Patito a un CompiledProgram; con path tambien escribe su imagen
+    from parser_patito import compile_source
+    program = CompiledProgram(*compile_source(source))
+    if path is not None:
+        program.save(path)
+    return program
+
+
+def load_program(path):
+    # Mapea la imagen del archivo en memoria; los cuadruplos se leen del mapa conforme se usan
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return CompiledProgram.from_image(data)
+
+
+class Program:
+    # Programa inmutable para correrlo muchas veces. Al crearlo se aplican una sola vez las
+    # pasadas de la VM (llamadas de cola, superinstrucciones, verificacion con unchecked=True) y
+    # el enlace, que deja la plantilla de la memoria global. Cada vm()/run() arma una VM nueva
+    # sobre ese codigo enlazado: solo copia la plantilla global y decodifica, y su estado
+    # (memoria, pila, salida, JIT, cobertura) es suyo. Nada de lo compartido se escribe al
+    # correr, asi que un mismo Program se puede usar desde varios hilos a la vez.
+    __slots__ = ('cuadruplos', 'dir_funcs', 'constants', 'linked', 'unchecked', 'pgo')
+
+    # Opciones de VirtualMachine que se fijan al crear el Program
+    LINK_OPTIONS = ('memory', 'superinstructions', 'tail_calls', 'unchecked', 'pgo')
+
+    def __init__(self, compiled, memory='list', superinstructions=True, tail_calls=True, unchecked=False,
+                 pgo=None):
+        cuadruplos, dir_funcs, constants = compiled
+        if not isinstance(cuadruplos, QuadBuffer):
+            cuadruplos = QuadBuffer.from_quads(cuadruplos)
+        cuadruplos = cuadruplos.frozen()
+        constants = MappingProxyType(dict(constants))
+        if pgo is not None:
+            # Perfil de corridas anteriores (pgo.py) para las VMs con jit=True
+            pgo.check(cuadruplos)
+        if memory == 'typed':
+            check_typed(cuadruplos, dir_funcs, constants)
+        elif unchecked:
+            verify(cuadruplos, dir_funcs, constants)
+
+        code = cuadruplos
+        if tail_calls:
+            code = eliminate_tail_calls(code, dir_funcs)
+        if superinstructions:
+            code = fuse_superinstructions(code, dir_funcs)
+        linked = link(code, dir_funcs, constants, memory)
+
+        for name, value in (('cuadruplos', cuadruplos), ('dir_funcs', dir_funcs), ('constants', constants),
+                            ('linked', linked), ('unchecked', unchecked), ('pgo', pgo)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Un Program es inmutable")
+
+    @classmethod
+    def from_source(cls, source, **options):
+        return cls(compile_program(source), **options)
+
+    @classmethod
+    def load(cls, path, **options):
+        return cls(load_program(path), **options)
+
+    def vm(self, engine='table', **options):
+        # VM nueva lista para correr; options son las del constructor de VirtualMachine
+        # (output, instrument, jit, coverage, ...) salvo LINK_OPTIONS
+        fixed = [name for name in self.LINK_OPTIONS if name in options]
+        if fixed:
+            raise ValueError(f"Opciones fijadas al crear el Program: {', '.join(fixed)}")
+        if engine == 'switch':
+            # El motor de referencia interpreta los cuadruplos originales, sin enlazar
+            return VirtualMachine(self.cuadruplos, self.dir_funcs, self.constants, engine='switch', **options)
+        return VirtualMachine(self.cuadruplos, self.dir_funcs, self.constants, engine=engine,
+                              unchecked=self.unchecked, linked=self.linked, pgo=self.pgo, **options)
+
+    def run(self, output=None, **options):
+        # Corre el programa desde el estado inicial y regresa la VM (salida, perfil, cobertura...)
+        vm = self.vm(output=output, **options)
+        vm.run()
+        return vm
+
+    def to_image(self):
+        return encode_program(self.cuadruplos, self.dir_funcs, self.constants)
+
+    def __repr__(self):
+        return (f"Program(quads={len(self.cuadruplos)}, functions={list(self.dir_funcs.functions)}, "
+                f"memory={self.linked.memory})")
@@ -0,0 +1,100 @@
+import json
+import struct
+import sys
+from array import array
+
+from quads import QuadBuffer
+from semantics import FuncDirectory, FunctionInfo, VariableInfo
+
+# ----- Imagen de programa -----
+# Un programa compilado (cuadruplos, directorio de funciones y tabla de constantes) en un formato
+# binario versionado, para guardarlo en un archivo o en memoria compartida y cargarlo sin volver
+# a compilar. Los cuadruplos van como los arreglos paralelos de QuadBuffer: al cargar no se arma
+# ningun objeto por cuadruplo, el QuadBuffer lee directo del buffer (bytes, mmap o memoryview).
+#
+#   cabecera    'PTOB', version (H), relleno (2), numero de cuadruplos (I), tamaño de metadatos (I)
+#   opcodes     un byte por cuadruplo (indice en la tabla de opcodes), relleno a multiplo de 8
+#   operandos   izquierdo, derecho y resultado: un entero de 64 bits (little-endian) por cuadruplo
+#   posiciones  linea y columna del fuente: un entero de 32 bits (little-endian) por cuadruplo
+#   metadatos   JSON utf-8: opcodes, cadenas de operandos, constantes y directorio de funciones
+# Los operandos usan la codificacion de QuadBuffer (enteros, -1 None, <= -2 cadenas).
+
+MAGIC = b'PTOB'
+IMAGE_VERSION = 3
+HEADER = struct.Struct('<4sH2xII')
+
+
+def encode_program(cuadruplos, dir_funcs, constant_table):
+    buffer = cuadruplos if isinstance(cuadruplos, QuadBuffer) else QuadBuffer.from_quads(cuadruplos)
+    n = len(buffer)
+    columns = [buffer.left, buffer.right, buffer.result, buffer.lines, buffer.columns]
+    if sys.byteorder != 'little':
+        columns = [array(code, column) for code, column in zip('qqqII', columns)]
+        for column in columns:
+            column.byteswap()
+
+    functions = []
+    for name, f in dir_funcs.functions.items():
+        variables = [[v.name, v.type, v.scope_level, v.kind, v.address] for v in f.var_table.table.values()]
+        functions.append([name, f.return_type, f.param_names, f.param_types, f.start_quad,
+                          f.return_address, variables])
+    meta = json.dumps({
+        'ops': buffer.ops,
+        'strings': buffer.strings,
+        'constants': sorted(constant_table.items()),
+        'functions': functions,
+    }).encode('utf-8')
+
+    out = [HEADER.pack(MAGIC, IMAGE_VERSION, n, len(meta)), bytes(buffer.opcodes), bytes(-n % 8)]
+    out += [column.tobytes() for column in columns]
+    out.append(meta)
+    return b''.join(out)
+
+
+def decode_program(data):
+    # Regresa (cuadruplos, dir_funcs, constantes); data puede ser bytes, un mmap o un memoryview.
+    # Los cuadruplos son un QuadBuffer (de solo lectura) sobre data, que sigue vivo mientras se usen
+    view = memoryview(data).cast('B')
+    if len(view) < HEADER.size:
+        raise ValueError("No es una imagen de programa de Patito")
+    magic, version, n, meta_size = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError("No es una imagen de programa de Patito")
+    if version != IMAGE_VERSION:
+        raise ValueError(f"Versión de imagen no soportada: {version}")
+
+    # Los tamaños de la cabecera se revisan antes de tomar cualquier columna del buffer
+    column_sizes = [array(code).itemsize * n for code in 'qqqII']
+    if HEADER.size + n + (-n % 8) + sum(column_sizes) + meta_size > len(view):
+        raise ValueError("Imagen de programa truncada")
+
+    pos = HEADER.size
+    opcodes = view[pos:pos + n]
+    pos += n + (-n % 8)
+    columns = []
+    for code, size in zip('qqqII', column_sizes):
+        column = view[pos:pos + size]
+        if sys.byteorder == 'little':
+            columns.append(column.cast(code))
+        else:
+            swapped = array(code, bytes(column))
+            swapped.byteswap()
+            columns.append(swapped)
+        pos += size
+    meta = json.loads(bytes(view[pos:pos + meta_size]).decode('utf-8'))
+
+    left, right, result, lines, positions = columns
+    cuadruplos = QuadBuffer(meta['ops'], opcodes, left, right, result, meta['strings'], lines, positions)
+    # El directorio se arma directo: add_function/add_variable volverian a pedir direcciones
+    dir_funcs = FuncDirectory()
+    for name, return_type, param_names, param_types, start_quad, return_address, variables in meta['functions']:
+        func = FunctionInfo(name, return_type)
+        func.param_names = list(param_names)
+        func.param_types = list(param_types)
+        func.start_quad = start_quad
+        func.return_address = return_address
+        for var_name, var_type, scope_level, kind, address in variables:
+            func.var_table.table[var_name] = VariableInfo(var_name, var_type, scope_level, kind, address)
+        dir_funcs.functions[name] = func
+    return cuadruplos, dir_funcs, {address: value for address, value in meta['constants']}
+
@@ -0,0 +1,201 @@
+import hashlib
+import struct
+
+from linker import quad_owners
+
+# ----- Cobertura de cuadruplos -----
+# VirtualMachine(..., coverage=True) registra que cuadruplos corrieron y hacia donde fue cada
+# GOTOF, en bitmaps preasignados (un bit por cuadruplo del programa original). Cada cuadruplo
+# empieza con una sonda en el codigo decodificado: la primera vez que corre marca su bit y se
+# reemplaza por su handler original, asi que despues de calentar la VM corre sin costo extra.
+# Las sondas de los saltos condicionales se quitan hasta ver las dos direcciones.
+# Los NOP que dejan las superinstrucciones se marcan junto con la superinstruccion que los
+# absorbio, y la direccion de un GOTO_IF_NOT_xx se guarda en el GOTOF original: mapas de la
+# misma fuente con o sin superinstrucciones se pueden combinar.
+# Un salto cuyo destino es el mismo cuadruplo al que seguiria no tiene dos direcciones
+# distinguibles: la primera vez que corre cuenta como cubierto hacia los dos lados.
+# No se combina con jit=True: los saltos dentro de una traza no pasarian por las sondas.
+#
+#   formato    'PVMC', version (H), numero de cuadruplos (I), huella del programa (32 bytes)
+#              y los tres bitmaps (cuadruplos, saltos tomados, saltos no tomados)
+
+MAGIC = b'PVMC'
+COVERAGE_VERSION = 1
+HEADER = struct.Struct('<4sH2xI32s')
+
+BRANCH_OPS = {'GOTOF', 'GOTO_IF_NOT_LT', 'GOTO_IF_NOT_GT', 'GOTO_IF_NOT_EQ', 'GOTO_IF_NOT_NE'}
+
+
+def branch_targets(linked):
+    # Destino de cada salto condicional del codigo enlazado; None en los demas cuadruplos y en
+    # los saltos que caen en el mismo cuadruplo al que seguirian (despues de sus NOP)
+    targets = []
+    for ip, (op, _, _, res) in enumerate(linked):
+        span = ip + 1
+        while span < len(linked) and linked[span][0] == 'NOP':
+            span += 1
+        targets.append(res if op in BRANCH_OPS and not ip < res <= span else None)
+    return targets
+
+
+def program_fingerprint(cuadruplos):
+    # Huella de los cuadruplos originales: los mapas solo se combinan si son del mismo programa
+    text = repr([(q.op, q.left_op, q.right_op, q.result) for q in cuadruplos])
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class CoverageMap:
+    def __init__(self, size, fingerprint):
+        self.size = size
+        self.fingerprint = fingerprint
+        nbytes = (size + 7) // 8
+        self.quads = bytearray(nbytes)
+        self.taken = bytearray(nbytes)  # GOTOF que salto (condicion falsa)
+        self.fallthrough = bytearray(nbytes)  # GOTOF que siguio al siguiente cuadruplo
+
+    @classmethod
+    def for_program(cls, cuadruplos):
+        return cls(len(cuadruplos), program_fingerprint(cuadruplos))
+
+    @staticmethod
+    def mark(bitmap, ip):
+        bitmap[ip >> 3] |= 1 << (ip & 7)
+
+    @staticmethod
+    def test(bitmap, ip):
+        return bool(bitmap[ip >> 3] & (1 << (ip & 7)))
+
+    def hit(self, ip):
+        return self.test(self.quads, ip)
+
+    def covered(self):
+        return sum(bin(byte).count('1') for byte in self.quads)
+
+    def merge(self, other):
+        # OR en su lugar con otro mapa del mismo programa
+        if other.size != self.size or other.fingerprint != self.fingerprint:
+            raise ValueError("Los mapas de cobertura son de programas distintos")
+        for name in ('quads', 'taken', 'fallthrough'):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            merged = int.from_bytes(mine, 'little') | int.from_bytes(theirs, 'little')
+            mine[:] = merged.to_bytes(len(mine), 'little')
+        return self
+
+    def __or__(self, other):
+        return CoverageMap.from_bytes(self.to_bytes()).merge(other)
+
+    def to_bytes(self):
+        return (HEADER.pack(MAGIC, COVERAGE_VERSION, self.size, self.fingerprint)
+                + bytes(self.quads) + bytes(self.taken) + bytes(self.fallthrough))
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError("No es un mapa de cobertura de la VM de Patito")
+        magic, version, size, fingerprint = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("No es un mapa de cobertura de la VM de Patito")
+        if version != COVERAGE_VERSION:
+            raise ValueError(f"Versión de mapa de cobertura no soportada: {version}")
+        coverage = cls(size, fingerprint)
+        nbytes = len(coverage.quads)
+        if len(data) != HEADER.size + 3 * nbytes:
+            raise ValueError("Mapa de cobertura truncado")
+        pos = HEADER.size
+        for bitmap in (coverage.quads, coverage.taken, coverage.fallthrough):
+            bitmap[:] = data[pos:pos + nbytes]
+            pos += nbytes
+        return coverage
+
+    def report(self, cuadruplos, dir_funcs):
+        # Funciones que nunca se llamaron y GOTOF que corrieron pero solo hacia un lado
+        if len(cuadruplos) != self.size:
+            raise ValueError("El mapa de cobertura no corresponde a estos cuadruplos")
+        owners = quad_owners(cuadruplos, dir_funcs)
+        positions = getattr(cuadruplos, 'position', None)
+
+        def line(ip):
+            position = positions(ip) if positions is not None else None
+            return position[0] if position is not None else None
+
+        dead = [name for name, f in dir_funcs.functions.items()
+                if name != 'global' and f.start_quad is not None and not self.hit(f.start_quad)]
+        cold = []
+        for ip, q in enumerate(cuadruplos):
+            if q.op != 'GOTOF' or not self.hit(ip):
+                continue
+            taken, fell = self.test(self.taken, ip), self.test(self.fallthrough, ip)
+            if not (taken and fell):
+                cold.append({'ip': ip, 'function': owners[ip], 'line': line(ip),
+                             'never': 'fallthrough' if taken else 'taken'})
+        return {
+            'quads': self.size,
+            'covered': self.covered(),
+            'dead_functions': dead,
+            'cold_branches': cold,
+        }
+
+
+def install_probes(vm, coverage):
+    # Pone una sonda en cada cuadruplo de vm.code ('table' o 'closure'); ver el comentario de arriba
+    linked = vm.program.code
+    code = vm.code
+    closures = vm.engine == 'closure'
+    quads = coverage.quads
+    mark = CoverageMap.mark
+    targets = branch_targets(linked)
+
+    for ip, (op, _, _, res) in enumerate(linked):
+        span = ip + 1
+        while span < len(linked) and linked[span][0] == 'NOP':
+            span += 1
+        if op in BRANCH_OPS:
+            site = ip + 1 if op != 'GOTOF' else ip
+            code[ip] = _branch_probe(code, ip, code[ip], closures, quads, coverage, site, targets[ip], span)
+        else:
+            code[ip] = _probe(code, ip, code[ip], closures, quads, mark, span)
+
+
+def _probe(code, ip, entry, closures, quads, mark, span):
+    def first_run():
+        code[ip] = entry
+        for i in range(ip, span):
+            mark(quads, i)
+
+    if closures:
+        def probe():
+            first_run()
+            return entry()
+        return probe
+
+    def probe(ip, left, right, res):
+        first_run()
+        return entry[0](ip, left, right, res)
+    return (probe,) + entry[1:]
+
+
+def _branch_probe(code, ip, entry, closures, quads, coverage, site, target, span):
+    # La sonda se queda hasta ver las dos direcciones del salto (target None: son la misma)
+    mark, test = CoverageMap.mark, CoverageMap.test
+    taken, fallthrough = coverage.taken, coverage.fallthrough
+
+    def record(nxt):
+        for i in range(ip, span):
+            mark(quads, i)
+        if target is None:
+            mark(taken, site)
+            mark(fallthrough, site)
+        else:
+            mark(taken if nxt == target else fallthrough, site)
+        if test(taken, site) and test(fallthrough, site):
+            code[ip] = entry
+        return nxt
+
+    if closures:
+        def probe():
+            return record(entry())
+        return probe
+
+    def probe(ip, left, right, res):
+        return record(entry[0](ip, left, right, res))
+    return (probe,) + entry[1:]
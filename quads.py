@@ -1,3 +1,5 @@
+from array import array
+
 from semantics import vm
 
 class EmptyStackError(Exception): # Detecta pops o tops de pilas vacias
@@ -41,6 +43,152 @@ class Quadruple:
         return f"({self.op}, {self.left_op}, {self.right_op}, {self.result})"    
     
 
+class QuadBuffer:
+    # Cuadruplos como arreglos paralelos: opcode (indice en ops) y los tres operandos como enteros.
+    # Operando: >= 0 entero (direccion o ip), -1 None, <= -2 la cadena -(n + 2) de strings
+    # (nombres de funcion y de parametro). buffer[i] regresa una vista con .op/.left_op/...
+    # lines y columns son el mapa al fuente: linea y columna (desde 1) de cada cuadruplo, 0 si no hay
+    def __init__(self, ops=None, opcodes=None, left=None, right=None, result=None, strings=None,
+                 lines=None, columns=None):
+        self.ops = ops if ops is not None else []
+        self.op_ids = {op: i for i, op in enumerate(self.ops)}
+        self.opcodes = opcodes if opcodes is not None else array('B')
+        self.left = left if left is not None else array('q')
+        self.right = right if right is not None else array('q')
+        self.result = result if result is not None else array('q')
+        self.strings = strings if strings is not None else []
+        self.string_ids = {s: i for i, s in enumerate(self.strings)}
+        self.lines = lines if lines is not None else array('I', bytes(4 * len(self.opcodes)))
+        self.columns = columns if columns is not None else array('I', bytes(4 * len(self.opcodes)))
+
+    @classmethod
+    def from_quads(cls, cuadruplos):
+        buffer = cls()
+        for q in cuadruplos:
+            buffer.append(q.op, q.left_op, q.right_op, q.result, *getattr(q, 'position', (0, 0)))
+        return buffer
+
+    def encode(self, value):
+        if value is None:
+            return -1
+        if isinstance(value, str):
+            if value not in self.string_ids:
+                self.string_ids[value] = len(self.strings)
+                self.strings.append(value)
+            return -2 - self.string_ids[value]
+        if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+            return value
+        raise ValueError(f"Operando no soportado en un cuadruplo: {value!r}")
+
+    def decode(self, value):
+        if value >= 0:
+            return value
+        if value == -1:
+            return None
+        return self.strings[-2 - value]
+
+    def append(self, op, left_op=None, right_op=None, result=None, line=0, column=0):
+        op_id = self.op_ids.get(op)
+        if op_id is None:
+            if len(self.ops) == 256:
+                raise ValueError("Demasiados opcodes distintos para un QuadBuffer")
+            op_id = self.op_ids[op] = len(self.ops)
+            self.ops.append(op)
+        self.opcodes.append(op_id)
+        self.left.append(self.encode(left_op))
+        self.right.append(self.encode(right_op))
+        self.result.append(self.encode(result))
+        self.lines.append(line)
+        self.columns.append(column)
+        return len(self.opcodes) - 1
+
+    def set_result(self, index, result):
+        self.result[index] = self.encode(result)
+
+    def quad(self, index):
+        # (op, izquierdo, derecho, resultado) ya decodificados
+        decode = self.decode
+        return (self.ops[self.opcodes[index]], decode(self.left[index]),
+                decode(self.right[index]), decode(self.result[index]))
+
+    def position(self, index):
+        # (linea, columna) del fuente que genero el cuadruplo, None si no se conoce
+        if not self.lines[index]:
+            return None
+        return self.lines[index], self.columns[index]
+
+    def copy(self):
+        return QuadBuffer(list(self.ops), array('B', self.opcodes), array('q', self.left),
+                          array('q', self.right), array('q', self.result), list(self.strings),
+                          array('I', self.lines), array('I', self.columns))
+
+    def frozen(self):
+        # Mismo buffer sobre vistas de solo lectura (sin copiar): escribir en él lanza TypeError
+        # y los arreglos originales ya no pueden crecer mientras existan las vistas
+        views = [memoryview(column).toreadonly() for column in
+                 (self.opcodes, self.left, self.right, self.result, self.lines, self.columns)]
+        opcodes, left, right, result, lines, columns = views
+        return QuadBuffer(tuple(self.ops), opcodes, left, right, result, tuple(self.strings), lines, columns)
+
+    def clear(self):
+        self.__init__()
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [QuadRef(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("indice de cuadruplo fuera de rango")
+        return QuadRef(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield QuadRef(self, i)
+
+    def __repr__(self):
+        return f"QuadBuffer(quads={len(self)})"
+
+
+class QuadRef:
+    # Vista de un cuadruplo dentro de un QuadBuffer, con los atributos de Quadruple
+    __slots__ = ('buffer', 'index')
+
+    def __init__(self, buffer, index):
+        self.buffer = buffer
+        self.index = index
+
+    @property
+    def op(self):
+        return self.buffer.ops[self.buffer.opcodes[self.index]]
+
+    @property
+    def left_op(self):
+        return self.buffer.decode(self.buffer.left[self.index])
+
+    @property
+    def right_op(self):
+        return self.buffer.decode(self.buffer.right[self.index])
+
+    @property
+    def result(self):
+        return self.buffer.decode(self.buffer.result[self.index])
+
+    @result.setter
+    def result(self, value):
+        self.buffer.set_result(self.index, value)
+
+    @property
+    def position(self):
+        return self.buffer.position(self.index) or (0, 0)
+
+    def __repr__(self):
+        return f"({self.op}, {self.left_op}, {self.right_op}, {self.result})"
+
+
 class QuadManager():
     def __init__(self):
         self.pila_operandos = Stack("pila_operandos") # direcciones
@@ -48,10 +196,13 @@ class QuadManager():
         self.pila_tipos = Stack("pila_tipos") # tipos (int, float, bool)
         self.pila_saltos = Stack("pila_saltos") # para goto/gotof
 
-        self.cuadruplos = [] # Lista de cuadruplos
+        self.cuadruplos = QuadBuffer() # Cuadruplos en arreglos paralelos
 
         self.count_temporales = 0
 
+        # Funcion que regresa (linea, columna) del fuente al emitir un cuadruplo; la pone el parser
+        self.position = None
+
     def new_temporal(self, tipo):
         name = f't{self.count_temporales}'
         self.count_temporales += 1
@@ -60,15 +211,14 @@ class QuadManager():
     
     # Añade un cuadruplo a la lista y regresa su indice
     def add_cuadruplo(self, op, left_op=None, right_op=None, result=None):
-        cuadruplo = Quadruple(op, left_op, right_op, result)
-        self.cuadruplos.append(cuadruplo)
-        return len(self.cuadruplos) - 1
+        line, column = self.position() if self.position is not None else (0, 0)
+        return self.cuadruplos.append(op, left_op, right_op, result, line, column)
     
     def get_cuadruplos(self, index):
         return self.cuadruplos[index]
     
     def fill_cuadruplos(self, index, result):
-        self.cuadruplos[index].result = result
+        self.cuadruplos.set_result(index, result)
 
     def print_cuadruplos(self):
         print("----- Cuádruplos -----")
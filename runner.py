@@ -0,0 +1,136 @@
+import gc
+import multiprocessing
+import time
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+
+from program import CompiledProgram, Program, compile_program
+from output_sink import BufferSink
+
+# ----- Ejecucion en varios procesos -----
+# ProgramRunner compila cada programa una sola vez en el proceso principal y deja su imagen
+# (program_image) en un segmento de multiprocessing.shared_memory. Los procesos del pool se
+# quedan vivos entre tareas: cada tarea solo manda el nombre del segmento, el worker lo abre
+# la primera vez y guarda el programa ya enlazado (Program), asi que las demas tareas solo
+# ejecutan. Cada worker guarda a lo mas cache_size programas: al pasarse cierra el que lleva
+# mas tiempo sin usarse (los que ya se descargaron dejan de pedirse y salen solos).
+# Los resultados llegan conforme terminan.
+
+WORKER_CACHE_SIZE = 16  # programas abiertos por worker
+
+
+class RunResult:
+    # Resultado de una tarea: salida capturada, error (texto) o None y tiempo en el worker
+    def __init__(self, task, program_id, output, error, elapsed):
+        self.task = task
+        self.program_id = program_id
+        self.output = output
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f"RunResult(task={self.task}, program_id={self.program_id}, ok={self.ok}, elapsed={self.elapsed:.4f})"
+
+
+# ------------------ Worker ------------------
+_images = OrderedDict()  # nombre del segmento -> (SharedMemory, Program), del menos al mas usado
+_cache_size = WORKER_CACHE_SIZE
+
+
+def _init_worker(cache_size):
+    global _cache_size
+    _cache_size = cache_size
+
+
+def _attach(name, size):
+    entry = _images.get(name)
+    if entry is not None:
+        _images.move_to_end(name)
+    else:
+        while _images and len(_images) >= _cache_size:
+            # El Program tiene vistas del segmento y las VMs que lo usaron quedan en ciclos
+            # (handlers como metodos de la VM): se recolectan antes de cerrarlo
+            _, (old, program) = _images.popitem(last=False)
+            del program
+            gc.collect()
+            old.close()
+        shm = shared_memory.SharedMemory(name=name)
+        entry = _images[name] = (shm, Program(CompiledProgram.from_image(shm.buf[:size])))
+    return entry[1]
+
+
+def _run_task(task):
+    task_id, name, size, engine, limits = task
+    start = time.perf_counter()
+    sink = BufferSink()
+    error = None
+    try:
+        program = _attach(name, size)
+        program.vm(engine=engine, output=sink).run(**limits)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return RunResult(task_id, name, sink.getvalue(), error, time.perf_counter() - start)
+
+
+# ------------------ Proceso principal ------------------
+class ProgramRunner:
+    def __init__(self, processes=None, engine='table', cache_size=WORKER_CACHE_SIZE):
+        if cache_size < 1:
+            raise ValueError("cache_size debe ser al menos 1")
+        self.engine = engine
+        # Los workers heredan el resource_tracker del proceso principal: el segmento que abre un
+        # worker queda registrado una sola vez y lo borra unload() (o el tracker al salir)
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(processes, _init_worker, (cache_size,))
+        self.images = {}  # id del programa (nombre del segmento) -> (SharedMemory, tamaño)
+
+    def load(self, source):
+        # Compila el programa y lo deja en memoria compartida; regresa su id
+        data = compile_program(source).to_image()
+        shm = shared_memory.SharedMemory(create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        self.images[shm.name] = (shm, len(data))
+        return shm.name
+
+    def unload(self, program_id):
+        shm, _ = self.images.pop(program_id)
+        shm.close()
+        shm.unlink()
+
+    def run(self, jobs, chunksize=1):
+        # jobs: ids de programa o (id, limites de VirtualMachine.run); genera RunResult en el
+        # orden en que terminan (RunResult.task es la posicion del trabajo en jobs)
+        tasks = []
+        for job in jobs:
+            program_id, limits = (job, {}) if isinstance(job, str) else job
+            _, size = self.images[program_id]
+            tasks.append((len(tasks), program_id, size, self.engine, limits))
+        yield from self.pool.imap_unordered(_run_task, tasks, chunksize)
+
+    def run_sources(self, sources):
+        # Compila y corre cada fuente una vez; los resultados quedan en el orden de sources
+        ids = [self.load(source) for source in sources]
+        try:
+            results = sorted(self.run(ids), key=lambda r: r.task)
+        finally:
+            for program_id in ids:
+                self.unload(program_id)
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        for program_id in list(self.images):
+            self.unload(program_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.pool.terminate()
+        self.close()
@@ -0,0 +1,57 @@
+import random
+
+# ----- Profiler por muestreo -----
+# vm.run(sampler=SamplingProfiler()) corre la VM por tandas con el mismo ciclo que los limites de
+# recursos (run_governed) y al final de cada tanda toma una muestra: la pila de llamadas y el ip
+# actual. Las tandas duran en promedio `interval` cuadruplos con una variacion aleatoria para no
+# sincronizarse con los ciclos del programa; entre muestras la VM corre a velocidad normal.
+# collapsed() regresa las pilas en el formato de flamegraph.pl / speedscope, un marco por
+# funcion con la linea del fuente (la de la llamada en los llamadores):
+#   global:19;fibonacci:12;fibonacci:10 57
+
+SAMPLE_INTERVAL = 1000  # cuadruplos promedio entre muestras
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL, seed=None):
+        if interval < 1:
+            raise ValueError("interval debe ser al menos 1")
+        self.interval = interval
+        self.random = random.Random(seed)
+        self.samples = {}  # pila (tupla de marcos) -> muestras
+        self.total = 0
+
+    # Misma interfaz que ResourceGovernor: run_governed la llama entre tandas
+    def start(self):
+        pass
+
+    def next_slice(self, vm, ip):
+        return self.random.randint(1, 2 * self.interval - 1)
+
+    def check(self, vm, ip, retired):
+        trace = vm.stack_trace(ip)
+        frames = []
+        for depth, (name, site) in enumerate(trace):
+            # En los llamadores el ip es el de regreso; la llamada es el cuadruplo anterior
+            line = vm.source_line(site if depth == len(trace) - 1 else site - 1)
+            frames.append(f"{name}:{line}" if line is not None else name)
+        stack = tuple(frames)
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+        self.total += 1
+
+    def collapsed(self):
+        # Una linea por pila distinta: marcos separados por ';' y el numero de muestras
+        lines = [f"{';'.join(stack)} {count}" for stack, count in
+                 sorted(self.samples.items(), key=lambda item: (-item[1], item[0]))]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.collapsed())
+
+    def by_line(self):
+        # Muestras donde el marco activo (la hoja) esta en cada funcion:linea, de mas a menos
+        leaves = {}
+        for stack, count in self.samples.items():
+            leaves[stack[-1]] = leaves.get(stack[-1], 0) + count
+        return sorted(leaves.items(), key=lambda item: -item[1])
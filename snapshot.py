@@ -0,0 +1,207 @@
+import hashlib
+import struct
+
+from linker import FrameLayout, FRAME_BANKS
+from output_sink import BufferSink
+
+# ----- Checkpoints de la VM -----
+# Estado de una VM enlazada ('table' o 'closure') a mitad de la ejecucion en un formato binario
+# propio: ip, bancos globales, frames (el actual, los de call_stack y el de un ERA pendiente)
+# y la salida que todavia no se entrega. Se restaura sobre una VM nueva del mismo programa,
+# con el mismo modo de memoria y las mismas optimizaciones (puede ser otro motor u otro proceso).
+#
+#   cabecera   'PVMS', version (H), ip (q), huella del programa (32 bytes)
+#   salida     texto utf-8 (I + bytes)
+#   globales   numero de bancos (H), por banco: numero de banco (H) y valores
+#   frames     numero (I), por frame: indice del layout (I), almacenes (B) y valores de cada uno
+#   pila       numero (I), por entrada: frame (I), ip de regreso (I), destino (B [+ H I])
+#   activos    frame actual (I), frame del ERA pendiente (I, NO_FRAME si no hay)
+# Valores: numero (I) y por valor una etiqueta (B) mas su dato.
+
+MAGIC = b'PVMS'
+SNAPSHOT_VERSION = 1
+NO_FRAME = 0xFFFFFFFF
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _BIGINT, _STR = range(7)
+_INT64 = (-(1 << 63), (1 << 63) - 1)
+
+
+def program_fingerprint(program):
+    # Huella del codigo enlazado y el modo de memoria: un checkpoint solo sirve para el mismo programa
+    def plain(x):
+        if isinstance(x, FrameLayout):
+            return ('layout', x.name)
+        if isinstance(x, tuple):
+            return tuple(plain(y) for y in x)
+        return x
+    text = repr((program.memory, [plain(q) for q in program.code]))
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+# ------------------ Escritura ------------------
+def _write_values(out, values):
+    out.append(struct.pack('<I', len(values)))
+    for v in values:
+        if v is None:
+            out.append(bytes((_NONE,)))
+        elif v is True or v is False:
+            out.append(bytes((_TRUE if v else _FALSE,)))
+        elif isinstance(v, int):
+            if _INT64[0] <= v <= _INT64[1]:
+                out.append(struct.pack('<Bq', _INT, v))
+            else:
+                data = v.to_bytes((v.bit_length() + 8) // 8, 'little', signed=True)
+                out.append(struct.pack('<BI', _BIGINT, len(data)) + data)
+        elif isinstance(v, float):
+            out.append(struct.pack('<Bd', _FLOAT, v))
+        elif isinstance(v, str):
+            data = v.encode('utf-8')
+            out.append(struct.pack('<BI', _STR, len(data)) + data)
+        else:
+            raise TypeError(f"Valor no soportado en un checkpoint: {v!r}")
+
+
+def dump_state(vm):
+    if vm.engine == 'switch':
+        raise ValueError("Los checkpoints requieren un motor enlazado ('table' o 'closure')")
+
+    out = [struct.pack('<4sHq32s', MAGIC, SNAPSHOT_VERSION, vm.ip, program_fingerprint(vm.program))]
+
+    # Salida no entregada: lo capturado por un BufferSink o lo pendiente en el buffer de otro sink
+    if isinstance(vm.output, BufferSink):
+        pending = vm.output.getvalue()
+    else:
+        pending = ''.join(getattr(vm.output, 'pending', ()))
+    data = pending.encode('utf-8')
+    out.append(struct.pack('<I', len(data)) + data)
+
+    banks = sorted(vm.program.global_sizes)
+    out.append(struct.pack('<H', len(banks)))
+    for bank in banks:
+        out.append(struct.pack('<H', bank))
+        _write_values(out, vm.mem[bank])
+
+    frames = []
+    ids = {}
+
+    def frame_id(frame):
+        if frame is None:
+            return NO_FRAME
+        if id(frame) not in ids:
+            ids[id(frame)] = len(frames)
+            frames.append(frame)
+        return ids[id(frame)]
+
+    stack = [(frame_id(frame), ret_ip, dest) for frame, ret_ip, dest in vm.call_stack]
+    current = frame_id(vm.current_frame)
+    pending_frame = frame_id(vm.next_frame)
+
+    out.append(struct.pack('<I', len(frames)))
+    for frame in frames:
+        out.append(struct.pack('<IB', frame.layout.index, len(frame.stores)))
+        for store in frame.stores:
+            _write_values(out, store)
+
+    out.append(struct.pack('<I', len(stack)))
+    for fid, ret_ip, dest in stack:
+        out.append(struct.pack('<II', fid, ret_ip))
+        out.append(struct.pack('<B', 0) if dest is None else struct.pack('<BHI', 1, dest[0], dest[1]))
+    out.append(struct.pack('<II', current, pending_frame))
+    return b''.join(out)
+
+
+# ------------------ Lectura ------------------
+class _Reader:
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values
+
+    def raw(self, n):
+        chunk = bytes(self.data[self.pos:self.pos + n])
+        self.pos += n
+        return chunk
+
+    def values(self):
+        (count,) = self.unpack('<I')
+        values = []
+        for _ in range(count):
+            (tag,) = self.unpack('<B')
+            if tag == _NONE:
+                values.append(None)
+            elif tag in (_FALSE, _TRUE):
+                values.append(tag == _TRUE)
+            elif tag == _INT:
+                values.append(self.unpack('<q')[0])
+            elif tag == _FLOAT:
+                values.append(self.unpack('<d')[0])
+            elif tag == _BIGINT:
+                values.append(int.from_bytes(self.raw(self.unpack('<I')[0]), 'little', signed=True))
+            elif tag == _STR:
+                values.append(self.raw(self.unpack('<I')[0]).decode('utf-8'))
+            else:
+                raise ValueError(f"Checkpoint corrupto: etiqueta de valor {tag}")
+        return values
+
+
+def _fill(store, values):
+    # Escribe en el almacen en su lugar (los closures y la lista de bancos guardan el objeto)
+    if len(values) != len(store):
+        raise ValueError("El checkpoint no corresponde a la memoria de este programa")
+    for i, v in enumerate(values):
+        store[i] = v
+
+
+def load_state(vm, data):
+    if vm.engine == 'switch':
+        raise ValueError("Los checkpoints requieren un motor enlazado ('table' o 'closure')")
+
+    reader = _Reader(data)
+    magic, version, ip, fingerprint = reader.unpack('<4sHq32s')
+    if magic != MAGIC:
+        raise ValueError("No es un checkpoint de la VM de Patito")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Versión de checkpoint no soportada: {version}")
+    if fingerprint != program_fingerprint(vm.program):
+        raise ValueError("El checkpoint es de otro programa o de otra configuración de la VM")
+
+    pending = reader.raw(reader.unpack('<I')[0]).decode('utf-8')
+
+    (nbanks,) = reader.unpack('<H')
+    for _ in range(nbanks):
+        (bank,) = reader.unpack('<H')
+        _fill(vm.mem[bank], reader.values())
+
+    by_index = {layout.index: layout for layout in vm.layouts.values()}
+    frames = []
+    (nframes,) = reader.unpack('<I')
+    for _ in range(nframes):
+        index, nstores = reader.unpack('<IB')
+        frame = by_index[index].new_frame()
+        if nstores != len(frame.stores):
+            raise ValueError("El checkpoint no corresponde a la memoria de este programa")
+        for store in frame.stores:
+            _fill(store, reader.values())
+        frames.append(frame)
+
+    stack = []
+    (nstack,) = reader.unpack('<I')
+    for _ in range(nstack):
+        fid, ret_ip = reader.unpack('<II')
+        (has_dest,) = reader.unpack('<B')
+        dest = reader.unpack('<HI') if has_dest else None
+        stack.append((frames[fid], ret_ip, dest))
+    current, pending_frame = reader.unpack('<II')
+
+    # La pila se cambia en su lugar: los closures ligaron vm.call_stack.append
+    vm.call_stack[:] = stack
+    vm.current_frame = frames[current]
+    vm.mem[FRAME_BANKS] = vm.current_frame.banks
+    vm.next_frame = frames[pending_frame] if pending_frame != NO_FRAME else None
+    vm.ip = ip
+    if pending:
+        vm.write_output(pending)
@@ -1,55 +1,50 @@
-from parser_patito import parser, lexer, quad_manager, dir_funcs
-from semantics import vm
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import redirect_stdout
+
+from program import Program, compile_program, load_program
+from program_image import HEADER, decode_program
+from quads import QuadManager, Quadruple
 from virtual_machine import VirtualMachine
+from transpiler import PythonProgram
+from c_backend import CProgram, CACHE_DIR, find_compiler
+from pgo import record_profile, load_profile
+from linker import FRAME_POOL_SIZE, BANKS
+from output_sink import BufferSink, OutputLimitExceeded
+from sampling_profiler import SamplingProfiler
+from quad_coverage import CoverageMap
+from verifier import verify, VerificationError
+from governor import ResourceLimitExceeded, ExecutionCancelled, CancellationToken
 
 
 # ===========================================================
 #  Helpers
 # ===========================================================
 
-def make_const_table(vm):
-    """Convierte vm.const_tables (value->addr) en addr->value."""
-    const_addr_to_value = {}
-    for tipo, table in vm.const_tables.items():
-        for value, addr in table.items():
-            const_addr_to_value[addr] = value
-    return const_addr_to_value
+def compile_patito_program(code):
+    """Reinicia el estado global del compilador, parsea y regresa el CompiledProgram."""
+    return compile_program(code)
 
 
-def run_patito_program(name, code):
+def run_patito_program(name, code, engine='table'):
     print("\n" + "="*60)
     print(f"TEST: {name}")
     print("="*60)
 
-    # Reset global state
-    quad_manager.cuadruplos.clear()
-    quad_manager.pila_operandos.data.clear()
-    quad_manager.pila_tipos.data.clear()
-    quad_manager.pila_operadores.data.clear()
-    quad_manager.pila_saltos.data.clear()
-
-    dir_funcs.functions.clear()
-    dir_funcs.add_function("global", "nula")
-    vm.reset_temporals()
-    vm.counters['global'] = {'int':0,'float':0,'bool':0}
-    vm.counters['local'] = {'int':0,'float':0,'bool':0}
-    vm.counters['temporal'] = {'int':0,'float':0,'bool':0}
-    vm.counters['const'] = {'int':0,'float':0,'letrero':0}
-    vm.const_tables = {'int':{},'float':{},'letrero':{}}
-
-    # Parsear
     try:
-        parser.parse(code, lexer=lexer)
+        program = compile_patito_program(code)
     except Exception as e:
         print("❌ ERROR durante el parseo:", e)
         return
 
-    # Preparar constantes
-    const_addr_to_value = make_const_table(vm)
-
     # Ejecutar VM
     try:
-        vmachine = VirtualMachine(quad_manager.cuadruplos, dir_funcs, const_addr_to_value)
+        vmachine = VirtualMachine.from_program(program, engine=engine)
         vmachine.run()
     except Exception as e:
         print("❌ ERROR durante ejecución de la VM:", e)
@@ -58,6 +53,1044 @@ def run_patito_program(name, code):
     print("\n✔ TEST FINALIZADO")
 
 
+def capture_output(code, engine, **options):
+    """Corre el programa con el motor indicado ('python' usa el transpiler) y regresa su salida."""
+    program = compile_patito_program(code)
+    cuadruplos, funcs, const_addr_to_value = program
+    sink = BufferSink()
+    if engine != 'python':
+        VirtualMachine.from_program(program, engine=engine, output=sink, **options).run()
+    else:
+        PythonProgram(cuadruplos, funcs, const_addr_to_value, **options).run(output=sink)
+    return sink.getvalue()
+
+
+# Configuraciones que deben producir la misma salida que el motor de referencia
+PARITY_CONFIGS = [
+    ('table', {}),
+    ('table', {'superinstructions': False}),
+    ('table', {'tail_calls': False}),
+    ('table', {'memory': 'typed'}),
+    ('closure', {}),
+    ('closure', {'memory': 'typed'}),
+    ('table', {'jit': True, 'jit_threshold': 2}),
+    ('closure', {'jit': True, 'jit_threshold': 2, 'memory': 'typed'}),
+    ('table', {'coverage': True}),
+    ('closure', {'coverage': True}),
+    ('table', {'unchecked': True}),
+    ('closure', {'unchecked': True, 'jit': True, 'jit_threshold': 2}),
+    ('python', {}),
+]
+
+
+def capture_outcome(code, engine, **options):
+    """Salida del programa, o el nombre de la excepcion con la que termino."""
+    try:
+        return capture_output(code, engine, **options)
+    except Exception as e:
+        return type(e).__name__
+
+
+def check_engine_parity(name, code, reference='switch'):
+    """Compara la salida (o el error) de cada motor contra el motor de referencia. Las
+    configuraciones con memoria tipada o sin revisiones pueden rechazar el programa antes."""
+    expected = capture_outcome(code, reference)
+    for engine, options in PARITY_CONFIGS:
+        label = ",".join([engine] + [f"{k}={v}" for k, v in options.items()])
+        got = capture_outcome(code, engine, **options)
+        verified = options.get('memory') == 'typed' or options.get('unchecked')
+        if got == expected:
+            print(f"✔ PARIDAD [{label}] {name}")
+        elif got == 'VerificationError' and verified:
+            print(f"✔ PARIDAD [{label}] {name}: rechazado por el verificador")
+        else:
+            print(f"❌ PARIDAD [{label}] {name}: {got!r} != {expected!r}")
+
+
+def check_output_limit(name, code, max_chars=5):
+    """Un BufferSink con limite debe cortar la ejecucion con OutputLimitExceeded."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    runners = {
+        'table': lambda sink: VirtualMachine(cuadruplos, funcs, const_addr_to_value, output=sink).run(),
+        'python': lambda sink: PythonProgram(cuadruplos, funcs, const_addr_to_value).run(output=sink),
+    }
+    for engine, run in runners.items():
+        sink = BufferSink(max_chars=max_chars)
+        stdout = io.StringIO()
+        try:
+            with redirect_stdout(stdout):
+                run(sink)
+        except OutputLimitExceeded:
+            if stdout.getvalue():
+                print(f"❌ LIMITE DE SALIDA {name} ({engine}): escribió a stdout {stdout.getvalue()!r}")
+            else:
+                print(f"✔ LIMITE DE SALIDA {name} ({engine})")
+            continue
+        print(f"❌ LIMITE DE SALIDA {name} ({engine}): se escribieron {len(sink.getvalue())} caracteres")
+
+
+def check_frame_pool(name, code):
+    """ENDFUNC regresa los frames a su pool y acquire() los entrega limpios."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    for engine in ('table', 'closure'):
+        vm = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=engine, output=BufferSink())
+        vm.run()
+        reused = [(layout, pool) for layout, pool in zip(vm.layouts.values(), vm.frame_pools) if pool]
+        if not reused or any(len(pool) > FRAME_POOL_SIZE for pool in vm.frame_pools):
+            print(f"❌ POOL DE FRAMES {name} ({engine}): {[len(p) for p in vm.frame_pools]}")
+            return
+        layout, pool = reused[0]
+        frame = layout.acquire(pool)
+        if [list(s) for s in frame.stores] != [list(t) for t in layout.templates]:
+            print(f"❌ POOL DE FRAMES {name} ({engine}): el frame reutilizado no esta limpio")
+            return
+    print(f"✔ POOL DE FRAMES {name}")
+
+
+def check_instrumentation(name, code, function, calls):
+    """Con instrument=True el reporte cuenta llamadas y cuadruplos y se puede pasar a JSON."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    for engine in ('table', 'closure'):
+        vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=engine,
+                                  output=BufferSink(), instrument=True)
+        vmachine.run()
+        report = json.loads(vmachine.profile.to_json())
+        stats = report['functions'].get(function, {})
+        per_function = sum(f['quads'] for f in report['functions'].values())
+        if (stats.get('calls') != calls or per_function != report['quads_retired']
+                or sum(report['opcodes'].values()) != report['quads_retired']
+                or stats['inclusive_time'] < stats['exclusive_time']):
+            print(f"❌ INSTRUMENTACION {name} ({engine}): {report['functions']}")
+            return
+    print(f"✔ INSTRUMENTACION {name}")
+
+
+INFINITE_LOOP_PROGRAM = """
+programa T;
+vars
+    x : int;
+
+main {
+    x = 0;
+    while (1 > 0) do {
+        x = x + 1;
+    };
+}
+end
+"""
+
+RUNAWAY_RECURSION_PROGRAM = """
+programa T;
+vars
+    r : int;
+
+int f(n:int) {
+    {
+        return f(n + 1) + 1;
+    }
+};
+
+main {
+    r = f(0);
+}
+end
+"""
+
+
+def check_resource_limits():
+    """Los limites de run() cortan ciclos infinitos y recursion sin fin con ResourceLimitExceeded."""
+    token = CancellationToken()
+    token.cancel()
+    cases = [
+        (INFINITE_LOOP_PROGRAM, {'max_quads': 10000}, 'quads'),
+        (INFINITE_LOOP_PROGRAM, {'max_time': 0.05}, 'time'),
+        (INFINITE_LOOP_PROGRAM, {'cancel_token': token}, 'cancel'),
+        (RUNAWAY_RECURSION_PROGRAM, {'max_stack_depth': 500}, 'stack'),
+        (RUNAWAY_RECURSION_PROGRAM, {'max_cells': 5000}, 'cells'),
+    ]
+    for code, limits, expected in cases:
+        cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+        for engine in ('table', 'closure'):
+            vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=engine, output=BufferSink())
+            try:
+                vmachine.run(**limits)
+            except ResourceLimitExceeded as e:
+                if e.limit != expected or e.stack[-1][1] != e.ip or (expected == 'cancel') != isinstance(e, ExecutionCancelled):
+                    print(f"❌ LIMITES {limits} ({engine}): {e.limit} {e.stack[-1]} ip={e.ip}")
+                    return
+                continue
+            print(f"❌ LIMITES {limits} ({engine}): el programa no se detuvo")
+            return
+    print("✔ LIMITES DE RECURSOS")
+
+
+SWEEP_PROGRAM = """
+programa T;
+vars
+    n : int;
+    x : float;
+    r : int;
+
+int fact(k:int) {
+    vars
+        f:int;
+    {
+        f = 1;
+        while (k > 1) do {
+            f = f * k;
+            k = k - 1;
+        };
+        return f;
+    }
+};
+
+main {
+    %s
+    r = fact(n);
+    if (r > 100) {
+        print("grande ", r, " ", x / 2);
+    } else {
+        print("chico ", r, " ", x * n);
+    };
+}
+end
+"""
+
+
+def check_batch_engine(lanes=12):
+    """El motor por lotes da en cada carril la misma salida que una corrida normal con esas globales."""
+    try:
+        from batch_engine import BatchVirtualMachine
+        import numpy  # noqa: F401
+    except ImportError:
+        print("⚠ MOTOR POR LOTES: NumPy no esta instalado, se omite")
+        return
+    ns = list(range(lanes))
+    xs = [i * 0.5 for i in range(lanes)]
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(SWEEP_PROGRAM % "")
+    batch = BatchVirtualMachine(cuadruplos, funcs, const_addr_to_value, {'n': ns, 'x': xs})
+    got = batch.run()
+    expected = [capture_output(SWEEP_PROGRAM % f"n = {n}; x = {x};", 'table') for n, x in zip(ns, xs)]
+    if got != expected:
+        print(f"❌ MOTOR POR LOTES: {got} != {expected}")
+        return
+
+    # Un carril cuyo factorial se sale de int64 da el mismo entero grande que la VM, y las
+    # entradas toman el tipo de su variable (x es float aunque reciba enteros)
+    ns = [3, 25, 5]
+    xs = [1, 2, 3]
+    got = BatchVirtualMachine(cuadruplos, funcs, const_addr_to_value, {'n': ns, 'x': xs}).run()
+    expected = [capture_output(SWEEP_PROGRAM % f"n = {n}; x = {float(x)};", 'table') for n, x in zip(ns, xs)]
+    if got != expected:
+        print(f"❌ MOTOR POR LOTES (desbordamiento): {got} != {expected}")
+        return
+    try:
+        BatchVirtualMachine(cuadruplos, funcs, const_addr_to_value, {'n': [1, 2.5], 'x': [0.0, 0.0]})
+        print("❌ MOTOR POR LOTES: aceptó un float para una variable int")
+        return
+    except ValueError:
+        pass
+    print(f"✔ MOTOR POR LOTES ({lanes} carriles, {batch.splits} divisiones)")
+
+
+def check_process_runner(processes=2):
+    """ProgramRunner corre los programas en procesos del pool con la misma salida que la VM local."""
+    from runner import ProgramRunner
+    expected = [capture_output(code, 'table') for _, code in TESTS]
+    with ProgramRunner(processes) as runner:
+        results = runner.run_sources([code for _, code in TESTS])
+        # El mismo programa ya cargado se corre varias veces sin volver a compilarlo
+        program_id = runner.load(TESTS[0][1])
+        repeated = list(runner.run([program_id] * 4 + [(program_id, {'max_quads': 5})]))
+    outputs = [r.output for r in results]
+    limited = [r for r in repeated if not r.ok]
+    if (outputs != expected or len(limited) != 1 or 'ResourceLimitExceeded' not in limited[0].error
+            or any(r.output != expected[0] for r in repeated if r.ok)):
+        print(f"❌ EJECUCION EN PROCESOS: {results} {repeated}")
+        return
+    print(f"✔ EJECUCION EN PROCESOS ({len(results) + len(repeated)} tareas)")
+
+
+def _worker_images():
+    import runner
+    return len(runner._images)
+
+
+def check_runner_cache(cache_size=2, rounds=6):
+    """Cargar y descargar programas en ciclo no acumula segmentos abiertos en el worker."""
+    from runner import ProgramRunner
+    name, code = TESTS[0]
+    expected = capture_output(code, 'table')
+    with ProgramRunner(1, cache_size=cache_size) as runner:
+        for _ in range(rounds):
+            program_id = runner.load(code)
+            result = next(runner.run([program_id]))
+            runner.unload(program_id)
+            if result.output != expected:
+                print(f"❌ CACHE DE PROGRAMAS EN PROCESOS: {result}")
+                return
+        cached = runner.pool.apply(_worker_images)
+    if cached != cache_size:
+        print(f"❌ CACHE DE PROGRAMAS EN PROCESOS: {cached} programas abiertos (limite {cache_size})")
+        return
+    print(f"✔ CACHE DE PROGRAMAS EN PROCESOS ({rounds} cargas, {cached} abiertos)")
+
+
+def check_snapshot(name, code, pause_every=997):
+    """Un checkpoint tomado a mitad de la ejecucion se reanuda en otra VM con la misma salida."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    expected = capture_output(code, 'table')
+    pairs = [('table', 'closure', {}), ('closure', 'table', {}), ('table', 'table', {'memory': 'typed'})]
+    for first, second, options in pairs:
+        sink = BufferSink()
+        vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=first, output=sink, **options)
+        checkpoints = 0
+        while True:
+            try:
+                vmachine.run(max_quads=pause_every)
+                break
+            except ResourceLimitExceeded:
+                # Cada pausa continua en una VM nueva, como si fuera otro proceso
+                data = vmachine.snapshot()
+                first, second = second, first
+                sink = BufferSink()
+                vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=first, output=sink, **options)
+                vmachine.restore(data)
+                checkpoints += 1
+        if sink.getvalue() != expected or checkpoints == 0:
+            print(f"❌ CHECKPOINT {name} ({first}/{second} {options}): {sink.getvalue()!r} != {expected!r}")
+            return
+    print(f"✔ CHECKPOINT {name}")
+
+
+def check_async_execution(slice_size=500):
+    """run_async() y stream() ceden el event loop: varias VMs y otras tareas avanzan en un hilo."""
+    programs = [compile_patito_program(code) for _, code in (TESTS[5], TESTS[3])]
+    expected = [capture_output(code, 'table') for _, code in (TESTS[5], TESTS[3])]
+    finished = []
+    ticks = []
+
+    async def run_one(i, engine):
+        sink = BufferSink()
+        await VirtualMachine(*programs[i], engine=engine, output=sink).run_async(slice_size)
+        finished.append((i, sink.getvalue()))
+
+    async def ticker():
+        # Corre mientras las VMs trabajan: si una VM bloqueara el loop no avanzaria
+        while len(finished) < 2:
+            ticks.append(1)
+            await asyncio.sleep(0)
+
+    async def stream_one():
+        vmachine = VirtualMachine(*programs[1], engine='closure', output=BufferSink())
+        return [chunk async for chunk in vmachine.stream(slice_size=5)]
+
+    async def main():
+        await asyncio.gather(run_one(0, 'table'), run_one(1, 'closure'), ticker())
+        return await stream_one()
+
+    chunks = asyncio.run(main())
+    # El programa corto termina primero aunque el largo empezo antes
+    if ([i for i, _ in finished] != [1, 0] or [out for _, out in sorted(finished)] != expected
+            or len(ticks) < 10 or len(chunks) < 2 or ''.join(chunks) != expected[1]):
+        print(f"❌ EJECUCION ASINCRONA: {finished} {len(ticks)} {chunks}")
+        return
+    print(f"✔ EJECUCION ASINCRONA ({len(ticks)} turnos del loop, {len(chunks)} pedazos de salida)")
+
+
+def check_trace_jit(name, code):
+    """Con jit=True los ciclos calientes se compilan a trazas y la salida no cambia."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    expected = capture_output(code, 'table')
+    for engine in ('table', 'closure'):
+        sink = BufferSink()
+        vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=engine, output=sink,
+                                  jit=True, jit_threshold=2)
+        vmachine.run()
+        if not vmachine.jit.traces or sink.getvalue() != expected:
+            print(f"❌ JIT DE TRAZAS {name} ({engine}): {list(vmachine.jit.traces)} {sink.getvalue()!r}")
+            return
+    print(f"✔ JIT DE TRAZAS {name}")
+
+
+def check_trace_jit_accounting(name, code):
+    """Una traza corre muchas vueltas como un solo cuadruplo: el JIT no se combina con nada que
+    cuente cuadruplos (instrumentacion, cobertura, max_quads, max_time, profiler por muestreo)."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(code)
+    for options in ({'instrument': True}, {'coverage': True}):
+        try:
+            VirtualMachine(cuadruplos, funcs, const_addr_to_value, output=BufferSink(), jit=True, **options)
+            print(f"❌ JIT Y CONTEO {name}: aceptó {options}")
+            return
+        except ValueError:
+            pass
+    for limits in ({'max_quads': 10 ** 6}, {'max_time': 60}, {'sampler': SamplingProfiler()}):
+        vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, output=BufferSink(), jit=True)
+        try:
+            vmachine.run(**limits)
+            print(f"❌ JIT Y CONTEO {name}: aceptó {list(limits)}")
+            return
+        except ValueError:
+            pass
+    # Los limites que no cuentan cuadruplos siguen funcionando con el JIT
+    sink = BufferSink()
+    VirtualMachine(cuadruplos, funcs, const_addr_to_value, output=sink, jit=True,
+                   jit_threshold=2).run(max_stack_depth=100)
+    if sink.getvalue() != capture_output(code, 'table'):
+        print(f"❌ JIT Y CONTEO {name}: {sink.getvalue()!r}")
+        return
+    print(f"✔ JIT Y CONTEO {name}")
+
+
+TAIL_CALL_PROGRAM = """
+programa T;
+vars
+    r : int;
+
+int cuenta(n:int, acc:int) {
+    {
+        if (n == 0) {
+            return acc;
+        } else {
+            return cuenta(n - 1, acc + 1);
+        };
+    }
+};
+
+main {
+    r = cuenta(%d, 0);
+    print("Cuenta: ", r);
+}
+end
+"""
+
+
+def check_tail_calls(depth=1000000):
+    """La recursion de cola reutiliza un solo frame, aun con un millon de niveles."""
+    cuadruplos, funcs, const_addr_to_value = compile_patito_program(TAIL_CALL_PROGRAM % depth)
+    for engine in ('table', 'closure'):
+        sink = BufferSink()
+        vmachine = VirtualMachine(cuadruplos, funcs, const_addr_to_value, engine=engine, output=sink)
+        vmachine.run()
+        # Solo la llamada desde main crea un frame; al terminar queda de regreso en su pool
+        frames = len(vmachine.frame_pools[vmachine.layouts['cuenta'].index])
+        if sink.getvalue() != f"Cuenta: {depth}\n" or frames != 1:
+            print(f"❌ RECURSION DE COLA ({engine}): {sink.getvalue()!r}, {frames} frames")
+            return
+    print(f"✔ RECURSION DE COLA a profundidad {depth}")
+
+
+IMMEDIATE_PROGRAM = """
+programa T;
+vars
+    x : int;
+    y : float;
+
+int doble(k:int) {
+    {
+        return(k * 2);
+    }
+};
+
+main {
+    x = 10;
+    y = 1.5;
+    print(2 * 3 + 1, 10 - x, 1 < x, x / 4, 3 / y, 0 - 5);
+    while (0 < x) do {
+        x = x - 3;
+    };
+    print(x, doble(21), -4);
+}
+end
+"""
+
+# Un float que guarda un int se imprime como int en la VM de referencia
+FLOAT_INT_PROGRAM = """
+programa FI;
+vars
+    f : float;
+    n : int;
+
+main {
+    n = 2;
+    f = 1;
+    print(f, " ", f * n);
+}
+end
+"""
+
+# Leer una variable local sin asignar es un TypeError en la VM de referencia
+UNINIT_PROGRAM = """
+programa U;
+vars
+    n : int;
+
+int f(a : int) {
+    vars
+        b : int;
+    {
+        return(a + b);
+    }
+};
+
+main {
+    n = 40;
+    print(f(n));
+}
+end
+"""
+
+
+def check_immediate_operands(name, code):
+    """Ningun cuadruplo decodificado lee una constante de la memoria: todas van como inmediatos."""
+    program = compile_patito_program(code)
+    vmachine = VirtualMachine.from_program(program, output=BufferSink())
+    const_banks = {bank for bank, (segment, _, _) in enumerate(BANKS) if segment == 'const'}
+    for handler, left, right, res in vmachine.code:
+        for operand in (left, right, res):
+            if isinstance(operand, tuple) and len(operand) == 2 and operand[0] in const_banks:
+                print(f"❌ INMEDIATOS ({name}): {handler.__name__} lee una constante de memoria")
+                return
+    vmachine.run()
+    expected = capture_output(code, 'switch')
+    if vmachine.output.getvalue() != expected:
+        print(f"❌ INMEDIATOS ({name}): {vmachine.output.getvalue()!r} != {expected!r}")
+        return
+    print(f"✔ OPERANDOS INMEDIATOS: {name} ({len(program.constants)} constantes)")
+
+
+def check_quad_buffer():
+    """QuadBuffer guarda los cuadruplos en arreglos y su vista se comporta como Quadruple."""
+    manager = QuadManager()
+    goto = manager.add_cuadruplo('GOTO')
+    manager.add_cuadruplo('ERA', None, None, 'suma')
+    manager.add_cuadruplo('PARAM', 10000, None, 'param1')
+    manager.add_cuadruplo('+', 1000, 10001, 7000)
+    manager.fill_cuadruplos(goto, 3)
+    quads = manager.cuadruplos
+    view = [(q.op, q.left_op, q.right_op, q.result) for q in quads]
+    expected = [('GOTO', None, None, 3), ('ERA', None, None, 'suma'),
+                ('PARAM', 10000, None, 'param1'), ('+', 1000, 10001, 7000)]
+    copied = quads.copy()
+    quads[0].result = 2
+    if view != expected or repr(quads[-1]) != "(+, 1000, 10001, 7000)" or copied[0].result != 3:
+        print(f"❌ QUAD BUFFER: {view}")
+        return
+    print(f"✔ QUAD BUFFER ({len(quads)} cuadruplos en {len(quads.ops)} opcodes)")
+
+
+def check_sampling_profiler(name, code, function, line):
+    """El profiler por muestreo atribuye casi todas las muestras a la funcion y linea calientes."""
+    program = compile_patito_program(code)
+    expected = capture_output(code, 'table')
+    for engine in ('table', 'closure'):
+        sampler = SamplingProfiler(interval=50, seed=7)
+        vmachine = VirtualMachine.from_program(program, engine=engine, output=BufferSink())
+        vmachine.run(sampler=sampler)
+        collapsed = sampler.collapsed().splitlines()
+        hottest = sampler.by_line()[0][0]
+        total = sum(int(entry.rsplit(' ', 1)[1]) for entry in collapsed)
+        if (vmachine.output.getvalue() != expected or hottest != f"{function}:{line}" or total != sampler.total
+                or not all(entry.startswith("global:") for entry in collapsed)):
+            print(f"❌ PROFILER POR MUESTREO ({engine}): {hottest} {collapsed[:3]}")
+            return
+    try:
+        VirtualMachine.from_program(program, output=BufferSink()).run(max_quads=10 ** 6, sampler=SamplingProfiler())
+        print("❌ PROFILER POR MUESTREO: aceptó límites de recursos")
+        return
+    except ValueError as e:
+        if "muestreo" not in str(e):
+            print(f"❌ PROFILER POR MUESTREO: error con límites de recursos: {e}")
+            return
+    print(f"✔ PROFILER POR MUESTREO: {name} ({sampler.total} muestras, caliente {hottest})")
+
+
+COVERAGE_PROGRAM = """
+programa T;
+vars
+    x : int;
+
+int nunca(k:int) {
+    {
+        return(k + 1);
+    }
+};
+
+main {
+    x = 3;
+    if (x > 0) {
+        print("positivo");
+    };
+    while (x > 0) do {
+        x = x - 1;
+    };
+}
+end
+"""
+
+
+def check_coverage():
+    """La cobertura encuentra funciones muertas y saltos frios; los mapas se combinan y se guardan."""
+    program = compile_patito_program(COVERAGE_PROGRAM)
+    full = VirtualMachine.from_program(program, output=BufferSink(), coverage=True)
+    full.run()
+    report = full.coverage.report(program.cuadruplos, program.dir_funcs)
+    cold = [(branch['line'], branch['never']) for branch in report['cold_branches']]
+    if report['dead_functions'] != ['nunca'] or cold != [(14, 'taken')]:
+        print(f"❌ COBERTURA: {report}")
+        return
+
+    # Una corrida cortada mas otra sin superinstrucciones en 'closure' cubren lo mismo
+    partial = VirtualMachine.from_program(program, output=BufferSink(), coverage=True)
+    try:
+        partial.run(max_quads=4, check_interval=1)
+    except ResourceLimitExceeded:
+        pass
+    other = VirtualMachine.from_program(program, engine='closure', output=BufferSink(), coverage=True,
+                                        superinstructions=False)
+    other.run()
+    merged = CoverageMap.from_bytes(partial.coverage.to_bytes()).merge(other.coverage)
+    if (partial.coverage.covered() >= report['covered'] or merged.to_bytes() != full.coverage.to_bytes()
+            or (partial.coverage | full.coverage).to_bytes() != full.coverage.to_bytes()):
+        print(f"❌ COBERTURA (combinar): {partial.coverage.covered()} {merged.covered()} {report['covered']}")
+        return
+
+    # Un if vacio salta al mismo cuadruplo al que seguiria: cubierto hacia los dos lados y sin
+    # direccion en el perfil
+    program = compile_patito_program(EMPTY_BRANCH_PROGRAM)
+    for engine, superinstructions in (('table', True), ('closure', False)):
+        vm = VirtualMachine.from_program(program, engine=engine, output=BufferSink(), coverage=True,
+                                         superinstructions=superinstructions)
+        vm.run()
+        if vm.coverage.report(program.cuadruplos, program.dir_funcs)['cold_branches']:
+            print(f"❌ COBERTURA (salto vacio, {engine}): {vm.coverage.report(program.cuadruplos, program.dir_funcs)}")
+            return
+    profile = record_profile(EMPTY_BRANCH_PROGRAM, output=BufferSink())
+    if any(program.cuadruplos[ip].result == ip + 1 for ip in profile.branches) or len(profile.branches) != 1:
+        print(f"❌ COBERTURA (salto vacio en el perfil): {profile.branches}")
+        return
+    print(f"✔ COBERTURA ({report['covered']}/{report['quads']} cuadruplos, muerta: {report['dead_functions']})")
+
+
+EMPTY_BRANCH_PROGRAM = """
+programa T;
+vars
+    x, y : int;
+
+main {
+    x = 3;
+    y = 1;
+    while (y < 3) do {
+        if (x > y) {
+        };
+        y = y + 1;
+    };
+    print(y);
+}
+end
+"""
+
+
+UNVERIFIABLE_PROGRAMS = [
+    ("lectura antes de asignar", "lee 'y' antes de asignarla", """
+    programa T;
+    vars
+        x : int;
+
+    int f(a:int) {
+        vars
+            y : int;
+        {
+            if (a > 0) {
+                y = a;
+            };
+            return(y);
+        }
+    };
+
+    main {
+        x = f(1);
+        print(x);
+    }
+    end
+    """),
+    ("global asignada solo en un camino de la funcion", "lee 'g' antes de asignarla", """
+    programa T;
+    vars
+        g : int;
+
+    nula pone(a:int) {
+        {
+            if (a > 0) {
+                g = a;
+            };
+        }
+    };
+
+    main {
+        pone(0);
+        print(g);
+    }
+    end
+    """),
+    ("funcion sin return", "puede terminar sin RETURN", """
+    programa T;
+    vars
+        x : int;
+
+    int f(a:int) {
+        {
+            if (a > 0) {
+                return(a);
+            };
+        }
+    };
+
+    main {
+        x = f(1);
+        print(x);
+    }
+    end
+    """),
+]
+
+
+# Una llamada en main asigna las globales que la funcion (o lo que llama) escribe siempre
+CALLEE_ASSIGNS_PROGRAM = """
+programa T;
+vars
+    g : int;
+
+nula pone(a:int) {
+    {
+        if (a > 0) {
+            g = a;
+        } else {
+            g = 0 - a;
+        };
+    }
+};
+
+nula llama(a:int) {
+    {
+        pone(a);
+    }
+};
+
+main {
+    llama(3);
+    print(g);
+}
+end
+"""
+
+
+def check_verifier():
+    """El verificador acepta los programas de prueba y rechaza los que fallarian al correr."""
+    for name, code in TESTS:
+        verify(*compile_patito_program(code))
+    verify(*compile_patito_program(CALLEE_ASSIGNS_PROGRAM))
+    for name, expected, code in UNVERIFIABLE_PROGRAMS:
+        program = compile_patito_program(code)
+        try:
+            VirtualMachine.from_program(program, output=BufferSink(), unchecked=True)
+        except VerificationError as e:
+            if not any(expected in error for error in e.errors):
+                print(f"❌ VERIFICADOR ({name}): {e.errors}")
+                return
+        else:
+            print(f"❌ VERIFICADOR ({name}): el programa paso la verificacion")
+            return
+
+    # Cuadruplos alterados: saltos fuera del programa o a otra funcion, y un ERA encimado
+    program = compile_patito_program(TESTS[5][1])
+    n = len(program.cuadruplos)
+    broken = [
+        ("salto fuera", {0: Quadruple('GOTO', None, None, n + 5)}, "fuera del programa"),
+        ("salto a otra funcion", {4: Quadruple('GOTO', None, None, n - 2)}, "salto de 'fibonacci' a 'global'"),
+        ("llamada anidada", {6: Quadruple('ERA', None, None, 'fibonacci')}, "llamada anidada"),
+    ]
+    for name, changes, expected in broken:
+        quads = [changes.get(i, q) for i, q in enumerate(program.cuadruplos)]
+        try:
+            verify(quads, program.dir_funcs, program.constants)
+        except VerificationError as e:
+            if not any(expected in error for error in e.errors):
+                print(f"❌ VERIFICADOR ({name}): {e.errors}")
+                return
+        else:
+            print(f"❌ VERIFICADOR ({name}): el programa paso la verificacion")
+            return
+    print(f"✔ VERIFICADOR ({len(TESTS)} programas validos, {len(UNVERIFIABLE_PROGRAMS) + len(broken)} rechazados)")
+
+
+def check_program_file():
+    """Cada programa se compila a archivo, se mapea con load_program y corre igual que recien compilado."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (name, code) in enumerate(TESTS):
+            path = os.path.join(tmp, f"programa{i}.pato")
+            compiled = compile_program(code, path)
+            program = load_program(path)
+            if not isinstance(program.cuadruplos.opcodes, memoryview):
+                print(f"❌ ARCHIVO DE PROGRAMA ({name}): los cuadruplos se decodificaron al cargar")
+                return
+            if list(program.cuadruplos.lines) != list(compiled.cuadruplos.lines):
+                print(f"❌ ARCHIVO DE PROGRAMA ({name}): el mapa de lineas no se conservo")
+                return
+            expected = capture_output(code, 'switch')
+            for engine in ('switch', 'table', 'closure'):
+                sink = BufferSink()
+                VirtualMachine.from_program(program, engine=engine, output=sink).run()
+                if sink.getvalue() != expected:
+                    print(f"❌ ARCHIVO DE PROGRAMA ({name}, {engine}): {sink.getvalue()!r} != {expected!r}")
+                    return
+            del program
+    # Una imagen cortada en cualquier parte (opcodes, columnas o metadatos) da el error del formato
+    data = compile_program(TESTS[5][1]).to_image()
+    for size in range(HEADER.size, len(data), 7):
+        try:
+            decode_program(data[:size])
+        except ValueError as e:
+            if "truncada" not in str(e):
+                print(f"❌ ARCHIVO DE PROGRAMA: imagen de {size} bytes: {e}")
+                return
+        except Exception as e:
+            print(f"❌ ARCHIVO DE PROGRAMA: imagen de {size} bytes: {type(e).__name__}: {e}")
+            return
+        else:
+            print(f"❌ ARCHIVO DE PROGRAMA: se cargó una imagen de {size} de {len(data)} bytes")
+            return
+    print(f"✔ ARCHIVO DE PROGRAMA ({len(TESTS)} programas compilados y cargados con mmap)")
+
+
+def check_program_reuse(name, code, threads=4, runs=3):
+    """Un Program se enlaza una vez y corre varias veces (y desde varios hilos) siempre desde cero."""
+    expected = capture_output(code, 'switch')
+    program = Program.from_source(code)
+    for engine in ('table', 'closure', 'switch'):
+        for _ in range(runs):
+            sink = BufferSink()
+            vm = program.run(output=sink, engine=engine)
+            if sink.getvalue() != expected:
+                print(f"❌ PROGRAM REUTILIZABLE ({name}, {engine}): {sink.getvalue()!r} != {expected!r}")
+                return
+            if engine != 'switch' and any(vm.mem[bank] is template for bank, template
+                                          in program.linked.global_templates.items()):
+                print(f"❌ PROGRAM REUTILIZABLE ({name}): la VM escribe en la plantilla global")
+                return
+
+    outputs = []
+
+    def worker():
+        for _ in range(runs):
+            sink = BufferSink()
+            program.run(output=sink)
+            outputs.append(sink.getvalue())
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    if outputs != [expected] * (threads * runs):
+        print(f"❌ PROGRAM REUTILIZABLE ({name}): salidas distintas desde varios hilos")
+        return
+
+    typed = Program(compile_program(code), memory='typed', unchecked=True)
+    sink = BufferSink()
+    typed.run(output=sink, jit=True)
+    if sink.getvalue() != expected:
+        print(f"❌ PROGRAM REUTILIZABLE ({name}, typed unchecked): {sink.getvalue()!r} != {expected!r}")
+        return
+
+    for action, error in ((lambda: setattr(program, 'constants', {}), AttributeError),
+                          (lambda: program.cuadruplos.set_result(0, 0), TypeError),
+                          (lambda: program.vm(memory='typed'), ValueError)):
+        try:
+            action()
+        except error:
+            continue
+        print(f"❌ PROGRAM REUTILIZABLE ({name}): se pudo modificar el Program")
+        return
+    print(f"✔ PROGRAM REUTILIZABLE ({name}: {runs} corridas por motor y {threads} hilos)")
+
+
+# Programas para el backend de C: repr de floats, desbordes de int64 (se rinde y corre en la VM)
+# y un float que recibe un int (no se traduce)
+C_BACKEND_PROGRAMS = [
+    ("floats", True, """
+    programa F;
+    vars x, y, z : float; i : int;
+    main {
+        x = 0.1; y = 0.2; z = x + y;
+        print(z, " ", 1 / 3, " ", 10 / 4, " ", -x, " ", x * 0.0);
+        x = 1.5;
+        i = 0;
+        while (i < 20) do { x = x * 10.0; i = i + 1; };
+        print(" ", x, " ", 1.0 / x, " ", 123456789.0 * 100000000.0, " ", 0.0001, " ", 0.00001);
+        print(" ", i > 2.5, " ", i == 20);
+    }
+    end
+    """),
+    ("desborde de int64", False, """
+    programa O;
+    vars n, f : int;
+    main {
+        n = 1; f = 1;
+        while (n < 30) do { f = f * n; n = n + 1; };
+        print(f);
+    }
+    end
+    """),
+    ("float = int", False, """
+    programa I;
+    vars x : float;
+    main { x = 3; print(x); }
+    end
+    """),
+]
+
+
+def check_c_backend():
+    """Cada programa compilado a C da la misma salida que la VM (o corre en la VM si no se puede)."""
+    compiler = find_compiler()
+    cases = [(name, True, code) for name, code in TESTS] + C_BACKEND_PROGRAMS
+    for name, native, code in cases:
+        expected = capture_output(code, 'switch')
+        c_program = CProgram.from_program(compile_patito_program(code))
+        sink = BufferSink()
+        ran_native = c_program.run(output=sink)
+        if sink.getvalue() != expected:
+            print(f"❌ BACKEND C ({name}): {sink.getvalue()!r} != {expected!r}")
+            return
+        if compiler is not None and ran_native != native:
+            print(f"❌ BACKEND C ({name}): nativo={ran_native}, esperado {native} ({c_program.fallback_reason})")
+            return
+
+    c_program = CProgram.from_program(compile_patito_program(TESTS[5][1]), cc='no-existe-cc')
+    sink = BufferSink()
+    if c_program.run(output=sink) or c_program.fallback_reason != "no hay compilador de C":
+        print("❌ BACKEND C: sin compilador no corrió en la VM")
+        return
+    if sink.getvalue() != capture_output(TESTS[5][1], 'switch'):
+        print("❌ BACKEND C: la VM de respaldo dio otra salida")
+        return
+    where = f"con {os.path.basename(compiler)}" if compiler else "sin compilador, todo en la VM"
+    print(f"✔ BACKEND C ({len(cases)} programas, {where})")
+
+
+def check_c_cache():
+    """El cache de ejecutables es del usuario; uno ajeno o que otros pueden escribir no se corre."""
+    if CACHE_DIR.startswith(tempfile.gettempdir()):
+        print(f"❌ CACHE DEL BACKEND C: el cache por omision esta en {CACHE_DIR}")
+        return
+    compiler = find_compiler()
+    if compiler is None:
+        print("✔ CACHE DEL BACKEND C (sin compilador)")
+        return
+    program = compile_patito_program(TESTS[0][1])
+    expected = capture_output(TESTS[0][1], 'switch')
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = os.path.join(tmp, 'cache')
+        first = CProgram.from_program(program, cache_dir=cache).executable
+        if os.stat(cache).st_mode & 0o777 != 0o700 or CProgram.from_program(program, cache_dir=cache).executable != first:
+            print(f"❌ CACHE DEL BACKEND C: {oct(os.stat(cache).st_mode)} {first}")
+            return
+        # Un ejecutable (o un directorio) que otros pueden escribir se reemplaza por uno nuevo aparte
+        os.chmod(first, 0o777)
+        replaced = CProgram.from_program(program, cache_dir=cache)
+        os.chmod(first, 0o700)
+        os.chmod(cache, 0o777)
+        shared = CProgram.from_program(program, cache_dir=cache)
+        os.chmod(cache, 0o700)
+        for c_program in (replaced, shared):
+            sink = BufferSink()
+            if (os.path.dirname(c_program.executable) == cache or not c_program.run(output=sink)
+                    or sink.getvalue() != expected):
+                print(f"❌ CACHE DEL BACKEND C: se usó {c_program.executable}")
+                return
+            shutil.rmtree(os.path.dirname(c_program.executable))
+    print("✔ CACHE DEL BACKEND C")
+
+
+# Programa para la optimizacion guiada por perfiles: funcion caliente pequeña, funcion que nunca
+# se llama, un salto que casi nunca se toma y un ciclo caliente sin llamadas (lo graba el JIT)
+PGO_PROGRAM = """
+programa P;
+vars i, s, j : int; x : float;
+int cuadrado(n : int) { { return(n * n); } };
+nula nunca(n : int) { { print(n); } };
+main {
+    i = 0; s = 0;
+    while (i < 300) do {
+        s = s + cuadrado(i);
+        if (i > 1000) { nunca(i); };
+        i = i + 1;
+    };
+    j = 0; x = 0.0;
+    while (j < 500) do { x = x + 0.25; j = j + 1; };
+    print(s, " ", x);
+}
+end
+"""
+
+
+def check_pgo():
+    """Los perfiles se acumulan por fuente y guian al JIT y al backend de C sin cambiar la salida."""
+    expected = capture_output(PGO_PROGRAM, 'switch')
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "perfiles.json")
+        for _ in range(2):
+            sink = BufferSink()
+            record_profile(PGO_PROGRAM, path, output=sink)
+            if sink.getvalue() != expected:
+                print(f"❌ PGO: la corrida perfilada dio {sink.getvalue()!r}")
+                return
+        profile = load_profile(path, PGO_PROGRAM)
+        if load_profile(path, TESTS[0][1]) is not None:
+            print("❌ PGO: hay perfil para un fuente que nunca se perfiló")
+            return
+    if profile.runs != 2 or profile.calls.get('cuadrado') != 600 or 'nunca' in profile.calls:
+        print(f"❌ PGO: perfil acumulado incorrecto {profile}")
+        return
+    trips = sorted(profile.trip_count(ip) for ip in profile.loops)
+    if trips != [300.0, 500.0] or 1.0 not in map(profile.taken_ratio, profile.branches):
+        print(f"❌ PGO: ciclos o saltos mal contados {profile.loops} {profile.branches}")
+        return
+
+    # Con el perfil el ciclo caliente se graba aunque el umbral del JIT nunca se alcance
+    traces = []
+    for pgo in (None, profile):
+        sink = BufferSink()
+        vm = Program(compile_patito_program(PGO_PROGRAM), pgo=pgo).run(output=sink, jit=True, jit_threshold=10 ** 9)
+        if sink.getvalue() != expected:
+            print(f"❌ PGO (JIT): {sink.getvalue()!r} != {expected!r}")
+            return
+        traces.append(set(vm.jit.traces))
+    if traces[0] or not traces[1] or not traces[1] <= set(profile.hot_loops()):
+        print(f"❌ PGO: trazas sin perfil {traces[0]}, con perfil {traces[1]}")
+        return
+
+    c_program = CProgram.from_program(compile_patito_program(PGO_PROGRAM), pgo=profile)
+    sink = BufferSink()
+    native = c_program.run(output=sink)
+    if sink.getvalue() != expected:
+        print(f"❌ PGO (C): {sink.getvalue()!r} != {expected!r}")
+        return
+    hints = ('always_inline', '__attribute__((cold, noinline))', '__builtin_expect')
+    if find_compiler() is not None and (not native or not all(h in c_program.source for h in hints)):
+        print(f"❌ PGO (C): el perfil no guió la traducción ({c_program.fallback_reason})")
+        return
+
+    try:
+        Program(compile_patito_program(TESTS[0][1]), pgo=profile)
+    except ValueError:
+        pass
+    else:
+        print("❌ PGO: se aceptó el perfil de otro programa")
+        return
+    print(f"✔ PGO ({profile.runs} corridas, {len(traces[1])} traza por perfil, backend C guiado)")
+
 
 # ===========================================================
 #  TEST CASES
@@ -317,3 +1350,40 @@ if __name__ == "__main__":
     for name, code in TESTS:
         run_patito_program(name, code)
 
+    print("\n" + "="*60)
+    print("PARIDAD ENTRE MOTORES")
+    print("="*60)
+    for name, code in TESTS:
+        check_engine_parity(name, code)
+
+    check_output_limit(*TESTS[0])
+    check_frame_pool(*TESTS[5])
+    check_engine_parity("Recursion de cola", TAIL_CALL_PROGRAM % 10)
+    check_tail_calls()
+    check_engine_parity("Operandos inmediatos", IMMEDIATE_PROGRAM)
+    check_engine_parity("Float con valor int", FLOAT_INT_PROGRAM)
+    check_engine_parity("Variable sin asignar", UNINIT_PROGRAM)
+    check_immediate_operands("Operandos inmediatos", IMMEDIATE_PROGRAM)
+    check_immediate_operands(*TESTS[5])
+    check_instrumentation(*TESTS[5], 'fibonacci', 21891)
+    check_resource_limits()
+    check_batch_engine()
+    check_process_runner()
+    check_runner_cache()
+    check_quad_buffer()
+    check_coverage()
+    check_verifier()
+    check_sampling_profiler(*TESTS[5], 'fibonacci', 12)
+    check_program_file()
+    check_program_reuse(*TESTS[5])
+    check_program_reuse(*TESTS[7])
+    check_c_backend()
+    check_c_cache()
+    check_pgo()
+    check_snapshot(*TESTS[5])
+    check_snapshot(*TESTS[7], pause_every=7)
+    check_async_execution()
+    check_trace_jit(*TESTS[0])
+    check_trace_jit(*TESTS[4])
+    check_trace_jit_accounting(*TESTS[0])
+
@@ -0,0 +1,179 @@
+from linker import BANKS, FRAME_BANKS, is_frame_bank, bank_type
+from semantic_cube import check_types
+
+# ----- JIT de trazas para ciclos -----
+# Cada GOTO hacia atras (el que genera p_ciclo_end al final de un while) marca un ciclo cuyo
+# encabezado es su destino. La VM cuenta cuantas veces se toma cada uno; al pasar el umbral
+# graba la traza de una vuelta (los cuadruplos que de verdad se ejecutan) y la compila a una
+# funcion de Python: las variables viven en locales, los tipos salen del cubo semantico y cada
+# GOTOF de la traza es una guarda. Si una guarda falla la funcion guarda los locales en memoria
+# y regresa el ip donde el interprete debe seguir (salida lateral).
+# Solo se compilan trazas sin llamadas ni ciclos anidados; los demas ciclos se interpretan.
+
+JIT_THRESHOLD = 50  # vueltas de un ciclo antes de grabar su traza
+TRACE_ITERATIONS = 4096  # vueltas maximas por entrada a una traza (la VM recupera el control)
+MAX_TRACE_LENGTH = 1000  # cuadruplos maximos de una traza
+MAX_ATTEMPTS = 3  # grabaciones fallidas antes de dejar el ciclo en el interprete
+
+BINARY_OPS = {'+', '-', '*', '/', '<', '>', '==', '!='}
+
+FUSED_BRANCHES = {
+    'GOTO_IF_NOT_LT': '<',
+    'GOTO_IF_NOT_GT': '>',
+    'GOTO_IF_NOT_EQ': '==',
+    'GOTO_IF_NOT_NE': '!=',
+}
+
+TRACEABLE = BINARY_OPS | set(FUSED_BRANCHES) | {'=', 'uminus', 'RETURN', 'IMPRIME', 'GOTO', 'GOTOF', 'NOP'}
+
+
+class TraceJIT:
+    def __init__(self, vm, threshold=JIT_THRESHOLD, hot_loops=()):
+        self.vm = vm
+        self.threshold = threshold
+        # ip del GOTO hacia atras -> vueltas; los ciclos calientes de un perfil (pgo.py) empiezan
+        # a un paso del umbral y se graban en su primera vuelta
+        self.counts = {ip: threshold - 1 for ip in hot_loops}
+        self.traces = {}  # ip del GOTO hacia atras -> funcion compilada
+        self.attempts = {}
+        self.blacklist = set()
+
+    def back_edge(self, ip, left, right, header):
+        # Handler del GOTO hacia atras (misma firma que los handlers del motor 'table')
+        trace = self.traces.get(ip)
+        if trace is not None:
+            return trace(self.vm.current_frame.stores)
+        if ip in self.blacklist:
+            return header
+        count = self.counts.get(ip, 0) + 1
+        self.counts[ip] = count
+        if count < self.threshold:
+            return header
+        self.counts[ip] = 0
+        return self.record(ip, header)
+
+    def record(self, back_edge, header):
+        # Interpreta una vuelta desde el encabezado grabando el camino; si vuelve al GOTO
+        # hacia atras compila la traza
+        vm = self.vm
+        linked = vm.program.code
+        path = []
+        ip = header
+        while True:
+            op, _, _, res = linked[ip]
+            if ip == back_edge:
+                break
+            if (op not in TRACEABLE or (op == 'GOTO' and res <= ip) or len(path) >= MAX_TRACE_LENGTH):
+                # Llamada, ciclo anidado o traza muy larga: el interprete sigue desde aqui
+                self.give_up(back_edge)
+                return ip
+            nxt = vm.step(ip)
+            path.append((ip, nxt))
+            if nxt is None or not header <= nxt <= back_edge:
+                # La vuelta salio del ciclo (termino o salio por el GOTOF); se intenta otra vez
+                self.give_up(back_edge)
+                return nxt
+            ip = nxt
+
+        self.traces[back_edge] = compile_trace(vm, header, path)
+        return self.traces[back_edge](vm.current_frame.stores)
+
+    def give_up(self, back_edge):
+        self.attempts[back_edge] = self.attempts.get(back_edge, 0) + 1
+        if self.attempts[back_edge] >= MAX_ATTEMPTS:
+            self.blacklist.add(back_edge)
+
+
+def compile_trace(vm, header, path):
+    # Fuente de Python de la traza: carga de variables, ciclo con guardas y escritura de regreso
+    mem = vm.mem
+    layout = vm.current_frame.layout
+    typed = vm.program.typed_bank
+    loads = {}  # variable -> expresion de memoria
+    written = []
+    live_in = []  # variables leidas antes de escribirse: deben tener valor al entrar
+
+    def var(operand):
+        bank, slot = operand
+        if BANKS[bank][0] == 'const':
+            return repr(mem[bank][slot])
+        if is_frame_bank(bank):
+            # Los bancos del frame comparten almacen: la variable se nombra por almacen y slot
+            store = layout.bank_stores[bank - FRAME_BANKS.start]
+            name, source = f"s{store}_{slot}", f"S{store}[{slot}]"
+        else:
+            name, source = f"g{bank}_{slot}", f"G{bank}[{slot}]"
+        loads.setdefault(name, source)
+        return name
+
+    def read(operand):
+        name = var(operand)
+        if name in loads and name not in written and name not in live_in:
+            live_in.append(name)
+        return name
+
+    def write(operand, expr, expr_type):
+        name = var(operand)
+        if typed(operand[0]) and bank_type(operand[0]) == 'float' and expr_type == 'int':
+            # array('d') convierte al guardar; en la traza la conversion se hace explicita
+            expr = f"float({expr})"
+        if name not in written:
+            written.append(name)
+        return f"{name} = {expr}"
+
+    def guard(cond, exit_ip):
+        return [f"if {cond}:", f"    exit_ip = {exit_ip}", "    break"]
+
+    body = []
+    for ip, nxt in path:
+        op, left, right, res = vm.program.code[ip]
+        if op in BINARY_OPS:
+            a, b = read(left), read(right)
+            if op == '/':
+                # Division entre cero: salida lateral para que el interprete lance el error
+                body += guard(f"{b} == 0", ip)
+            expr_type = check_types(op, bank_type(left[0]), bank_type(right[0]))
+            body.append(write(res, f"{a} {op} {b}", expr_type))
+        elif op == '=':
+            body.append(write(res, read(left), bank_type(left[0])))
+        elif op == 'RETURN':
+            body.append(write(left, read(res), bank_type(res[0])))
+        elif op == 'uminus':
+            body.append(write(res, f"-{read(left)}", bank_type(left[0])))
+        elif op == 'IMPRIME':
+            value = read(res)
+            if typed(res[0]) and bank_type(res[0]) == 'bool':
+                value = f"bool({value})"
+            body.append(f"out(str({value}))")
+        elif op == 'GOTOF':
+            cond = read(left)
+            body += guard(f"not {cond}", res) if nxt == ip + 1 else guard(cond, ip + 1)
+        elif op in FUSED_BRANCHES:
+            cond = f"{read(left)} {FUSED_BRANCHES[op]} {read(right)}"
+            body += guard(f"not ({cond})", res) if nxt == ip + 2 else guard(cond, ip + 2)
+
+    stores = sorted({source.split('[')[0] for source in loads.values() if source.startswith('S')})
+    banks = sorted({source.split('[')[0] for source in loads.values() if source.startswith('G')})
+
+    lines = ["def make(mem, out):"]
+    lines += [f"    {bank} = mem[{bank[1:]}]" for bank in banks]
+    lines.append("    def trace(stores):")
+    lines += [f"        {store} = stores[{store[1:]}]" for store in stores]
+    lines += [f"        {name} = {loads[name]}" for name in loads]
+    if live_in and not vm.unchecked:
+        # Una variable sin valor haria fallar la traza a medias: esa vuelta la corre el interprete
+        # (con unchecked=True el verificador ya descarto lecturas antes de asignar)
+        lines.append(f"        if {' or '.join(f'{name} is None' for name in live_in)}:")
+        lines.append(f"            return {header}")
+    lines.append(f"        exit_ip = {header}")
+    lines.append(f"        for _ in range({TRACE_ITERATIONS}):")
+    lines += [f"            {line}" for line in body]
+    lines += [f"        {loads[name]} = {name}" for name in written]
+    lines.append("        return exit_ip")
+    lines.append("    return trace")
+
+    namespace = {}
+    exec("\n".join(lines) + "\n", namespace)
+    trace = namespace['make'](mem, vm.write_output)
+    trace.source = "\n".join(lines)
+    return trace
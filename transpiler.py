@@ -0,0 +1,202 @@
+import sys
+
+from output_sink import StreamSink
+from linker import BANKS, link, quad_owners, is_frame_bank
+
+# ----- Backend de Python -----
+# Traduce los cuadruplos enlazados a codigo fuente de Python: cada funcion de Patito es una
+# funcion de Python, sus bloques basicos son estados de una maquina de estados (pc) y cada
+# slot de memoria es una variable (locales y temporales como variables locales, globales
+# como variables del modulo). El fuente se compila una sola vez con compile().
+# IMPRIME escribe con out(texto), el write() del sink de salida, igual que la VM.
+
+BINARY_OPS = {'+', '-', '*', '/', '<', '>', '==', '!='}
+
+RECURSION_LIMIT = 20000  # limite de recursion de Python mientras corre el programa traducido
+
+
+def func_name(name):
+    # 'global' es palabra reservada de Python; todas las funciones llevan prefijo
+    return f"pf_{name}"
+
+
+def var_name(operand, mem):
+    # Nombre de Python (o literal) de un operando enlazado (banco, slot)
+    bank, slot = operand
+    if BANKS[bank][0] == 'const':
+        return repr(mem[bank][slot])
+    if is_frame_bank(bank):
+        return f"f{bank}_{slot}"
+    return f"g{bank}_{slot}"
+
+
+def basic_blocks(indices, code):
+    # Separa los cuadruplos de una funcion en bloques basicos: [(lider, [indices])]
+    leaders = {indices[0]}
+    for i in indices:
+        op, _, _, res = code[i]
+        if op in ('GOTO', 'GOTOF'):
+            leaders.add(res)
+            leaders.add(i + 1)
+    blocks = []
+    for i in indices:
+        if i in leaders or not blocks:
+            blocks.append((i, []))
+        blocks[-1][1].append(i)
+    return blocks
+
+
+class _FunctionWriter:
+    # Genera el fuente de una funcion de Patito
+    def __init__(self, name, layout, indices, program, mem):
+        self.name = name
+        self.layout = layout
+        self.indices = indices
+        self.program = program
+        self.mem = mem
+        self.globals = set()
+        self.locals = set()
+
+    def operand(self, operand):
+        name = var_name(operand, self.mem)
+        segment = BANKS[operand[0]][0]
+        if segment == 'global':
+            self.globals.add(name)
+        elif segment != 'const':
+            self.locals.add(name)
+        return name
+
+    def statements(self, i, arg_names):
+        # Sentencias de Python para el cuadruplo i; regresa (lineas, termina_bloque)
+        code = self.program.code
+        op, left, right, res = code[i]
+
+        if op in BINARY_OPS:
+            return [f"{self.operand(res)} = {self.operand(left)} {op} {self.operand(right)}"], False
+        if op == '=':
+            return [f"{self.operand(res)} = {self.operand(left)}"], False
+        if op == 'RETURN':
+            # RETURN solo deja el valor en el return_address; el control sigue hasta ENDFUNC
+            return [f"{self.operand(left)} = {self.operand(res)}"], False
+        if op == 'uminus':
+            return [f"{self.operand(res)} = -{self.operand(left)}"], False
+        if op == 'IMPRIME':
+            return [f"out(str({self.operand(res)}))"], False
+        if op == 'ERA':
+            arg_names.clear()
+            return [], False
+        if op == 'PARAM':
+            arg = f"arg{len(arg_names)}"
+            self.locals.add(arg)
+            arg_names.append(arg)
+            return [f"{arg} = {self.operand(left)}"], False
+        if op == 'GOSUB':
+            # res es el FrameLayout de la funcion llamada
+            call = f"{func_name(res.name)}({', '.join(arg_names)})"
+            arg_names.clear()
+            return [call], False
+        if op == 'GOTO':
+            return self.jump(res, i), True
+        if op == 'GOTOF':
+            # GOTOF siempre cierra un bloque: el siguiente cuadruplo es lider
+            cond = self.operand(left)
+            if res > i:
+                return [f"pc = {i + 1} if {cond} else {res}"], True
+            return [f"if not {cond}:", f"    pc = {res}", "    continue", f"pc = {i + 1}"], True
+        if op == 'ENDFUNC':
+            return ["return"], True
+        if op == 'END':
+            return ["out('\\n')", "return"], True
+        raise RuntimeError(f"Operación de cuádruplo no soportada: {op}")
+
+    def jump(self, target, i):
+        # Los estados van en orden: un salto hacia adelante solo cambia pc y sigue bajando
+        # por la cadena de if; uno hacia atras (back-edge de un while) reinicia el ciclo
+        if target > i:
+            return [f"pc = {target}"]
+        return [f"pc = {target}", "continue"]
+
+    def source(self):
+        code = self.program.code
+        blocks = basic_blocks(self.indices, code)
+        arg_names = []
+        body = []
+        single = len(blocks) == 1 and code[blocks[0][1][-1]][0] not in ('GOTO', 'GOTOF')
+        for n, (leader, block) in enumerate(blocks):
+            lines = []
+            ends = False
+            for i in block:
+                stmts, ends = self.statements(i, arg_names)
+                lines.extend(stmts)
+            if not ends:
+                # Cae al siguiente bloque (o termina si es el ultimo)
+                if n + 1 < len(blocks):
+                    lines.append(f"pc = {blocks[n + 1][0]}")
+                else:
+                    lines.append("return")
+            if single:
+                body.extend(lines)
+            else:
+                body.append(f"if pc == {leader}:")
+                body.extend(f"    {line}" for line in lines)
+
+        params = [var_name(p, self.mem) for p in self.layout.params]
+        out = [f"def {func_name(self.name)}({', '.join(params)}):"]
+        if self.globals:
+            out.append(f"    global {', '.join(sorted(self.globals))}")
+        # Los slots no escritos valen None, igual que en la VM
+        uninit = sorted(self.locals - set(params))
+        if uninit:
+            out.append(f"    {' = '.join(uninit)} = None")
+        if single:
+            out.extend(f"    {line}" for line in body)
+        else:
+            out.append(f"    pc = {blocks[0][0]}")
+            out.append("    while True:")
+            out.extend(f"        {line}" for line in body)
+        return "\n".join(out) + "\n"
+
+
+def transpile(cuadruplos, dir_funcs, constant_table):
+    # Regresa el fuente de Python equivalente al programa
+    program = link(cuadruplos, dir_funcs, constant_table)
+    mem, _ = program.new_memory()
+    owners = quad_owners(cuadruplos, dir_funcs)
+
+    chunks = ["# Generado por transpiler.py a partir de los cuadruplos de Patito\n"]
+
+    # Globales del programa (incluye los return_address de las funciones)
+    global_names = [f"g{bank}_{slot}" for bank, size in program.global_sizes.items() for slot in range(size)]
+    if global_names:
+        chunks.append(f"{' = '.join(global_names)} = None\n")
+
+    for name, layout in program.layouts.items():
+        if layout.start_quad is None:
+            continue
+        indices = [i for i in range(layout.start_quad, len(cuadruplos)) if owners[i] == name]
+        chunks.append(_FunctionWriter(name, layout, indices, program, mem).source())
+
+    return "\n".join(chunks)
+
+
+class PythonProgram:
+    # Programa de Patito compilado a un code object de Python
+    def __init__(self, cuadruplos, dir_funcs, constant_table):
+        self.source = transpile(cuadruplos, dir_funcs, constant_table)
+        self.code = compile(self.source, "<patito>", "exec")
+
+    def run(self, output=None):
+        # output: sink de salida (output_sink.py); por omision un StreamSink a stdout
+        output = output if output is not None else StreamSink()
+        namespace = {'out': output.write}
+        exec(self.code, namespace)
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+        try:
+            namespace[func_name('global')]()
+        except RecursionError:
+            raise RuntimeError("Recursión demasiado profunda para el backend de Python; use la VM")
+        finally:
+            sys.setrecursionlimit(limit)
+            # La salida pendiente se entrega aunque el programa falle
+            output.flush()
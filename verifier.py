@@ -0,0 +1,261 @@
+from linker import OPERAND_KINDS, BANKS, classify, is_frame_bank, is_const_bank, quad_owners
+
+# ----- Verificador de cuadruplos -----
+# Revisa una sola vez los cuadruplos (los del compilador, antes de optimizar) contra el directorio
+# de funciones y la tabla de constantes:
+#   - opcodes conocidos, direcciones validas y funciones existentes (con start_quad y
+#     return_address donde se necesitan)
+#   - saltos dentro del programa y dentro de la funcion que los contiene
+#   - ERA/PARAM/GOSUB balanceados en todos los caminos: cada PARAM y GOSUB tiene su ERA, los
+#     parametros van en orden y completos, y no hay un ERA encimado sobre otro pendiente
+#   - asignacion definitiva: ningun camino lee una local o temporal (o, en main, una global)
+#     antes de escribirla, y toda funcion con tipo ejecuta un RETURN antes de su ENDFUNC
+# Las globales leidas dentro de funciones no se revisan: dependen de quien llama. En main una
+# llamada cuenta como escritura de las globales que la funcion (o lo que llama) escribe en
+# todos sus caminos.
+# Un programa que pasa puede correr con VirtualMachine(..., unchecked=True).
+# check_typed() agrega lo que necesita memory='typed' (ver linker.py).
+
+BASE_OPS = {op for op in OPERAND_KINDS if op not in ('NOP', 'CALL', 'TAILCALL') and not op.startswith('GOTO_IF')}
+WRITES = {'=', '+', '-', '*', '/', '<', '>', '==', '!=', 'uminus'}
+
+
+class VerificationError(RuntimeError):
+    def __init__(self, errors):
+        super().__init__("El programa no pasó la verificación:\n" + "\n".join(f"  - {e}" for e in errors))
+        self.errors = errors
+
+
+def verify(cuadruplos, dir_funcs, constant_table):
+    # Regresa None si el programa es valido; si no lanza VerificationError con todos los errores
+    quads = [(q.op, q.left_op, q.right_op, q.result) for q in cuadruplos]
+    n = len(quads)
+    owners = quad_owners(cuadruplos, dir_funcs)
+    functions = dir_funcs.functions
+    errors = []
+
+    def error(ip, message):
+        text = f"cuádruplo {ip}: {message}"
+        if text not in errors:
+            errors.append(text)
+
+    names = {}  # (funcion, direccion) -> nombre de la variable
+    for fname, f in functions.items():
+        for var in f.var_table.table.values():
+            names[(fname, var.address)] = var.name
+
+    def describe(owner, address):
+        name = names.get((owner, address)) or names.get(('global', address))
+        return f"'{name}'" if name else f"el temporal {address}"
+
+    # ------------------ Operandos ------------------
+    def check_address(ip, address):
+        if isinstance(address, str):
+            f = functions.get(address)
+            if f is None or f.return_address is None:
+                error(ip, f"lee el valor de retorno de '{address}' sin return_address")
+            return
+        try:
+            bank, _ = classify(address)
+        except RuntimeError:
+            error(ip, f"dirección inválida {address!r}")
+            return
+        if is_const_bank(bank) and address not in constant_table:
+            error(ip, f"constante {address} fuera de la tabla de constantes")
+
+    for ip, (op, left, right, res) in enumerate(quads):
+        if op not in BASE_OPS:
+            error(ip, f"operación no soportada {op!r}")
+            continue
+        for kind, value in zip(OPERAND_KINDS[op], (left, right, res)):
+            if kind == 'addr':
+                if value is None:
+                    error(ip, f"{op} sin operando")
+                else:
+                    check_address(ip, value)
+            elif kind == 'jump':
+                if not isinstance(value, int) or not 0 <= value <= n:
+                    error(ip, f"salto a {value!r} fuera del programa")
+                elif value < n and owners[value] != owners[ip]:
+                    error(ip, f"salto de '{owners[ip]}' a '{owners[value]}'")
+            elif kind == 'func':
+                f = functions.get(value)
+                if f is None or (op == 'GOSUB' and f.start_quad is None):
+                    error(ip, f"{op} a función '{value}' sin start_quad")
+            elif kind == 'param':
+                if not (isinstance(value, str) and value[:1] == 'P' and value[1:].isdigit()):
+                    error(ip, f"etiqueta de parámetro inválida {value!r}")
+        if op == 'RETURN' and functions[owners[ip]].return_address is None:
+            error(ip, f"RETURN en función '{owners[ip]}' sin return_address")
+    if errors:
+        raise VerificationError(errors)
+
+    def successors(ip, op, res):
+        if op == 'GOTO':
+            return [res]
+        if op == 'GOTOF':
+            return [ip + 1, res]
+        if op in ('ENDFUNC', 'END'):
+            return []
+        return [ip + 1]
+
+    # Globales que cada funcion escribe en todos sus caminos (directo o en lo que llama): mismo
+    # flujo con interseccion en las uniones, del start_quad a cada ENDFUNC. Empieza sin
+    # escrituras y crece hasta estabilizarse, asi la recursion nunca agrega de mas.
+    def global_writes(op, res, owner):
+        if op in WRITES and BANKS[classify(res)[0]][0] == 'global':
+            return {res}
+        if op == 'RETURN':
+            return {functions[owner].return_address}
+        if op == 'GOSUB':
+            return writes[res]
+        return frozenset()
+
+    def function_writes(name, start):
+        seen = {start: frozenset()}
+        work = [start]
+        exits = None
+        while work:
+            ip = work.pop()
+            op, _, _, res = quads[ip]
+            written = seen[ip] | global_writes(op, res, name)
+            if op == 'ENDFUNC':
+                exits = written if exits is None else exits & written
+            for nxt in successors(ip, op, res):
+                if nxt >= n:
+                    continue
+                old = seen.get(nxt)
+                merged = written if old is None else old & written
+                if merged != old:
+                    seen[nxt] = merged
+                    work.append(nxt)
+        return exits or frozenset()
+
+    writes = {name: frozenset() for name in functions}
+    changed = True
+    while changed:
+        changed = False
+        for name, f in functions.items():
+            if name != 'global' and f.start_quad is not None:
+                written = function_writes(name, f.start_quad)
+                if written != writes[name]:
+                    writes[name] = written
+                    changed = True
+
+    # ------------------ Flujo: llamadas y asignacion definitiva ------------------
+    # Estado en cada cuadruplo: (llamada pendiente (funcion, parametros pasados) o None,
+    # direcciones ya escritas en todos los caminos, RETURN ejecutado en todos los caminos)
+    def tracked(owner, address):
+        if isinstance(address, str):
+            return False
+        bank = classify(address)[0]
+        return is_frame_bank(bank) or (owner == 'global' and BANKS[bank][0] == 'global')
+
+    states = {}
+    work = []
+
+    def flow(ip, state):
+        if ip >= n:
+            return
+        old = states.get(ip)
+        if old is None:
+            states[ip] = state
+            work.append(ip)
+            return
+        pending, assigned, returned = old
+        if state[0] != pending:
+            error(ip, "llega con llamadas (ERA/PARAM) distintas por caminos distintos")
+            return
+        merged = (pending, assigned & state[1], returned and state[2])
+        if merged != old:
+            states[ip] = merged
+            work.append(ip)
+
+    flow(0, (None, frozenset(), False))
+    for name, f in functions.items():
+        if name != 'global' and f.start_quad is not None:
+            params = frozenset(f.var_table.table[p].address for p in f.param_names)
+            flow(f.start_quad, (None, params, False))
+
+    while work:
+        ip = work.pop()
+        op, left, right, res = quads[ip]
+        owner = owners[ip]
+        pending, assigned, returned = states[ip]
+
+        reads = [value for position, (kind, value) in enumerate(zip(OPERAND_KINDS[op], (left, right, res)))
+                 if kind == 'addr' and not (op in WRITES and position == 2)]
+        for value in reads:
+            if tracked(owner, value) and value not in assigned:
+                error(ip, f"lee {describe(owner, value)} antes de asignarla")
+
+        if op in WRITES:
+            assigned = assigned | {res}
+        elif op == 'RETURN':
+            returned = True
+        elif op == 'ERA':
+            if pending is not None:
+                error(ip, f"ERA de '{res}' antes del GOSUB de '{pending[0]}' (llamada anidada)")
+            pending = (res, 0)
+        elif op == 'PARAM':
+            k = int(res[1:])
+            if pending is None:
+                error(ip, "PARAM sin un ERA previo")
+            elif k != pending[1] + 1 or k > len(functions[pending[0]].param_names):
+                error(ip, f"PARAM {res} fuera de orden para '{pending[0]}'")
+            else:
+                pending = (pending[0], k)
+        elif op == 'GOSUB':
+            if pending is None:
+                error(ip, "GOSUB sin ERA previo")
+            elif pending[0] != res:
+                error(ip, f"GOSUB a '{res}' con el ERA de '{pending[0]}'")
+            elif pending[1] != len(functions[res].param_names):
+                error(ip, f"GOSUB a '{res}' con {pending[1]} de {len(functions[res].param_names)} parámetros")
+            pending = None
+            if owner == 'global':
+                assigned = assigned | writes[res]
+        elif op == 'ENDFUNC':
+            if pending is not None:
+                error(ip, f"ENDFUNC con el ERA de '{pending[0]}' pendiente")
+            if functions[owner].return_address is not None and not returned:
+                error(ip, f"'{owner}' puede terminar sin RETURN")
+
+        for nxt in successors(ip, op, res):
+            flow(nxt, (pending, assigned, returned))
+
+    if errors:
+        raise VerificationError(errors)
+
+
+def check_typed(cuadruplos, dir_funcs, constant_table):
+    # Lo que necesita memory='typed' (ver linker.py): el programa pasa verify() y ningun int se
+    # guarda en un float (=, PARAM, RETURN). En la VM de referencia ese float seguiria siendo int
+    # y se imprimiria como int; un array('d') lo convertiria a float.
+    verify(cuadruplos, dir_funcs, constant_table)
+    functions = dir_funcs.functions
+
+    def type_of(operand):
+        if isinstance(operand, str):
+            operand = functions[operand].return_address
+        return BANKS[classify(operand)[0]][1]
+
+    owners = quad_owners(cuadruplos, dir_funcs)
+    errors = []
+    pending = []  # ERA abiertos (las llamadas se anidan en los argumentos)
+    for ip, q in enumerate(cuadruplos):
+        op, left, res = q.op, q.left_op, q.result
+        if op == 'ERA':
+            pending.append(res)
+        elif op == 'GOSUB' and pending:
+            pending.pop()
+        elif op == 'PARAM' and pending:
+            target = functions[pending[-1]].param_types[int(res[1:]) - 1]
+            if target == 'float' and type_of(left) == 'int':
+                errors.append(f"cuádruplo {ip}: {res} de '{pending[-1]}' es float y recibe un int")
+        elif op == '=' and type_of(res) == 'float' and type_of(left) == 'int':
+            errors.append(f"cuádruplo {ip}: un float recibe un int")
+        elif op == 'RETURN' and type_of(owners[ip]) == 'float' and type_of(res) == 'int':
+            errors.append(f"cuádruplo {ip}: '{owners[ip]}' regresa float y recibe un int")
+    if errors:
+        raise VerificationError(errors)
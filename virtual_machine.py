@@ -1,5 +1,52 @@
-from quads import Quadruple
+import asyncio
+import operator
+import time
+
+from quads import Quadruple, QuadBuffer
 from semantics import FuncDirectory
+from linker import link, bank_type, is_const_bank, split_moves, quad_owners, FRAME_BANKS, FRAME_POOL_SIZE
+from closure_engine import compile_closures
+from optimizer import fuse_superinstructions, eliminate_tail_calls
+from output_sink import StreamSink, BufferSink
+from instrumentation import ExecutionProfile
+from governor import ResourceGovernor
+from snapshot import dump_state, load_state
+from trace_jit import TraceJIT, JIT_THRESHOLD
+from quad_coverage import CoverageMap, install_probes, branch_targets
+from verifier import verify, check_typed
+
+# Operaciones para plegar cuadruplos con dos constantes al decodificar
+FOLD_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '<': operator.lt,
+    '>': operator.gt,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+FUSED_BRANCH_OPS = {
+    'GOTO_IF_NOT_LT': '<',
+    'GOTO_IF_NOT_GT': '>',
+    'GOTO_IF_NOT_EQ': '==',
+    'GOTO_IF_NOT_NE': '!=',
+}
+
+# Con la constante a la izquierda: operacion equivalente con los operandos volteados
+SWAPPED_OPS = {
+    '+': '+',
+    '*': '*',
+    '<': '>',
+    '>': '<',
+    '==': '==',
+    '!=': '!=',
+    'GOTO_IF_NOT_LT': 'GOTO_IF_NOT_GT',
+    'GOTO_IF_NOT_GT': 'GOTO_IF_NOT_LT',
+    'GOTO_IF_NOT_EQ': 'GOTO_IF_NOT_EQ',
+    'GOTO_IF_NOT_NE': 'GOTO_IF_NOT_NE',
+}
 
 class MemorySegment:
     # Memoria simple, guarda diccionario direccion -> valor
@@ -22,18 +69,42 @@ class MemoryFrame:
 
 
 class VirtualMachine:
-    def __init__(self, cuadruplos, dir_funcs, constant_table):
+    # Motores disponibles: 'table' (despacho por tabla), 'closure' (un closure por cuadruplo)
+    # y 'switch' (cadena if/elif de referencia)
+    ENGINES = ('table', 'closure', 'switch')
+
+    def __init__(self, cuadruplos, dir_funcs, constant_table, engine='table', memory='list',
+                 superinstructions=True, tail_calls=True, output=None, instrument=False,
+                 jit=False, jit_threshold=JIT_THRESHOLD, coverage=False, unchecked=False, linked=None,
+                 pgo=None):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Motor de ejecución desconocido: {engine}")
+        if instrument and engine == 'switch':
+            raise ValueError("La instrumentación requiere un motor enlazado ('table' o 'closure')")
+        if jit and engine == 'switch':
+            raise ValueError("El JIT de trazas requiere un motor enlazado ('table' o 'closure')")
+        if jit and (instrument or coverage):
+            # Una traza corre hasta TRACE_ITERATIONS vueltas sin pasar por los contadores
+            raise ValueError("El JIT de trazas no se puede combinar con instrumentación ni cobertura")
+        if coverage and engine == 'switch':
+            raise ValueError("La cobertura requiere un motor enlazado ('table' o 'closure')")
+        if unchecked and engine == 'switch':
+            raise ValueError("El modo sin revisiones requiere un motor enlazado ('table' o 'closure')")
+        if linked is not None and engine == 'switch':
+            raise ValueError("Un programa ya enlazado requiere un motor enlazado ('table' o 'closure')")
+        if memory == 'typed' and engine != 'switch' and linked is None:
+            # Los arreglos tipados no distinguen un slot sin asignar ni un int dentro de un float
+            check_typed(cuadruplos, dir_funcs, constant_table)
+        elif unchecked and linked is None:
+            # El verificador revisa una vez lo que los handlers revisarian en cada llamada
+            # (un Program ya enlazado se verifico al crearse)
+            verify(cuadruplos, dir_funcs, constant_table)
+        self.unchecked = unchecked
+
         self.cuadruplos = cuadruplos
         self.dir_funcs = dir_funcs
         self.const_mem = constant_table
 
-        # Memoria global (1000-3999)
-        self.global_mem = MemorySegment()
-
-        # Frame actual (main / global) y nombre de función actual
-        self.current_frame = MemoryFrame("global")
-        self.current_func_name = "global"
-
         # Pila de llamadas
         self.call_stack = []
 
@@ -43,6 +114,130 @@ class VirtualMachine:
         # Instruction pointer: indice de cuadruplo actual
         self.ip = 0
 
+        # Salida de IMPRIME: por defecto sys.stdout con buffer, se vacia al terminar run()
+        self.output = output if output is not None else StreamSink()
+        self.write_output = self.output.write
+
+        # Contadores por cuadruplo/opcode/funcion (solo con instrument=True)
+        self.profile = None
+
+        # Bitmaps de cobertura de cuadruplos y saltos (solo con coverage=True); ver quad_coverage.py
+        self.coverage = None
+
+        # JIT de trazas para ciclos calientes (solo con jit=True); ver trace_jit.py
+        self.jit = None
+
+        self.engine = engine
+        if engine == 'switch':
+            # Memoria global (1000-3999)
+            self.global_mem = MemorySegment()
+
+            # Frame actual (main / global) y nombre de función actual
+            self.current_frame = MemoryFrame("global")
+            self.current_func_name = "global"
+            return
+
+        # Enlace al cargar: operandos resueltos a (banco, slot), memoria como lista de bancos
+        # memory='typed' usa arreglos tipados (array('q'), array('d'), bytearray) en los bancos
+        # del frame; solo para programas que pasan verifier.check_typed()
+        # superinstructions=True fusiona relacional+GOTOF y ERA/PARAM/GOSUB/= antes de enlazar
+        # tail_calls=True cambia la recursion en posicion de cola por TAILCALL (sin crecer la pila)
+        # linked: LinkedProgram compartido (ver program.Program); memory, superinstructions y
+        # tail_calls ya se aplicaron al enlazarlo
+        if linked is None:
+            if tail_calls:
+                cuadruplos = eliminate_tail_calls(cuadruplos, dir_funcs)
+            if superinstructions:
+                cuadruplos = fuse_superinstructions(cuadruplos, dir_funcs)
+            linked = link(cuadruplos, dir_funcs, constant_table, memory)
+        self.program = linked
+        self.layouts = self.program.layouts
+        self.mem, self.current_frame = self.program.new_memory()
+        # Registros de activacion liberados por ENDFUNC, uno por funcion (layout.index)
+        self.frame_pools = [[] for _ in self.layouts]
+
+        # Decodificacion al cargar: cada cuadruplo se traduce una sola vez a su handler
+        self.handlers = {
+            '=': self._op_assign,
+            '+': self._op_add,
+            '-': self._op_sub,
+            '*': self._op_mul,
+            '/': self._op_div,
+            '<': self._op_lt,
+            '>': self._op_gt,
+            '==': self._op_eq,
+            '!=': self._op_ne,
+            'uminus': self._op_uminus,
+            'GOTO': self._op_goto,
+            'GOTOF': self._op_gotof,
+            'IMPRIME': self._op_imprime,
+            'ERA': self._op_era,
+            'PARAM': self._op_param,
+            'GOSUB': self._op_gosub,
+            'RETURN': self._op_return,
+            'ENDFUNC': self._op_endfunc,
+            'END': self._op_end,
+            'NOP': self._op_nop,
+            'GOTO_IF_NOT_LT': self._op_goto_if_not_lt,
+            'GOTO_IF_NOT_GT': self._op_goto_if_not_gt,
+            'GOTO_IF_NOT_EQ': self._op_goto_if_not_eq,
+            'GOTO_IF_NOT_NE': self._op_goto_if_not_ne,
+            'CALL': self._op_call,
+            'TAILCALL': self._op_tailcall,
+        }
+        # Variantes con operando inmediato: la constante va en el cuadruplo decodificado
+        # (right o left es el valor, no un (banco, slot)) y no se lee de la memoria
+        self.right_immediate = {
+            '=': self._op_assign_k,
+            '+': self._op_add_k,
+            '-': self._op_sub_k,
+            '*': self._op_mul_k,
+            '/': self._op_div_k,
+            '<': self._op_lt_k,
+            '>': self._op_gt_k,
+            '==': self._op_eq_k,
+            '!=': self._op_ne_k,
+            'GOTO_IF_NOT_LT': self._op_goto_if_not_lt_k,
+            'GOTO_IF_NOT_GT': self._op_goto_if_not_gt_k,
+            'GOTO_IF_NOT_EQ': self._op_goto_if_not_eq_k,
+            'GOTO_IF_NOT_NE': self._op_goto_if_not_ne_k,
+        }
+        self.left_immediate = {
+            '-': self._op_k_sub,
+            '/': self._op_k_div,
+        }
+        if unchecked:
+            # Programa verificado: ERA/PARAM/GOSUB balanceados, sin revisar next_frame
+            self.handlers['PARAM'] = self._op_param_unchecked
+            self.handlers['GOSUB'] = self._op_gosub_unchecked
+        if jit:
+            # pgo: ProgramProfile (pgo.py) de corridas anteriores; dice que ciclos son calientes
+            hot_loops = ()
+            if pgo is not None:
+                pgo.check(self.cuadruplos)
+                hot_loops = pgo.hot_loops()
+            self.jit = TraceJIT(self, jit_threshold, hot_loops)
+        if engine == 'closure':
+            self.code = compile_closures(self, self.program.code)
+        else:
+            self.code = self.decode(self.program.code)
+
+        if coverage:
+            self.coverage = CoverageMap.for_program(self.cuadruplos)
+            install_probes(self, self.coverage)
+
+        if instrument:
+            # Un lugar extra para el centinela que termina la ejecucion
+            ops = [q[0] for q in self.program.code] + ['HALT']
+            owners = quad_owners(cuadruplos, dir_funcs) + ['global']
+            lines = [self.source_line(ip) for ip in range(len(ops))]
+            self.profile = ExecutionProfile(engine, ops, owners, lines)
+
+    @classmethod
+    def from_program(cls, program, **options):
+        # VM para un CompiledProgram (program.py); options son las del constructor
+        return cls(program.cuadruplos, program.dir_funcs, program.constants, **options)
+
     def read(self, addr_or_name):
         # Lee el valor y determina que segmento  usar segun rango de dir
         if isinstance(addr_or_name, str):
@@ -57,21 +252,21 @@ class VirtualMachine:
         if address is None:
             return None
 
-        # Constantes
-        if address in self.const_mem:
-            return self.const_mem[address]
-
-        # Globales
-        if 1000 <= address < 4000:
-            return self.global_mem.get(address)
+        # Temporales
+        if 7000 <= address < 10000:
+            return self.current_frame.temp.get(address)
 
         # Locales
         if 4000 <= address < 7000:
             return self.current_frame.local.get(address)
 
-        # Temporales
-        if 7000 <= address < 10000:
-            return self.current_frame.temp.get(address)
+        # Globales
+        if 1000 <= address < 4000:
+            return self.global_mem.get(address)
+
+        # Constantes: solo se consultan para direcciones fuera de los rangos de variables
+        if address in self.const_mem:
+            return self.const_mem[address]
 
         raise RuntimeError(f"Invalid address: {address}")
 
@@ -87,11 +282,594 @@ class VirtualMachine:
             raise RuntimeError(f"Invalid address: {address}")
 
 
-    def run(self):
+    def decode(self, linked_code):
+        # Traduce cada cuadruplo enlazado (op, left, right, res) a (handler, left, right, res)
+        code = []
+        for ip, (op, left, right, res) in enumerate(linked_code):
+            handler = self.handlers.get(op)
+            if handler is None:
+                raise RuntimeError(f"Operación de cuádruplo no soportada: {op}")
+            if op == 'IMPRIME' and self.program.typed_bank(res[0]) and bank_type(res[0]) == 'bool':
+                # Un bytearray guarda 0/1; se imprime como True/False igual que el modo 'list'
+                handler = self._op_imprime_bool
+            if self.jit is not None and op == 'GOTO' and res <= ip:
+                # GOTO hacia atras: fin de un ciclo, lo cuenta el JIT
+                handler = self.jit.back_edge
+            immediate = self.decode_immediate(ip, op, left, right, res)
+            if immediate is not None:
+                code.append(immediate)
+                continue
+            code.append((handler, left, right, res))
+
+        # Centinela: salir del final de la lista termina la ejecucion igual que antes
+        code.append((self._op_halt, None, None, None))
+        return code
+
+    def decode_immediate(self, ip, op, left, right, res):
+        # Cuadruplo con operandos constantes -> (handler, left, right, res) con los valores ya
+        # puestos en el cuadruplo; None si no lleva constantes
+        mem = self.mem
+
+        def const(operand):
+            return isinstance(operand, tuple) and len(operand) == 2 and is_const_bank(operand[0])
+
+        def value(operand):
+            return mem[operand[0]][operand[1]]
+
+        if op in FOLD_OPS or op in FUSED_BRANCH_OPS:
+            kl, kr = const(left), const(right)
+            if kl and kr:
+                # Dos constantes: se pliega al decodificar (la division entre cero se deja
+                # para que falle al ejecutarse, igual que antes)
+                fold = FOLD_OPS[FUSED_BRANCH_OPS.get(op, op)]
+                try:
+                    result = fold(value(left), value(right))
+                except ZeroDivisionError:
+                    return (self.left_immediate['/'], value(left), right, res)
+                if op in FUSED_BRANCH_OPS:
+                    return (self._op_goto, None, None, ip + 2 if result else res)
+                return (self._op_assign_k, result, None, res)
+            if kr:
+                return (self.right_immediate[op], left, value(right), res)
+            if kl:
+                if op in SWAPPED_OPS:
+                    return (self.right_immediate[SWAPPED_OPS[op]], right, value(left), res)
+                return (self.left_immediate[op], value(left), right, res)
+            return None
+
+        if op == '=' and const(left):
+            return (self._op_assign_k, value(left), None, res)
+        if op == 'uminus' and const(left):
+            return (self._op_assign_k, -value(left), None, res)
+        if op == 'GOTOF' and const(left):
+            return (self._op_nop, None, None, None) if value(left) else (self._op_goto, None, None, res)
+        if op == 'IMPRIME' and const(res):
+            return (self._op_imprime_k, None, None, str(value(res)))
+        if op == 'PARAM' and const(left):
+            return (self._op_param_k_unchecked if self.unchecked else self._op_param_k, value(left), None, res)
+        if op == 'RETURN' and const(res):
+            return (self._op_return_k, left, None, value(res))
+        if op in ('CALL', 'TAILCALL'):
+            # Los argumentos constantes se separan con su valor: (de variables, de constantes)
+            return (self.handlers[op], split_moves(left, mem), right, res)
+        return None
+
+    def step(self, ip):
+        # Ejecuta un solo cuadruplo del codigo decodificado y regresa el siguiente ip
+        if self.engine == 'closure':
+            return self.code[ip]()
+        handler, left, right, res = self.code[ip]
+        return handler(ip, left, right, res)
+
+    def run(self, max_quads=None, max_time=None, max_stack_depth=None, max_cells=None,
+            cancel_token=None, check_interval=4096, sampler=None):
         # Ejecuto todos los cuadruplos hasta llegar al END
-        while self.ip < len(self.cuadruplos):
-            q = self.cuadruplos[self.ip]
-            op, left, right, res = q.op, q.left_op, q.right_op, q.result
+        # Con algun limite (o cancel_token) corre por tandas y revisa los limites entre ellas
+        # sampler (SamplingProfiler) toma muestras de la pila entre tandas; ver sampling_profiler.py
+        governor = None
+        if self.jit is not None and (max_quads is not None or max_time is not None or sampler is not None):
+            # Una traza cuenta como un solo cuadruplo aunque corra miles de vueltas
+            raise ValueError("El JIT de trazas no se puede combinar con max_quads, max_time ni el profiler por muestreo")
+        if any(x is not None for x in (max_quads, max_time, max_stack_depth, max_cells, cancel_token)):
+            if sampler is not None:
+                # Los dos controlan las tandas de run_governed(); solo puede haber uno
+                raise ValueError("El profiler por muestreo no se puede combinar con límites de recursos")
+            if self.engine == 'switch' or self.profile is not None:
+                raise ValueError("Los límites de recursos requieren un motor enlazado sin instrumentación")
+            governor = ResourceGovernor(max_quads, max_time, max_stack_depth, max_cells,
+                                        cancel_token, check_interval)
+        elif sampler is not None:
+            if self.engine == 'switch' or self.profile is not None:
+                raise ValueError("El profiler por muestreo requiere un motor enlazado sin instrumentación")
+            governor = sampler
+        try:
+            if self.engine == 'switch':
+                self.run_switch()
+            elif governor is not None:
+                self.run_governed(governor)
+            elif self.profile is not None:
+                self.run_instrumented()
+            elif self.engine == 'closure':
+                self.run_closures()
+            else:
+                self.run_table()
+        finally:
+            # La salida pendiente se entrega aunque el programa falle
+            self.output.flush()
+
+    def run_table(self):
+        # Motor 'table': cada handler regresa el siguiente ip
+        code = self.code
+        ip = self.ip
+        # Cada handler regresa el siguiente ip, o None cuando el programa termina
+        try:
+            while ip is not None:
+                handler, left, right, res = code[ip]
+                ip = handler(ip, left, right, res)
+        finally:
+            # Si un handler falla, self.ip queda en el cuadruplo que fallo
+            if ip is not None:
+                self.ip = ip
+
+    def run_closures(self):
+        # Motor 'closure': cada cuadruplo ya es una funcion que regresa el siguiente ip
+        code = self.code
+        ip = self.ip
+        try:
+            while ip is not None:
+                ip = code[ip]()
+        finally:
+            if ip is not None:
+                self.ip = ip
+
+    def run_governed(self, governor):
+        # Igual que run_table/run_closures, por tandas de governor.next_slice() cuadruplos
+        code = self.code
+        closures = self.engine == 'closure'
+        ip = self.ip
+        governor.start()
+        try:
+            while ip is not None:
+                n = governor.next_slice(self, ip)
+                if closures:
+                    for _ in range(n):
+                        ip = code[ip]()
+                        if ip is None:
+                            break
+                else:
+                    for _ in range(n):
+                        handler, left, right, res = code[ip]
+                        ip = handler(ip, left, right, res)
+                        if ip is None:
+                            break
+                if ip is not None:
+                    governor.check(self, ip, n)
+        finally:
+            if ip is not None:
+                self.ip = ip
+
+    def run_slices(self, slice_size=4096):
+        # Generador: corre el programa por tandas de slice_size cuadruplos y se pausa (yield)
+        # entre tandas con self.ip al dia; termina cuando el programa termina
+        if self.engine == 'switch':
+            raise ValueError("La ejecución por tandas requiere un motor enlazado ('table' o 'closure')")
+        code = self.code
+        closures = self.engine == 'closure'
+        ip = self.ip
+        try:
+            while ip is not None:
+                if closures:
+                    for _ in range(slice_size):
+                        ip = code[ip]()
+                        if ip is None:
+                            break
+                else:
+                    for _ in range(slice_size):
+                        handler, left, right, res = code[ip]
+                        ip = handler(ip, left, right, res)
+                        if ip is None:
+                            break
+                if ip is not None:
+                    self.ip = ip
+                    yield
+        finally:
+            if ip is not None:
+                self.ip = ip
+
+    async def run_async(self, slice_size=4096):
+        # Como run(), pero cede el event loop entre tandas: varias VMs en el mismo hilo
+        # (asyncio.gather) avanzan por turnos de slice_size cuadruplos
+        try:
+            for _ in self.run_slices(slice_size):
+                await asyncio.sleep(0)
+        finally:
+            self.output.flush()
+
+    async def stream(self, slice_size=4096):
+        # Iterador asincrono de la salida de IMPRIME: despues de cada tanda entrega lo que se
+        # escribio en ella. La VM debe escribir a un BufferSink
+        if not isinstance(self.output, BufferSink):
+            raise ValueError("stream() requiere una VM creada con output=BufferSink()")
+        for _ in self.run_slices(slice_size):
+            text = self.output.take()
+            if text:
+                yield text
+            await asyncio.sleep(0)
+        text = self.output.take()
+        if text:
+            yield text
+
+    def live_cells(self):
+        # Celdas de memoria vivas: globales mas los frames de la pila, el actual y el de un ERA
+        cells = sum(self.program.global_sizes.values())
+        frames = [entry[0] for entry in self.call_stack] + [self.current_frame, self.next_frame]
+        return cells + sum(sum(frame.layout.sizes) for frame in frames if frame is not None)
+
+    def source_line(self, ip):
+        # Linea del fuente que genero el cuadruplo ip (None si el programa no trae mapa de lineas)
+        position = None
+        if isinstance(self.cuadruplos, QuadBuffer) and 0 <= ip < len(self.cuadruplos):
+            position = self.cuadruplos.position(ip)
+        return position[0] if position is not None else None
+
+    def stack_trace(self, ip):
+        # [(funcion, ip)] de la llamada mas externa a la actual; en los llamadores el ip es
+        # donde van a continuar cuando regrese la llamada
+        trace = [(frame.layout.name, ret_ip) for frame, ret_ip, _ in self.call_stack]
+        trace.append((self.current_frame.layout.name, ip))
+        return trace
+
+    def snapshot(self):
+        # Checkpoint binario del estado actual (ver snapshot.py); se reanuda con restore() + run()
+        return dump_state(self)
+
+    def restore(self, data):
+        load_state(self, data)
+
+    def run_instrumented(self):
+        # Igual que run_table/run_closures, contando cada cuadruplo; las entradas y salidas de
+        # funcion se detectan por el cambio de tamaño de la pila de llamadas
+        profile = self.profile
+        code = self.code
+        counts = profile.counts
+        stack = self.call_stack
+        closures = self.engine == 'closure'
+        tail_calls = {i for i, op in enumerate(profile.ops) if op == 'TAILCALL'}
+        taken = profile.taken
+        # Destino de cada salto condicional para contar cuantas veces se toma (None en los demas
+        # y en los que caen en el mismo cuadruplo que si no saltaran: no se cuentan)
+        targets = branch_targets(self.program.code) + [None]
+        clock = time.perf_counter
+        ip = self.ip
+        depth = len(stack)
+        start = clock()
+        profile.enter(self.current_frame.layout.name, start)
+        try:
+            while ip is not None:
+                counts[ip] += 1
+                if closures:
+                    nxt = code[ip]()
+                else:
+                    handler, left, right, res = code[ip]
+                    nxt = handler(ip, left, right, res)
+                if targets[ip] is not None and nxt == targets[ip]:
+                    taken[ip] += 1
+                if len(stack) != depth:
+                    if len(stack) > depth:
+                        profile.enter(self.current_frame.layout.name, clock())
+                    else:
+                        profile.leave(clock())
+                    depth = len(stack)
+                elif ip in tail_calls:
+                    profile.tail_call(profile.owners[ip])
+                ip = nxt
+        finally:
+            now = clock()
+            profile.finish(now)
+            profile.wall_time += now - start
+            if ip is not None:
+                self.ip = ip
+
+    # ------------------ Handlers (motor 'table') ------------------
+    # Los operandos ya vienen enlazados como (banco, slot); self.mem es la lista de bancos
+    def _op_assign(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_add(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] + mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_sub(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] - mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_mul(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] * mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_div(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] / mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_lt(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] < mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_gt(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] > mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_eq(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] == mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_ne(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] != mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_uminus(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = -mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_goto(self, ip, left, right, res):
+        return res
+
+    def _op_gotof(self, ip, left, right, res):
+        if not self.mem[left[0]][left[1]]:
+            return res
+        return ip + 1
+
+    def _op_imprime(self, ip, left, right, res):
+        self.write_output(str(self.mem[res[0]][res[1]]))
+        return ip + 1
+
+    def _op_imprime_bool(self, ip, left, right, res):
+        self.write_output(str(bool(self.mem[res[0]][res[1]])))
+        return ip + 1
+
+    def _op_era(self, ip, left, right, res):
+        # res es el FrameLayout de la funcion, resuelto por el linker
+        self.next_frame = res.acquire(self.frame_pools[res.index])
+        return ip + 1
+
+    def _op_param(self, ip, left, right, res):
+        # res es (banco del frame, slot) del parametro en la funcion llamada, resuelto por el linker
+        if self.next_frame is None:
+            raise RuntimeError("PARAM sin un ERA previo")
+
+        self.next_frame.banks[res[0]][res[1]] = self.mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_gosub(self, ip, left, right, res):
+        self.call_stack.append((self.current_frame, ip + 1, None))
+
+        if self.next_frame is None:
+            raise RuntimeError("GOSUB sin ERA previo")
+        self.current_frame = self.next_frame
+        self.mem[FRAME_BANKS] = self.current_frame.banks
+        self.next_frame = None
+
+        return res.start_quad
+
+    # Variantes de unchecked=True: el verificador ya garantizo el ERA previo
+    def _op_param_unchecked(self, ip, left, right, res):
+        self.next_frame.banks[res[0]][res[1]] = self.mem[left[0]][left[1]]
+        return ip + 1
+
+    def _op_gosub_unchecked(self, ip, left, right, res):
+        self.call_stack.append((self.current_frame, ip + 1, None))
+        self.current_frame = self.next_frame
+        self.mem[FRAME_BANKS] = self.current_frame.banks
+        self.next_frame = None
+        return res.start_quad
+
+    def _op_return(self, ip, left, right, res):
+        # left es el return_address de la funcion, resuelto por el linker
+        mem = self.mem
+        mem[left[0]][left[1]] = mem[res[0]][res[1]]
+        return ip + 1
+
+    def _op_endfunc(self, ip, left, right, res):
+        if not self.call_stack:
+            return None
+
+        callee = self.current_frame
+        self.current_frame, ret_ip, dest = self.call_stack.pop()
+        mem = self.mem
+        mem[FRAME_BANKS] = self.current_frame.banks
+        if dest is not None:
+            # CALL con destino: copia el valor de retorno al temporal del llamador
+            src = callee.layout.return_slot
+            mem[dest[0]][dest[1]] = mem[src[0]][src[1]]
+        # El frame de la funcion que termina regresa a su pool
+        pool = self.frame_pools[callee.layout.index]
+        if len(pool) < FRAME_POOL_SIZE:
+            pool.append(callee)
+        return ret_ip
+
+    # ------------------ Superinstrucciones ------------------
+    def _op_nop(self, ip, left, right, res):
+        return ip + 1
+
+    # GOTO_IF_NOT_xx: el siguiente cuadruplo es el NOP del GOTOF absorbido, se salta
+    def _op_goto_if_not_lt(self, ip, left, right, res):
+        mem = self.mem
+        if mem[left[0]][left[1]] < mem[right[0]][right[1]]:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_gt(self, ip, left, right, res):
+        mem = self.mem
+        if mem[left[0]][left[1]] > mem[right[0]][right[1]]:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_eq(self, ip, left, right, res):
+        mem = self.mem
+        if mem[left[0]][left[1]] == mem[right[0]][right[1]]:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_ne(self, ip, left, right, res):
+        mem = self.mem
+        if mem[left[0]][left[1]] != mem[right[0]][right[1]]:
+            return ip + 2
+        return res
+
+    def _op_call(self, ip, left, right, res):
+        # ERA + PARAMs + GOSUB (+ copia del retorno a right) en un solo cuadruplo
+        # res es (FrameLayout, ip de regreso); left son los movimientos de argumentos
+        # separados al decodificar en (de variables, de constantes)
+        layout, resume = res
+        moves, consts = left
+
+        mem = self.mem
+        frame = layout.acquire(self.frame_pools[layout.index])
+        banks = frame.banks
+        for pb, ps, ab, slot in moves:
+            banks[pb][ps] = mem[ab][slot]
+        for pb, ps, value in consts:
+            banks[pb][ps] = value
+
+        self.call_stack.append((self.current_frame, resume, right))
+        self.current_frame = frame
+        mem[FRAME_BANKS] = banks
+        return layout.start_quad
+
+    def _op_tailcall(self, ip, left, right, res):
+        # Recursion de cola: los argumentos se leen todos antes de limpiar el frame actual,
+        # que se reutiliza como el de la nueva llamada; la pila no cambia
+        moves, consts = left
+        mem = self.mem
+        values = [mem[ab][slot] for _, _, ab, slot in moves]
+        res.reset(self.current_frame)
+        banks = self.current_frame.banks
+        for (pb, ps, _, _), value in zip(moves, values):
+            banks[pb][ps] = value
+        for pb, ps, value in consts:
+            banks[pb][ps] = value
+        return res.start_quad
+
+    # ------------------ Operandos inmediatos ------------------
+    # right (o left en _op_k_xx) ya es el valor de la constante
+    def _op_assign_k(self, ip, left, right, res):
+        self.mem[res[0]][res[1]] = left
+        return ip + 1
+
+    def _op_add_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] + right
+        return ip + 1
+
+    def _op_sub_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] - right
+        return ip + 1
+
+    def _op_mul_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] * right
+        return ip + 1
+
+    def _op_div_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] / right
+        return ip + 1
+
+    def _op_lt_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] < right
+        return ip + 1
+
+    def _op_gt_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] > right
+        return ip + 1
+
+    def _op_eq_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] == right
+        return ip + 1
+
+    def _op_ne_k(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = mem[left[0]][left[1]] != right
+        return ip + 1
+
+    def _op_k_sub(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = left - mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_k_div(self, ip, left, right, res):
+        mem = self.mem
+        mem[res[0]][res[1]] = left / mem[right[0]][right[1]]
+        return ip + 1
+
+    def _op_goto_if_not_lt_k(self, ip, left, right, res):
+        if self.mem[left[0]][left[1]] < right:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_gt_k(self, ip, left, right, res):
+        if self.mem[left[0]][left[1]] > right:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_eq_k(self, ip, left, right, res):
+        if self.mem[left[0]][left[1]] == right:
+            return ip + 2
+        return res
+
+    def _op_goto_if_not_ne_k(self, ip, left, right, res):
+        if self.mem[left[0]][left[1]] != right:
+            return ip + 2
+        return res
+
+    def _op_imprime_k(self, ip, left, right, res):
+        # res es el texto de la constante
+        self.write_output(res)
+        return ip + 1
+
+    def _op_param_k(self, ip, left, right, res):
+        if self.next_frame is None:
+            raise RuntimeError("PARAM sin un ERA previo")
+
+        self.next_frame.banks[res[0]][res[1]] = left
+        return ip + 1
+
+    def _op_param_k_unchecked(self, ip, left, right, res):
+        self.next_frame.banks[res[0]][res[1]] = left
+        return ip + 1
+
+    def _op_return_k(self, ip, left, right, res):
+        self.mem[left[0]][left[1]] = res
+        return ip + 1
+
+    def _op_end(self, ip, left, right, res):
+        self.write_output('\n')
+        return None
+
+    def _op_halt(self, ip, left, right, res):
+        return None
+
+    def run_switch(self):
+        # Motor de referencia: cadena if/elif sobre los cuadruplos sin enlazar. Se pasan una vez
+        # a tuplas (op, izq, der, res) para no decodificar el QuadBuffer en cada paso
+        quads = [(q.op, q.left_op, q.right_op, q.result) for q in self.cuadruplos]
+        while self.ip < len(quads):
+            op, left, right, res = quads[self.ip]
 
 
             if op == '=':
@@ -140,7 +918,7 @@ class VirtualMachine:
                 # Dirección en result
                 value = self.read(res)
                 # Mas de 1 print en misma linea
-                print(value, end='')
+                self.write_output(str(value))
 
             # ------------------ Funciones ------------------
             elif op == 'ERA':
@@ -206,7 +984,7 @@ class VirtualMachine:
 
             # ------------------ END del programa ------------------
             elif op == 'END':
-                print()
+                self.write_output('\n')
                 return
 
             else: